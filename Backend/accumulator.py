@@ -0,0 +1,830 @@
+"""
+Single-writer accumulation of encrypted submissions, with group commit.
+
+Request threads hand validated ballots to submit(), which adds them
+homomorphically into an in-memory running sum per questionnaire shard and
+returns a Future. Each certificate fingerprint maps to one of the
+questionnaire's num_shards shards. Every questionnaire with pending ballots
+has one writer thread; besides it only explicit flush() calls (before
+decrypting) write the questionnaire's ballots. The writer appends the sum of everything pending for the questionnaire to
+CiphertextLog, together with the SubmissionRecord rows and the num_responses
+increment, in a single transaction, and then resolves the ballots' futures.
+Ballots arriving while a write is in progress go into the next one, so
+under load each transaction carries many ballots. No accumulator row is
+ever read, modified and written back on this path, so concurrent
+submissions cannot overwrite each other's ballots.
+
+Log entries are compacted into their AccumulatorShard checkpoint by the
+background thread once a shard has LOG_COMPACT_THRESHOLD entries, so reading
+the full sum never scans an unbounded log. Reading it (load_accumulated)
+sums checkpoints and log entries as coefficient arrays (see
+ciphertext_arrays.sum_arrays); only moduli too large for uint64 are split
+across a process pool.
+
+Questionnaires created with accumulator_storage 'coefficients' keep their
+sum in accumulator_coefficients instead, one row per coefficient, and each
+write adds into those rows in SQL (see coefficient_table). Those created
+with 'memmap' are written to the log like 'log' questionnaires; once the
+write commits, a process with a memory-mapped store attached also adds the
+group straight into the questionnaire's mapped running sum, and the store
+checkpoints it instead of shard compaction (see memmap_store and
+attach_memmap_store). Everything else here works the same for every storage.
+
+After the deadline the whole sum is finalized: modulus-switched down and
+stored compactly on the Questionnaire row in place of the accumulator,
+checkpoints and log (see modulus_switching and store_final_array).
+
+The num_responses increment of every write only matches a questionnaire
+whose sum is not finalized yet; ballots that reach the database after that
+fail with QuestionnaireClosedError instead of being ignored by the final sum.
+
+SubmissionRecord rows are unique per (questionnaire, fingerprint). If a group
+collides with a record written elsewhere (another process, or a race the
+in-memory checks missed), only the colliding ballots are dropped from its
+sum, their futures fail with DuplicateSubmissionError, and the write is
+retried; a fingerprint is never counted twice.
+
+A ballot whose future has resolved is in the database. A clean shutdown
+writes everything still pending (see stop()).
+"""
+
+import atexit
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import get_session_factory, Questionnaire, AccumulatorShard, CiphertextLog, SubmissionRecord
+from ciphertext_arrays import add_arrays, sum_arrays, pack_ciphertext_array, switch_modulus
+from serialization import ciphertexts_to_array, array_to_ciphertexts
+from coefficient_table import add_to_coefficients, load_coefficients, delete_coefficients
+from slot_packing import num_ciphertexts
+
+# Seconds a questionnaire's writer thread waits for new ballots before exiting
+WRITER_IDLE_TIMEOUT = 30.0
+
+# Seconds a writer waits before retrying a failed write
+WRITE_RETRY_DELAY = 1.0
+
+# Accumulator storages a questionnaire can be created with
+STORAGE_LOG = 'log'
+STORAGE_COEFFICIENTS = 'coefficients'
+STORAGE_MEMMAP = 'memmap'
+ACCUMULATOR_STORAGES = (STORAGE_LOG, STORAGE_COEFFICIENTS, STORAGE_MEMMAP)
+DEFAULT_ACCUMULATOR_STORAGE = STORAGE_LOG
+
+# Shard count for new questionnaires, and the allowed range
+DEFAULT_NUM_SHARDS = 4
+MAX_NUM_SHARDS = 64
+
+# Log entries per shard before they are folded into the shard checkpoint
+LOG_COMPACT_THRESHOLD = 64
+
+# Object-array reductions with at least this many parts are split across worker processes
+PARALLEL_REDUCE_MIN_PARTS = 32
+REDUCE_WORKERS = os.cpu_count() or 1
+
+_reduce_pool = None
+_reduce_pool_lock = threading.Lock()
+
+# MemmapStore holding the sums of 'memmap' questionnaires in this process, if any
+_memmap_store = None
+
+
+class DuplicateSubmissionError(Exception):
+    """Raised when a fingerprint already has a ballot waiting to be flushed."""
+
+
+class InvalidBallotError(ValueError):
+    """Raised when a ballot's ciphertexts do not fit its questionnaire's parameters."""
+
+
+class QuestionnaireClosedError(Exception):
+    """Raised for ballots that reach the database after their questionnaire's sum was finalized."""
+
+
+def shard_for(fingerprint, num_shards):
+    """Pick the accumulator shard for a certificate fingerprint."""
+    digest = hashlib.sha256(fingerprint.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') % max(num_shards or 1, 1)
+
+
+def params_of(questionnaire):
+    """BFV parameters of a questionnaire as a picklable tuple."""
+    return (questionnaire.poly_degree, questionnaire.plain_modulus, int(questionnaire.ciph_modulus))
+
+
+def ballot_array(questionnaire, ciphertexts):
+    """
+    Convert a ballot to a coefficient array, checking it fits the questionnaire.
+
+    Args:
+        questionnaire: Questionnaire the ballot is for
+        ciphertexts: List of Ciphertext laid out per slot_packing
+
+    Returns:
+        (ciphertexts, 2, poly_degree) array
+
+    Raises:
+        InvalidBallotError: If the ballot has the wrong number of ciphertexts,
+            a ring degree other than poly_degree, or a coefficient that is not
+            an integer in [0, ciph_modulus)
+    """
+    expected = num_ciphertexts(len(questionnaire.get_questions()), questionnaire.questions_per_ciphertext or 1)
+    return checked_ballot_array(ciphertexts, expected, questionnaire.poly_degree, questionnaire.ciph_modulus)
+
+
+def checked_ballot_array(ciphertexts, expected_ciphertexts, poly_degree, ciph_modulus):
+    """ballot_array for callers without the Questionnaire row, e.g. worker processes."""
+    if len(ciphertexts) != expected_ciphertexts:
+        raise InvalidBallotError(f'Expected {expected_ciphertexts} encrypted answers for this questionnaire')
+    ciph_modulus = int(ciph_modulus)
+    for ciphertext in ciphertexts:
+        for poly in (ciphertext.c0, ciphertext.c1):
+            coeffs = poly.coeffs
+            if not isinstance(coeffs, (list, tuple)) or len(coeffs) != poly_degree:
+                raise InvalidBallotError(f'Expected ring degree {poly_degree}')
+            if any(type(c) is not int for c in coeffs) or min(coeffs) < 0 or max(coeffs) >= ciph_modulus:
+                raise InvalidBallotError(f'Coefficients must be integers in [0, {ciph_modulus})')
+    return ciphertexts_to_array(ciphertexts, ciph_modulus)
+
+
+def _reduce_arrays(params, parts):
+    """Sum coefficient arrays mod ciph_modulus; runs in worker processes."""
+    return sum_arrays(parts, params[2])
+
+
+def _get_reduce_pool():
+    global _reduce_pool
+    with _reduce_pool_lock:
+        if _reduce_pool is None:
+            _reduce_pool = ProcessPoolExecutor(max_workers=REDUCE_WORKERS)
+        return _reduce_pool
+
+
+def reduce_parts(params, parts):
+    """
+    Sum ballots stored as coefficient arrays, in parallel for many Python-int arrays.
+    
+    Args:
+        params: (poly_degree, plain_modulus, ciph_modulus) tuple
+        parts: List of (ciphertexts, 2, degree) arrays
+    
+    Returns:
+        (ciphertexts, 2, degree) array, or None if parts is empty
+    """
+    if not parts:
+        return None
+    # uint64 sums are memory-bound and faster than shipping parts to workers;
+    # only Python-int (object) arrays are worth splitting across processes
+    if len(parts) >= PARALLEL_REDUCE_MIN_PARTS and parts[0].dtype == object:
+        pool = _get_reduce_pool()
+        num_chunks = min(REDUCE_WORKERS, len(parts) // 2)
+        size = -(-len(parts) // num_chunks)
+        chunks = [parts[i:i + size] for i in range(0, len(parts), size)]
+        parts = list(pool.map(_reduce_arrays, repeat(params), chunks))
+    return _reduce_arrays(params, parts)
+
+
+def attach_memmap_store(store):
+    """
+    Write and read the sums of 'memmap' questionnaires through store (a MemmapStore).
+
+    Only one process, the server, attaches the store. Processes without it,
+    e.g. the command-line tools, read those sums from the database: the
+    store's last checkpoint plus the log after it.
+    """
+    global _memmap_store
+    _memmap_store = store
+
+
+def load_accumulated_array(session, questionnaire):
+    """
+    Sum everything stored for a questionnaire into one coefficient array.
+    
+    Includes the legacy accumulator kept on the Questionnaire row, all shard
+    checkpoints and all log entries not yet compacted, or the coefficient rows
+    for 'coefficients' storage. Ballots still pending in an AccumulationBuffer
+    are not included. A finalized sum is switched
+    back up to ciph_modulus; decrypt it with load_decryptable_array instead.
+    
+    Returns:
+        (ciphertexts, 2, degree) array, or None if nothing has been stored yet
+    """
+    final = questionnaire.get_final_array()
+    if final is not None:
+        final_modulus, final_array = final
+        return switch_modulus(final_array, final_modulus, questionnaire.ciph_modulus)
+    
+    if questionnaire.accumulator_storage == STORAGE_COEFFICIENTS:
+        return load_coefficients(session, questionnaire)
+    if questionnaire.accumulator_storage == STORAGE_MEMMAP and _memmap_store is not None:
+        return _memmap_store.load(session, questionnaire)
+    
+    parts = []
+    legacy = questionnaire.get_accumulated_array()
+    if legacy is not None:
+        parts.append(legacy)
+    shards = session.query(AccumulatorShard).filter_by(
+        questionnaire_id=questionnaire.id
+    ).order_by(AccumulatorShard.shard_id).all()
+    parts.extend(shard.get_accumulated_array() for shard in shards if shard.accumulated_responses_blob)
+    entries = session.query(CiphertextLog).filter_by(
+        questionnaire_id=questionnaire.id
+    ).order_by(CiphertextLog.id).all()
+    parts.extend(entry.get_ciphertext_array() for entry in entries)
+    
+    return reduce_parts(params_of(questionnaire), parts)
+
+
+def load_accumulated(session, questionnaire):
+    """
+    Sum everything stored for a questionnaire (see load_accumulated_array).
+    
+    Returns:
+        list of Ciphertext, or None if nothing has been stored yet
+    """
+    total = load_accumulated_array(session, questionnaire)
+    if total is None:
+        return None
+    return array_to_ciphertexts(total)
+
+
+def load_decryptable_array(session, questionnaire):
+    """
+    The stored sum with the parameters to decrypt it under.
+    
+    A finalized sum is returned as stored, at its smaller modulus.
+    
+    Returns:
+        (params, array), or None if nothing has been stored yet
+    """
+    final = questionnaire.get_final_array()
+    if final is not None:
+        final_modulus, final_array = final
+        return (questionnaire.poly_degree, questionnaire.plain_modulus, final_modulus), final_array
+    total = load_accumulated_array(session, questionnaire)
+    if total is None:
+        return None
+    return params_of(questionnaire), total
+
+
+def last_log_id(session, questionnaire_id):
+    """Highest CiphertextLog id of a questionnaire, or 0 if its log is empty."""
+    return session.query(func.max(CiphertextLog.id)).filter_by(questionnaire_id=questionnaire_id).scalar() or 0
+
+
+def store_final_array(session, questionnaire, ciph_modulus, array, max_log_id):
+    """
+    Replace everything stored for a questionnaire's sum with its finalized form.
+    
+    Deletes the shard checkpoints, the log entries up to max_log_id (the last
+    one summed into array, see last_log_id) and the coefficient rows; the
+    caller commits. The memmap slot is released by the store's next
+    checkpoint, once the finalized sum is committed. Writes committed after the
+    finalized sum are refused (see AccumulationBuffer), so the caller only
+    has to check that num_responses did not change since the sum was read.
+    """
+    questionnaire.set_final_array(ciph_modulus, array)
+    delete_coefficients(session, questionnaire.id)
+    session.query(AccumulatorShard).filter_by(questionnaire_id=questionnaire.id).delete(synchronize_session=False)
+    session.query(CiphertextLog).filter(
+        CiphertextLog.questionnaire_id == questionnaire.id,
+        CiphertextLog.id <= max_log_id
+    ).delete(synchronize_session=False)
+
+
+def accumulator_version(questionnaire, total):
+    """
+    Identify the accumulated sum a set of decrypted results was computed from.
+    
+    Args:
+        questionnaire: Questionnaire the sum belongs to
+        total: Array returned by load_accumulated_array
+    
+    Returns:
+        str: '<num_responses>:<sha256 of the packed sum>'
+    """
+    digest = hashlib.sha256(pack_ciphertext_array(total)).hexdigest()
+    return f'{questionnaire.num_responses}:{digest}'
+
+
+def compact_log(session, questionnaire_id, shard_id, params):
+    """
+    Fold a shard's log entries into its checkpoint.
+    
+    Only entries present when compaction starts are folded and deleted, so
+    entries appended concurrently stay in the log for the next round. The
+    caller commits.
+    
+    Returns:
+        int: Number of log entries folded
+    """
+    entries = session.query(CiphertextLog).filter_by(
+        questionnaire_id=questionnaire_id,
+        shard_id=shard_id
+    ).order_by(CiphertextLog.id).all()
+    if not entries:
+        return 0
+    
+    shard = session.query(AccumulatorShard).filter_by(
+        questionnaire_id=questionnaire_id,
+        shard_id=shard_id
+    ).first()
+    if shard is None:
+        shard = AccumulatorShard(questionnaire_id=questionnaire_id, shard_id=shard_id, num_responses=0)
+        session.add(shard)
+    
+    parts = [entry.get_ciphertext_array() for entry in entries]
+    if shard.accumulated_responses_blob:
+        parts.insert(0, shard.get_accumulated_array())
+    shard.set_accumulated_array(reduce_parts(params, parts))
+    shard.num_responses += sum(entry.num_ballots for entry in entries)
+    
+    session.query(CiphertextLog).filter(
+        CiphertextLog.id.in_([entry.id for entry in entries])
+    ).delete(synchronize_session=False)
+    return len(entries)
+
+
+class PendingGroup:
+    """
+    Running homomorphic sum of the ballots not yet written for one questionnaire shard.
+
+    The sum is kept as a (ciphertexts, 2, degree) coefficient array, so adding a
+    ballot is one vectorized operation instead of a BFVEvaluator.add per question.
+    The ballots themselves are kept alongside, with the Future of each, so a
+    fingerprint that turns out to be recorded already can be taken out.
+    """
+
+    def __init__(self, questionnaire, shard_id):
+        self.questionnaire_id = questionnaire.id
+        self.storage = questionnaire.accumulator_storage or STORAGE_LOG
+        self.shard_id = shard_id
+        self.params = params_of(questionnaire)
+        self.array = None
+        self.fingerprints = []
+        self.ballots = []
+        self.futures = []
+        self.created = time.monotonic()
+        self.closed = False  # set once its ballots were refused by a finalized questionnaire
+
+    def add(self, ballot, fingerprint, future=None):
+        """Add one ballot (an array from ballot_array) to the sum."""
+        if self.array is None:
+            self.array = ballot.copy()
+        else:
+            add_arrays(ballot, self.array, self.params[2], out=self.array)
+        self.fingerprints.append(fingerprint)
+        self.ballots.append(ballot)
+        self.futures.append(future)
+
+    def merge(self, other):
+        """Fold another group for the same questionnaire into this one."""
+        if self.array is None:
+            self.array = other.array
+        elif other.array is not None:
+            self.array = add_arrays(self.array, other.array, self.params[2])
+        self.fingerprints.extend(other.fingerprints)
+        self.ballots.extend(other.ballots)
+        self.futures.extend(other.futures)
+        self.created = min(self.created, other.created)
+
+    def discard(self, fingerprints):
+        """Take the ballots of the given fingerprints out of the group and re-sum the rest."""
+        kept = []
+        for fp, ballot, future in zip(self.fingerprints, self.ballots, self.futures):
+            if fp not in fingerprints:
+                kept.append((fp, ballot, future))
+            elif future is not None and not future.done():
+                future.set_exception(DuplicateSubmissionError(fp))
+        self.fingerprints = [fp for fp, _, _ in kept]
+        self.ballots = [ballot for _, ballot, _ in kept]
+        self.futures = [future for _, _, future in kept]
+        self.array = sum_arrays(self.ballots, self.params[2])
+
+    def reject(self, error):
+        """Fail every ballot in the group with error and empty it."""
+        for future in self.futures:
+            if future is not None and not future.done():
+                future.set_exception(error)
+        self.fingerprints, self.ballots, self.futures = [], [], []
+        self.array = None
+
+    def resolve(self):
+        """Mark every ballot in the group as written."""
+        for future in self.futures:
+            if future is not None and not future.done():
+                future.set_result(True)
+
+
+class AccumulationBuffer:
+    """
+    In-memory per-questionnaire accumulator with one writer thread per questionnaire.
+
+    Groups are keyed by (questionnaire link, shard id). A questionnaire's
+    writer starts with its first pending ballot and exits after idle_timeout
+    seconds without any. flush() can also be called directly, e.g. before
+    decrypting; per-shard flush locks keep it and the writer from writing the
+    same shard at once.
+    """
+
+    def __init__(self, db_url, compact_threshold=LOG_COMPACT_THRESHOLD, submission_filter=None,
+                 idle_timeout=WRITER_IDLE_TIMEOUT, retry_delay=WRITE_RETRY_DELAY):
+        self.db_url = db_url
+        self.submission_filter = submission_filter  # SubmissionFilter told about every written fingerprint
+        self.compact_threshold = compact_threshold
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._flush_locks = {}  # (link, shard) -> Lock, one writer per shard row
+        self._groups = {}       # (link, shard) -> PendingGroup still collecting ballots
+        self._flushing = {}     # (link, shard) -> [PendingGroup] being written right now
+        self._compact_due = {}  # (link, shard) -> (questionnaire_id, params) with a long log
+        self._writers = {}      # link -> (Condition on _lock, writer Thread)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def submit(self, questionnaire, ciphertexts, fingerprint):
+        """
+        Add a ballot to the questionnaire's pending sum.
+
+        Returns:
+            Future: Resolves to True once the ballot is in the database, or
+            fails with DuplicateSubmissionError if its fingerprint turns out
+            to be recorded already, or QuestionnaireClosedError if the
+            questionnaire's sum was finalized before it could be written
+
+        Raises:
+            InvalidBallotError: If the ballot does not fit the questionnaire (see ballot_array)
+            DuplicateSubmissionError: If the fingerprint is already pending
+        """
+        # Checked before the lock, so a malformed ballot never reaches a shared sum
+        ballot = ballot_array(questionnaire, ciphertexts)
+        shard_id = shard_for(fingerprint, questionnaire.num_shards)
+        key = (questionnaire.link, shard_id)
+        future = Future()
+        with self._lock:
+            if self._stopped.is_set():
+                raise RuntimeError('Accumulation buffer is stopped')
+            if self._is_pending_locked(key, fingerprint):
+                raise DuplicateSubmissionError(fingerprint)
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = PendingGroup(questionnaire, shard_id)
+            group.add(ballot, fingerprint, future)
+            self._wake_writer_locked(questionnaire.link)
+
+        self._ensure_started()
+        return future
+
+    def is_pending(self, questionnaire, fingerprint):
+        """Return True if the fingerprint has a ballot that is not yet in the database."""
+        key = (questionnaire.link, shard_for(fingerprint, questionnaire.num_shards))
+        with self._lock:
+            return self._is_pending_locked(key, fingerprint)
+
+    def pending_count(self, link):
+        """Number of ballots for a questionnaire that are not yet in the database."""
+        with self._lock:
+            groups = [g for key, g in self._groups.items() if key[0] == link]
+            groups += [g for key, gs in self._flushing.items() if key[0] == link for g in gs]
+            return sum(len(g.fingerprints) for g in groups)
+
+    def flush(self, link=None):
+        """
+        Write pending sums to the database in a single transaction.
+
+        Also waits for writes already in progress, so once this returns every
+        ballot submitted before the call is in the database.
+
+        Args:
+            link: Flush only this questionnaire (default: all of them)
+
+        Returns:
+            int: Number of ballots written by this call
+        """
+        with self._lock:
+            # Shards being written right now are included so their flush locks are waited for
+            keys = sorted(key for key in set(self._groups) | set(self._flushing) if link is None or key[0] == link)
+            locks = [self._flush_locks.setdefault(key, threading.Lock()) for key in keys]
+
+        # Locks are taken in key order so concurrent flushes cannot deadlock
+        for lock in locks:
+            lock.acquire()
+        try:
+            with self._lock:
+                groups = [(key, self._groups.pop(key)) for key in keys if key in self._groups]
+                for key, group in groups:
+                    self._flushing.setdefault(key, []).append(group)
+
+            if not groups:
+                return 0
+
+            try:
+                long_logs = self._write(groups)
+            except Exception:
+                self._requeue(groups)
+                raise
+            finally:
+                with self._lock:
+                    for key, group in groups:
+                        self._flushing[key].remove(group)
+                        if not self._flushing[key]:
+                            del self._flushing[key]
+
+            for _, group in groups:
+                group.resolve()
+            if long_logs:
+                with self._lock:
+                    self._compact_due.update(long_logs)
+                self._wakeup.set()
+
+            return sum(len(group.fingerprints) for _, group in groups)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def write_batch(self, questionnaire, ballots):
+        """
+        Sum a batch of validated ballots in memory and write it in one transaction.
+
+        Unlike submit(), the ballots are in the database when this returns.
+        Fingerprints already waiting in the buffer are left out.
+
+        Args:
+            questionnaire: Questionnaire the ballots are for
+            ballots: list of (fingerprint, ballot array from ballot_array) pairs with distinct fingerprints
+
+        Returns:
+            set: Fingerprints whose ballots were written
+
+        Raises:
+            QuestionnaireClosedError: If the questionnaire's sum was finalized, so nothing was written
+        """
+        by_key = {}
+        for fingerprint, ballot in ballots:
+            shard_id = shard_for(fingerprint, questionnaire.num_shards)
+            by_key.setdefault((questionnaire.link, shard_id), []).append((fingerprint, ballot))
+
+        with self._lock:
+            keys = sorted(by_key)
+            locks = [self._flush_locks.setdefault(key, threading.Lock()) for key in keys]
+
+        for lock in locks:
+            lock.acquire()
+        try:
+            groups = []
+            with self._lock:
+                for key in keys:
+                    group = PendingGroup(questionnaire, key[1])
+                    items = [(fp, ballot) for fp, ballot in by_key[key] if not self._is_pending_locked(key, fp)]
+                    # Reserve the fingerprints so a concurrent submit() sees them as pending
+                    group.fingerprints = [fp for fp, _ in items]
+                    group.ballots = [ballot for _, ballot in items]
+                    group.futures = [None] * len(items)
+                    if items:
+                        self._flushing.setdefault(key, []).append(group)
+                        groups.append((key, group))
+
+            try:
+                for _, group in groups:
+                    group.array = sum_arrays(group.ballots, group.params[2])
+                long_logs = self._write(groups) if groups else {}
+            finally:
+                with self._lock:
+                    for key, group in groups:
+                        self._flushing[key].remove(group)
+                        if not self._flushing[key]:
+                            del self._flushing[key]
+
+            if long_logs:
+                with self._lock:
+                    self._compact_due.update(long_logs)
+                self._ensure_started()
+                self._wakeup.set()
+
+            if any(group.closed for _, group in groups):
+                raise QuestionnaireClosedError(questionnaire.link)
+            return {fp for _, group in groups for fp in group.fingerprints}
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def compact(self):
+        """
+        Fold long shard logs into their checkpoints.
+        
+        Called from the background thread only, so checkpoints have a single writer.
+        """
+        with self._lock:
+            due, self._compact_due = self._compact_due, {}
+        
+        for key, (questionnaire_id, params) in sorted(due.items()):
+            session = get_session_factory(self.db_url).session_factory()
+            try:
+                compact_log(session, questionnaire_id, key[1], params)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                print(f"Error compacting log for {key[0]} shard {key[1]}: {e}")
+            finally:
+                session.close()
+
+    def stop(self):
+        """Stop the writers and the compaction thread, and write everything still pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        with self._lock:
+            writers = list(self._writers.values())
+            for wakeup, _ in writers:
+                wakeup.notify()
+        for _, thread in writers:
+            thread.join()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _is_pending_locked(self, key, fingerprint):
+        groups = self._flushing.get(key, []) + ([self._groups[key]] if key in self._groups else [])
+        return any(fingerprint in g.fingerprints for g in groups)
+
+    def _write(self, groups):
+        """
+        Append each group to the log; returns the shards whose log is due for compaction.
+        
+        Ballots whose fingerprint is already recorded are dropped from their
+        group (and from group.fingerprints) before the groups are written.
+        """
+        while True:
+            try:
+                long_logs = self._write_once(groups)
+                break
+            except IntegrityError:
+                if not self._discard_recorded(groups):
+                    raise
+        
+        if self.submission_filter is not None:
+            for _, group in groups:
+                self.submission_filter.add(group.questionnaire_id, group.fingerprints)
+        return long_logs
+
+    def _discard_recorded(self, groups):
+        """Drop ballots whose fingerprints have a SubmissionRecord; returns how many were dropped."""
+        session = get_session_factory(self.db_url).session_factory()
+        try:
+            dropped = 0
+            for _, group in groups:
+                if not group.fingerprints:
+                    continue
+                recorded = {fingerprint for (fingerprint,) in session.query(SubmissionRecord.cert_fingerprint).filter(
+                    SubmissionRecord.questionnaire_id == group.questionnaire_id,
+                    SubmissionRecord.cert_fingerprint.in_(group.fingerprints)
+                )}
+                if recorded:
+                    group.discard(recorded)
+                    dropped += len(recorded)
+                    print(f"Dropped {len(recorded)} ballots already recorded for questionnaire {group.questionnaire_id}")
+            return dropped
+        finally:
+            session.close()
+
+    def _write_once(self, groups):
+        long_logs = {}
+        closed = []
+        store = _memmap_store
+        logged = []
+        session = get_session_factory(self.db_url).session_factory()
+        try:
+            for key, group in groups:
+                if not group.fingerprints:
+                    continue
+
+                # Atomic increment, so the questionnaire row is never read-modify-written.
+                # It only matches while the sum is not finalized: a finalized sum
+                # would silently ignore anything written after it.
+                updated = session.query(Questionnaire).filter(
+                    Questionnaire.id == group.questionnaire_id,
+                    Questionnaire.final_accumulator_blob.is_(None)
+                ).update(
+                    {Questionnaire.num_responses: Questionnaire.num_responses + len(group.fingerprints)},
+                    synchronize_session=False
+                )
+                if not updated:
+                    closed.append((key, group))
+                    continue
+
+                if group.storage == STORAGE_COEFFICIENTS:
+                    add_to_coefficients(session, group.questionnaire_id, group.params[2], group.array)
+                else:
+                    entry = CiphertextLog(
+                        questionnaire_id=group.questionnaire_id,
+                        shard_id=group.shard_id,
+                        num_ballots=len(group.fingerprints)
+                    )
+                    entry.set_ciphertext_array(group.array)
+                    session.add(entry)
+                    if group.storage == STORAGE_MEMMAP and store is not None:
+                        logged.append((group, entry))
+                session.add_all([
+                    SubmissionRecord(questionnaire_id=group.questionnaire_id, cert_fingerprint=fingerprint)
+                    for fingerprint in group.fingerprints
+                ])
+
+                # Only 'log' storage compacts into shards; memmap logs are checkpointed by the store
+                if group.storage != STORAGE_LOG:
+                    continue
+                log_length = session.query(func.count(CiphertextLog.id)).filter_by(
+                    questionnaire_id=group.questionnaire_id,
+                    shard_id=group.shard_id
+                ).scalar()
+                if log_length >= self.compact_threshold:
+                    long_logs[key] = (group.questionnaire_id, group.params)
+
+            session.flush()
+            entry_ids = [entry.id for _, entry in logged]
+            session.commit()
+            # Only committed entries reach the slots, so a slot never holds a ballot the database lacks
+            for (group, _), entry_id in zip(logged, entry_ids):
+                try:
+                    store.add(session, group.questionnaire_id, entry_id, group.array, len(group.fingerprints))
+                except Exception as e:
+                    # The ballots are committed: rebuild the slot from the database rather than retry the write
+                    print(f"Error adding to accumulator file: {e}")
+                    store.invalidate(group.questionnaire_id)
+            for key, group in closed:
+                print(f"Rejected {len(group.fingerprints)} ballots for {key[0]}: its sum is already finalized")
+                group.closed = True
+                group.reject(QuestionnaireClosedError(key[0]))
+            return long_logs
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _requeue(self, groups):
+        """Put groups back after a failed write so their ballots are not lost."""
+        with self._lock:
+            for key, group in groups:
+                newer = self._groups.get(key)
+                if newer is not None:
+                    group.merge(newer)
+                self._groups[key] = group
+            for link in {key[0] for key, _ in groups}:
+                self._wake_writer_locked(link)
+
+    def _wake_writer_locked(self, link):
+        """Notify the questionnaire's writer, starting one if it has none."""
+        writer = self._writers.get(link)
+        if writer is not None:
+            writer[0].notify()
+            return
+        wakeup = threading.Condition(self._lock)
+        thread = threading.Thread(target=self._write_loop, args=(link, wakeup), daemon=True)
+        self._writers[link] = (wakeup, thread)
+        thread.start()
+
+    def _write_loop(self, link, wakeup):
+        """Writer thread of one questionnaire: write whatever is pending, one transaction at a time."""
+        while True:
+            with self._lock:
+                idle_since = time.monotonic()
+                while not any(key[0] == link for key in self._groups):
+                    idle = time.monotonic() - idle_since
+                    if self._stopped.is_set() or idle >= self.idle_timeout:
+                        # Leaves under the lock, so a submit() either sees this writer or starts a new one
+                        del self._writers[link]
+                        return
+                    wakeup.wait(self.idle_timeout - idle)
+
+            try:
+                self.flush(link)
+            except Exception as e:
+                print(f"Error writing pending responses for {link}: {e}")
+                if self._stopped.wait(self.retry_delay):
+                    with self._lock:
+                        del self._writers[link]
+                    return
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        """Compaction thread: folds long shard logs whenever a write reports one."""
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.compact()
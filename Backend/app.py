@@ -9,22 +9,35 @@ import os
 # Add py-fhe to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'py-fhe'))
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from datetime import datetime, timezone
+import base64
+import hashlib
 import json
 import ssl
-
-from models import init_db, get_session, Questionnaire, SubmissionRecord
-from bfv.bfv_evaluator import BFVEvaluator
-from bfv.bfv_parameters import BFVParameters
-from bfv.bfv_decryptor import BFVDecryptor
-from bfv.batch_encoder import BatchEncoder
-from util.ciphertext import Ciphertext
-from util.polynomial import Polynomial
-from util.secret_key import SecretKey
-import threading
-import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from sqlalchemy.orm import object_session, load_only
+
+from models import (init_db, get_session, remove_session, Questionnaire, SubmissionRecord, public_key_digest,
+                    questionnaire_list_query, questionnaire_list_page, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE)
+from serialization import (deserialize_polynomial, serialize_ciphertext, deserialize_ciphertext,
+                           decode_ballot, BALLOT_MIME_TYPE)
+from accumulator import (AccumulationBuffer, DuplicateSubmissionError, InvalidBallotError, QuestionnaireClosedError,
+                         ballot_array, load_decryptable_array, accumulator_version, DEFAULT_NUM_SHARDS, MAX_NUM_SHARDS,
+                         attach_memmap_store, ACCUMULATOR_STORAGES, DEFAULT_ACCUMULATOR_STORAGE,
+                         STORAGE_LOG, STORAGE_COEFFICIENTS, STORAGE_MEMMAP)
+from coefficient_table import supports as coefficient_storage_supports, init_coefficients
+from memmap_store import MemmapStore, supports as memmap_storage_supports
+from response_cache import ResponseCache
+from slot_packing import num_ciphertexts, OPTIONS_PER_QUESTION
+from crypto_context import context_for, resolve_parameters, secret_keys, PROFILES
+from deadline_scheduler import DeadlineScheduler
+from decryption_service import DecryptionService, decrypt_votes, format_results
+from keypair_pool import KeypairPool
+from submission_filter import SubmissionFilter
+from ballot_signatures import BallotVerifier, ballot_digest
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend requests
@@ -33,124 +46,134 @@ CORS(app)  # Enable CORS for frontend requests
 DB_URL = 'sqlite:///questionnaires.db'
 engine, Session = init_db(DB_URL)
 
+# Fingerprints that have submitted, so first-time voters skip the duplicate lookup
+submission_filter = SubmissionFilter()
 
-def serialize_polynomial(poly):
-    """Serialize a Polynomial object to JSON."""
-    return {
-        'ring_degree': poly.ring_degree,
-        'coeffs': poly.coeffs
-    }
+# Ballots are summed in memory and written by one writer thread per questionnaire
+accumulation_buffer = AccumulationBuffer(DB_URL, submission_filter=submission_filter)
 
+# Seconds a submission waits for its ballot to be written before answering 202
+SUBMIT_TIMEOUT = 10.0
 
-def deserialize_polynomial(data):
-    """Deserialize a Polynomial from JSON."""
-    # Support both camelCase (from JS) and snake_case
-    ring_degree = data.get('ring_degree') or data.get('ringDegree')
-    return Polynomial(ring_degree, data['coeffs'])
+# Running sums of open 'memmap' questionnaires, mapped from this file by the
+# serving process only (see open_memmap_store); processes that just import
+# this module, like the decryption and import workers, never map it
+MEMMAP_PATH = 'accumulators.mmap'
+memmap_store = None
 
 
-def serialize_ciphertext(ciph):
-    """Serialize a Ciphertext object to JSON."""
-    return {
-        'c0': serialize_polynomial(ciph.c0),
-        'c1': serialize_polynomial(ciph.c1),
-        'scaling_factor': ciph.scaling_factor,
-        'modulus': ciph.modulus
-    }
-def deserialize_ciphertext(data):
-    """Deserialize a Ciphertext from JSON."""
-    c0 = deserialize_polynomial(data['c0'])
-    c1 = deserialize_polynomial(data['c1'])
-    # Support both camelCase and snake_case
-    scaling_factor = data.get('scaling_factor') or data.get('scalingFactor')
-    return Ciphertext(c0, c1, scaling_factor, data.get('modulus'))
+def open_memmap_store():
+    """Map the accumulator file in this process and write 'memmap' ballots into it."""
+    global memmap_store
+    if memmap_store is None:
+        memmap_store = MemmapStore(DB_URL, MEMMAP_PATH)
+        attach_memmap_store(memmap_store)
+    return memmap_store
+
+
+def memmap_store_stats():
+    """Stats of the accumulator file, or None if this process has not mapped it."""
+    return memmap_store.stats() if memmap_store is not None else None
+
+
+# Keypairs generated ahead of time for new questionnaires
+keypair_pool = KeypairPool(DB_URL)
+
+# Serialized /results bodies, keyed by the accumulator version they show
+results_cache = ResponseCache()
+
+# Public keys are two full polynomials each, so fewer of them are kept
+PUBLIC_KEY_CACHE_SIZE = 64
+
+# Questionnaire documents and public keys never change after creation, so their
+# serialized bodies are cached without a version: link -> (etag, body), key id -> body
+document_cache = ResponseCache()
+public_key_cache = ResponseCache(max_entries=PUBLIC_KEY_CACHE_SIZE)
+
+# Clients revalidate documents (cheap 304s) and keep content-addressed keys forever
+DOCUMENT_CACHE_CONTROL = 'no-cache'
+PUBLIC_KEY_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Voter signatures on ballots uploaded by relays
+ballot_verifier = BallotVerifier()
+
+# Largest relayed batch accepted in one request
+MAX_BATCH_BALLOTS = 1000
+
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """Release the request thread's session back to the shared pool."""
+    remove_session(DB_URL)
 
 
 def decrypt_questionnaire(questionnaire):
-    """Decrypt accumulated responses for a questionnaire."""
+    """
+    Decrypt accumulated responses for a questionnaire.
+    
+    Results are stored with the accumulator version they were decrypted from
+    and reused until new ballots change it. Results decrypted after the
+    deadline are final and never decrypted again. The caller commits.
+    """
     try:
-        # Check if already decrypted
+        # Final results never change
         if questionnaire.is_decrypted:
             print(f"Questionnaire {questionnaire.link} already decrypted")
             return True
         
+        # Include ballots still waiting in the write-behind buffer
+        if accumulation_buffer.flush(questionnaire.link):
+            object_session(questionnaire).commit()
+        
         # Check if has responses
         if questionnaire.num_responses == 0:
             print(f"Questionnaire {questionnaire.link} has no responses to decrypt")
             return False
         
-        print(f"Decrypting questionnaire {questionnaire.link}...")
-        
-        # Get parameters
-        params = BFVParameters(
-            poly_degree=questionnaire.poly_degree,
-            plain_modulus=questionnaire.plain_modulus,
-            ciph_modulus=int(questionnaire.ciph_modulus)
-        )
-        
-        # Reconstruct secret key
-        secret_key_data = questionnaire.get_secret_key()
-        secret_key_poly = Polynomial(secret_key_data['ring_degree'], secret_key_data['coeffs'])
-        secret_key = SecretKey(secret_key_poly)
-        
-        # Create decryptor and encoder
-        decryptor = BFVDecryptor(params, secret_key)
-        encoder = BatchEncoder(params)
+        deadline = questionnaire.deadline
+        if deadline.tzinfo is None:
+            deadline = deadline.replace(tzinfo=timezone.utc)
+        is_final = datetime.now(timezone.utc) > deadline
         
-        # Get accumulated responses
-        accumulated = questionnaire.get_accumulated_responses()
-        questions = questionnaire.get_questions()
+        # Get accumulated responses (sum of all shards, or the finalized sum)
+        decryptable = load_decryptable_array(object_session(questionnaire), questionnaire)
         
-        if not accumulated:
+        if decryptable is None:
             print(f"Questionnaire {questionnaire.link} has no accumulated responses")
             return False
+        params, accumulated_array = decryptable
         
-        # Decrypt and format results
-        results = []
+        # Nothing new since the last decryption
+        version = accumulator_version(questionnaire, accumulated_array)
+        if version == questionnaire.results_version and questionnaire.decrypted_results_json:
+            questionnaire.is_decrypted = 1 if is_final else 0
+            return True
+        
+        print(f"Decrypting questionnaire {questionnaire.link}...")
+        
+        # Decrypt and format results; each ciphertext may carry several questions in its slots
         print(f"\n{'='*40}")
         print(f"🔓 DESCIFRANDO RESULTADOS")
         print(f"{'='*40}")
+        print(f"Ciphertexts: {accumulated_array.shape[0]} x ring_degree={questionnaire.poly_degree}")
+        questions = questionnaire.get_questions()
+        question_votes = decrypt_votes(
+            params, questionnaire.secret_key_json, accumulated_array,
+            len(questions), questionnaire.questions_per_ciphertext or 1
+        )
+        results = format_results(questions, question_votes, questionnaire.num_responses)
         
-        for i, (question, ciph_data) in enumerate(zip(questions, accumulated)):
+        for i, (question, votes) in enumerate(zip(questions, question_votes)):
             print(f"\n--- Pregunta {i+1}: {question['text']} ---")
-            
-            # Deserialize and decrypt
-            ciphertext = deserialize_ciphertext(ciph_data)
-            print(f"Ciphertext: c0.ring_degree={ciphertext.c0.ring_degree}")
-            
-            plaintext = decryptor.decrypt(ciphertext)
-            print(f"Plaintext descifrado (coeffs): {plaintext.poly.coeffs}")
-            
-            decoded = encoder.decode(plaintext)
-            print(f"Valores decodificados: {decoded}")
-            
-            # Filter out N/A options
-            options_results = []
-            for j, option in enumerate(question['options']):
-                votes = int(decoded[j])
-                
-                # Skip N/A options completely
-                if option.strip().upper() == 'N/A':
-                    continue
-                
-                percentage = (votes / questionnaire.num_responses * 100) if questionnaire.num_responses > 0 else 0
-                options_results.append({
-                    'option': option,
-                    'votes': votes,
-                    'percentage': round(percentage, 2)
-                })
-            
-            results.append({
-                'question': question['text'],
-                'results': options_results
-            })
-            
+            print(f"Valores decodificados: {votes}")
             print(f"Resultados finales pregunta {i+1}:")
-            for opt_result in options_results:
+            for opt_result in results[i]['results']:
                 print(f"  {opt_result['option']}: {opt_result['votes']} votos ({opt_result['percentage']}%)")
         
-        # Store decrypted results
-        questionnaire.set_decrypted_results(results)
+        # Store decrypted results; final results never need the key in this process again
+        questionnaire.set_decrypted_results(results, version=version, final=is_final)
+        if is_final:
+            secret_keys.discard(params, questionnaire.secret_key_json)
         
         print(f"\n{'='*40}")
         print(f"✓ Questionnaire {questionnaire.link} decrypted successfully")
@@ -164,49 +187,14 @@ def decrypt_questionnaire(questionnaire):
         return False
 
 
-def check_expired_questionnaires():
-    """Background task to check and decrypt expired questionnaires."""
-    print("\n🔍 Starting automatic decryption service...")
-    
-    while True:
-        try:
-            time.sleep(60)  # Check every 60 seconds
-            
-            session = get_session(DB_URL)
-            
-            try:
-                # Find expired questionnaires that haven't been decrypted yet
-                now = datetime.now(timezone.utc)
-                questionnaires = session.query(Questionnaire).filter(
-                    Questionnaire.is_decrypted == 0,
-                    Questionnaire.num_responses > 0
-                ).all()
-                
-                for q in questionnaires:
-                    # Make deadline timezone-aware if needed
-                    deadline = q.deadline
-                    if deadline.tzinfo is None:
-                        deadline = deadline.replace(tzinfo=timezone.utc)
-                    
-                    # Check if expired
-                    if now > deadline:
-                        print(f"\n⏰ Questionnaire {q.link} has expired. Decrypting...")
-                        
-                        if decrypt_questionnaire(q):
-                            session.commit()
-                            print(f"✓ Results saved to database for {q.link}")
-                        else:
-                            session.rollback()
-                
-            except Exception as e:
-                print(f"Error in expiration check: {e}")
-                session.rollback()
-            finally:
-                session.close()
-                
-        except Exception as e:
-            print(f"Error in background task: {e}")
-            time.sleep(60)
+def retry_decryption(link):
+    """Try a failed final decryption again later."""
+    deadline_scheduler.retry(link)
+
+
+# Final decryptions run in worker processes, queued when each deadline passes
+decryption_service = DecryptionService(DB_URL, accumulation_buffer, on_failure=retry_decryption)
+deadline_scheduler = DeadlineScheduler(DB_URL, decryption_service.submit)
 
 
 @app.route('/')
@@ -224,43 +212,75 @@ def serve_static(filename):
         return send_from_directory('../Frontend/dist', 'index.html')
 
 
+def questionnaire_document(questionnaire):
+    """
+    Serialize the public questionnaire document.
+
+    Everything in it is fixed at creation, so the body is built once and
+    cached. The public key is not embedded; public_key_url points at its
+    content-addressed, cacheable-forever resource.
+
+    Returns:
+        (etag, body bytes)
+    """
+    # Return deadline in ISO format with Z to indicate UTC
+    deadline = questionnaire.deadline
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    deadline_iso = deadline.isoformat()
+    if not deadline_iso.endswith('Z') and not '+' in deadline_iso:
+        deadline_iso += 'Z'
+
+    body = json.dumps({
+        'id': questionnaire.id,
+        'link': questionnaire.link,
+        'deadline': deadline_iso,
+        'questions': questionnaire.get_questions(),
+        'public_key_id': questionnaire.public_key_sha256,
+        'public_key_url': f'/api/public-key/{questionnaire.public_key_sha256}',
+        'params': questionnaire.get_params()
+    }).encode('utf-8')
+    return hashlib.sha256(body).hexdigest()[:32], body
+
+
+def cached_json_response(etag, body, cache_control):
+    """JSON response with a strong ETag, or 304 Not Modified if the client already has it."""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 @app.route('/api/questionnaire/<string:link>', methods=['GET'])
 def get_questionnaire(link):
     """
-    Get questionnaire details including public key.
+    Get questionnaire details: questions, parameters and the public key URL.
     
     Returns:
-        JSON with questionnaire data, questions, public key, and parameters
+        JSON questionnaire document with a strong ETag (304 if unchanged)
     """
+    cached = document_cache.get(link)
+    if cached is not None:
+        return cached_json_response(*cached, DOCUMENT_CACHE_CONTROL)
+
     session = get_session(DB_URL)
     
     try:
-        questionnaire = session.query(Questionnaire).filter_by(link=link).first()
+        questionnaire = session.query(Questionnaire).options(load_only(
+            Questionnaire.id, Questionnaire.link, Questionnaire.deadline, Questionnaire.questions_json,
+            Questionnaire.public_key_sha256, Questionnaire.poly_degree, Questionnaire.plain_modulus,
+            Questionnaire.ciph_modulus, Questionnaire.questions_per_ciphertext
+        )).filter_by(link=link).first()
         
         if not questionnaire:
             return jsonify({'error': 'Questionnaire not found'}), 404
         
-        # Check if expired
-        # Make deadline timezone-aware if it's naive
-        deadline = questionnaire.deadline
-        if deadline.tzinfo is None:
-            deadline = deadline.replace(tzinfo=timezone.utc)
-        
-        # Return deadline in ISO format with Z to indicate UTC
-        deadline_iso = deadline.isoformat()
-        if not deadline_iso.endswith('Z') and not '+' in deadline_iso:
-            deadline_iso += 'Z'
-
-        response_data = {
-            'id': questionnaire.id,
-            'link': questionnaire.link,
-            'deadline': deadline_iso,
-            'questions': questionnaire.get_questions(),
-            'public_key': questionnaire.get_public_key(),
-            'params': questionnaire.get_params()
-        }
-        
-        return jsonify(response_data), 200
+        etag, body = questionnaire_document(questionnaire)
+        document_cache.put(link, None, (etag, body))
+        return cached_json_response(etag, body, DOCUMENT_CACHE_CONTROL)
         
     except Exception as e:
         print(f"Error retrieving questionnaire: {e}")
@@ -270,6 +290,39 @@ def get_questionnaire(link):
         session.close()
 
 
+@app.route('/api/public-key/<string:key_id>', methods=['GET'])
+def get_public_key(key_id):
+    """
+    Get a public key by its content address (SHA-256 of the serialized key).
+
+    The body for a given address can never change, so it may be cached forever.
+    """
+    body = public_key_cache.get(key_id)
+    if body is not None:
+        return cached_json_response(key_id, body, PUBLIC_KEY_CACHE_CONTROL)
+
+    session = get_session(DB_URL)
+
+    try:
+        public_key_json = session.query(Questionnaire.public_key_json).filter_by(
+            public_key_sha256=key_id
+        ).limit(1).scalar()
+
+        if public_key_json is None:
+            return jsonify({'error': 'Public key not found'}), 404
+
+        body = public_key_json.encode('utf-8')
+        public_key_cache.put(key_id, None, body)
+        return cached_json_response(key_id, body, PUBLIC_KEY_CACHE_CONTROL)
+
+    except Exception as e:
+        print(f"Error retrieving public key: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    finally:
+        session.close()
+
+
 @app.route('/api/cert-info', methods=['GET'])
 def get_cert_info():
     peercert = request.environ.get('peercert')
@@ -282,13 +335,26 @@ def get_cert_info():
 
 @app.route('/api/submit-answers', methods=['POST'])
 def submit_answers():
+    """
+    Submit an encrypted ballot.
+    
+    Accepts either JSON ({'questionnaire_id': ..., 'encrypted_answers': [...]})
+    or the binary ballot format when sent as Content-Type application/x-bfv-ballot.
+    """
     session = get_session(DB_URL)
     
     try:
-        data = request.get_json()
-        
-        questionnaire_id = data.get('questionnaire_id')
-        encrypted_answers = data.get('encrypted_answers')
+        ballot_params_id = None
+        if request.mimetype == BALLOT_MIME_TYPE:
+            try:
+                questionnaire_id, ballot_params_id, encrypted_answers = decode_ballot(request.get_data())
+            except ValueError as e:
+                return jsonify({'error': f'Invalid ballot: {e}'}), 400
+        else:
+            data = request.get_json()
+            
+            questionnaire_id = data.get('questionnaire_id')
+            encrypted_answers = data.get('encrypted_answers')
 
         cert_fingerprint = request.environ.get('peercert_fingerprint')
         if not cert_fingerprint:
@@ -310,47 +376,51 @@ def submit_answers():
         if datetime.now(timezone.utc) > deadline:
             return jsonify({'error': 'Questionnaire has expired'}), 410
         
-        existing = session.query(SubmissionRecord).filter_by(
+        # Index probe only when the filter cannot rule the fingerprint out
+        existing = submission_filter.might_contain(questionnaire.id, cert_fingerprint) and session.query(
+            SubmissionRecord.id
+        ).filter_by(
             questionnaire_id=questionnaire.id,
             cert_fingerprint=cert_fingerprint
         ).first()
-        if existing:
+        if existing or accumulation_buffer.is_pending(questionnaire, cert_fingerprint):
             return jsonify({'error': 'Already submitted'}), 409
 
-        params = BFVParameters(
-            poly_degree=questionnaire.poly_degree,
-            plain_modulus=questionnaire.plain_modulus,
-            ciph_modulus=int(questionnaire.ciph_modulus)
-        )
-        
-        evaluator = BFVEvaluator(params)
-        new_ciphertexts = [deserialize_ciphertext(ciph_data) for ciph_data in encrypted_answers]
-        
-        accumulated = questionnaire.get_accumulated_responses()
-        
-        if accumulated is None:
-            accumulated = [serialize_ciphertext(ciph) for ciph in new_ciphertexts]
-        else:
-            accumulated_ciphertexts = [deserialize_ciphertext(ciph_data) for ciph_data in accumulated]
-            for i in range(len(new_ciphertexts)):
-                accumulated_ciphertexts[i] = evaluator.add(accumulated_ciphertexts[i], new_ciphertexts[i])
-            accumulated = [serialize_ciphertext(ciph) for ciph in accumulated_ciphertexts]
+        expected_ciphertexts = num_ciphertexts(len(questionnaire.get_questions()), questionnaire.questions_per_ciphertext or 1)
+        if len(encrypted_answers) != expected_ciphertexts:
+            return jsonify({'error': f'Expected {expected_ciphertexts} encrypted answers for this questionnaire'}), 400
 
-        questionnaire.set_accumulated_responses(accumulated)
-        questionnaire.num_responses += 1
+        if ballot_params_id is None:
+            new_ciphertexts = [deserialize_ciphertext(ciph_data) for ciph_data in encrypted_answers]
+        elif ballot_params_id != context_for(questionnaire).params_id:
+            return jsonify({'error': 'Ballot was encrypted with different parameters'}), 400
+        else:
+            new_ciphertexts = encrypted_answers
         
-        submission_record = SubmissionRecord(
-            questionnaire_id=questionnaire.id,
-            cert_fingerprint=cert_fingerprint
-        )
-        session.add(submission_record)
+        # Queued for the questionnaire's writer, which commits it with whatever else is pending
+        try:
+            written = accumulation_buffer.submit(questionnaire, new_ciphertexts, cert_fingerprint)
+            written.result(timeout=SUBMIT_TIMEOUT)
+        except InvalidBallotError as e:
+            return jsonify({'error': f'Invalid ballot: {e}'}), 400
+        except DuplicateSubmissionError:
+            return jsonify({'error': 'Already submitted'}), 409
+        except QuestionnaireClosedError:
+            return jsonify({'error': 'Questionnaire has expired'}), 410
+        except FutureTimeoutError:
+            # Still queued; the writer commits it once the database catches up
+            return jsonify({
+                'success': True,
+                'message': 'Answers queued',
+                'total_responses': questionnaire.num_responses + accumulation_buffer.pending_count(questionnaire.link)
+            }), 202
 
+        # End the read transaction so num_responses is re-read with this ballot in it
         session.commit()
-        
         return jsonify({
             'success': True,
             'message': 'Answers submitted successfully',
-            'total_responses': questionnaire.num_responses
+            'total_responses': questionnaire.num_responses + accumulation_buffer.pending_count(questionnaire.link)
         }), 200
 
     except Exception as e:
@@ -361,6 +431,136 @@ def submit_answers():
         session.close()
 
 
+def _check_relayed_ballot(questionnaire, item, expected_ciphertexts):
+    """
+    Validate one ballot of a relayed batch.
+
+    Returns:
+        (fingerprint, ballot array) on success
+
+    Raises:
+        ValueError: With the reason the ballot is rejected
+    """
+    if not isinstance(item, dict) or not item.get('certificate') or not item.get('signature'):
+        raise ValueError('Missing certificate or signature')
+
+    if item.get('ballot'):
+        payload = base64.b64decode(item['ballot'], validate=True)
+        ballot_link, ballot_params_id, ciphertexts = decode_ballot(payload)
+        if ballot_link != questionnaire.link:
+            raise ValueError('Ballot is for a different questionnaire')
+        if ballot_params_id != context_for(questionnaire).params_id:
+            raise ValueError('Ballot was encrypted with different parameters')
+    elif item.get('encrypted_answers'):
+        payload = item['encrypted_answers']
+        ciphertexts = None
+    else:
+        raise ValueError('Missing ballot')
+
+    fingerprint = ballot_verifier.verify(item['certificate'], item['signature'],
+                                         questionnaire.link, ballot_digest(payload))
+
+    if ciphertexts is None:
+        if len(payload) != expected_ciphertexts:
+            raise ValueError(f'Expected {expected_ciphertexts} encrypted answers for this questionnaire')
+        ciphertexts = [deserialize_ciphertext(ciph_data) for ciph_data in payload]
+    return fingerprint, ballot_array(questionnaire, ciphertexts)
+
+
+@app.route('/api/submit-answers/batch', methods=['POST'])
+def submit_answers_batch():
+    """
+    Submit ballots collected by a relay, all for one questionnaire.
+
+    The relay authenticates with its own client certificate. Each ballot
+    carries the voter's certificate and signature (see ballot_signatures), and
+    the voter's certificate fingerprint is what is recorded against duplicates:
+
+        {'questionnaire_id': ...,
+         'ballots': [{'certificate': PEM, 'signature': base64,
+                      'encrypted_answers': [...] or 'ballot': base64 binary ballot}, ...]}
+
+    Duplicates are looked up with one query for the whole batch, the accepted
+    ballots are summed in memory and written in one transaction. The response
+    has an accepted/rejected status per ballot, in request order.
+    """
+    session = get_session(DB_URL)
+
+    try:
+        if not request.environ.get('peercert_fingerprint'):
+            return jsonify({'error': 'Client certificate required'}), 401
+
+        data = request.get_json()
+        questionnaire_id = data.get('questionnaire_id')
+        ballots = data.get('ballots')
+        if not questionnaire_id or not isinstance(ballots, list) or not ballots:
+            return jsonify({'error': 'Missing required fields'}), 400
+        if len(ballots) > MAX_BATCH_BALLOTS:
+            return jsonify({'error': f'At most {MAX_BATCH_BALLOTS} ballots per batch'}), 413
+
+        questionnaire = session.query(Questionnaire).filter_by(link=questionnaire_id).first()
+
+        if not questionnaire:
+            return jsonify({'error': 'Questionnaire not found'}), 404
+
+        deadline = questionnaire.deadline
+        if deadline.tzinfo is None:
+            deadline = deadline.replace(tzinfo=timezone.utc)
+
+        if datetime.now(timezone.utc) > deadline:
+            return jsonify({'error': 'Questionnaire has expired'}), 410
+
+        expected_ciphertexts = num_ciphertexts(len(questionnaire.get_questions()), questionnaire.questions_per_ciphertext or 1)
+        results = [None] * len(ballots)
+        valid = {}  # fingerprint -> (index, ballot array)
+        for i, item in enumerate(ballots):
+            try:
+                fingerprint, ballot = _check_relayed_ballot(questionnaire, item, expected_ciphertexts)
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                results[i] = {'index': i, 'status': 'rejected', 'error': str(e) or 'Invalid ballot'}
+                continue
+            if fingerprint in valid:
+                results[i] = {'index': i, 'status': 'rejected', 'error': 'Duplicate ballot in batch'}
+                continue
+            valid[fingerprint] = (i, ballot)
+
+        # One set-based lookup for the fingerprints the filter cannot rule out
+        candidates = [fingerprint for fingerprint in valid if submission_filter.might_contain(questionnaire.id, fingerprint)]
+        submitted = {fingerprint for (fingerprint,) in session.query(SubmissionRecord.cert_fingerprint).filter(
+            SubmissionRecord.questionnaire_id == questionnaire.id,
+            SubmissionRecord.cert_fingerprint.in_(candidates)
+        )} if candidates else set()
+
+        try:
+            written = accumulation_buffer.write_batch(questionnaire, [
+                (fingerprint, ballot) for fingerprint, (_, ballot) in valid.items()
+                if fingerprint not in submitted
+            ])
+        except QuestionnaireClosedError:
+            return jsonify({'error': 'Questionnaire has expired'}), 410
+        for fingerprint, (i, _) in valid.items():
+            if fingerprint in written:
+                results[i] = {'index': i, 'status': 'accepted'}
+            else:
+                results[i] = {'index': i, 'status': 'rejected', 'error': 'Already submitted'}
+
+        session.expire(questionnaire)
+        return jsonify({
+            'success': True,
+            'accepted': len(written),
+            'rejected': len(ballots) - len(written),
+            'total_responses': questionnaire.num_responses + accumulation_buffer.pending_count(questionnaire.link),
+            'results': results
+        }), 200
+
+    except Exception as e:
+        session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    finally:
+        session.close()
+
+
 @app.route('/api/questionnaire/<string:link>/stats', methods=['GET'])
 def get_stats(link):
     """
@@ -381,7 +581,7 @@ def get_stats(link):
         
         return jsonify({
             'link': questionnaire.link,
-            'num_responses': questionnaire.num_responses,
+            'num_responses': questionnaire.num_responses + accumulation_buffer.pending_count(questionnaire.link),
             'deadline': questionnaire.deadline.isoformat(),
             'created_at': questionnaire.created_at.isoformat(),
             'is_expired': datetime.now(timezone.utc) > deadline
@@ -398,21 +598,41 @@ def get_stats(link):
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint."""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now(timezone.utc).isoformat()}), 200
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'decryption': decryption_service.stats(),
+        'keypair_pool': keypair_pool.stats(),
+        'submission_filter': submission_filter.stats(),
+        'memmap_store': memmap_store_stats(),
+        'secret_keys': secret_keys.stats()
+    }), 200
 
 
 @app.route('/api/questionnaires', methods=['GET'])
 def list_questionnaires():
     """
-    Get list of all questionnaires with basic info.
+    Get one page of questionnaires with basic info, newest first.
+
+    Query parameters:
+        limit: Page size (default LIST_PAGE_SIZE, at most LIST_MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
+        status: 'open' or 'expired' (default: all)
     """
     session = get_session(DB_URL)
     
     try:
-        questionnaires = session.query(Questionnaire).order_by(Questionnaire.created_at.desc()).all()
+        try:
+            limit = min(max(int(request.args.get('limit', LIST_PAGE_SIZE)), 1), LIST_MAX_PAGE_SIZE)
+            query = questionnaire_list_query(limit, request.args.get('cursor'), request.args.get('status'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
+        rows, next_cursor = questionnaire_list_page(session.execute(query).all(), limit)
+        
+        now = datetime.now(timezone.utc)
         result = []
-        for q in questionnaires:
+        for q in rows:
             # Make deadline timezone-aware if it's naive
             deadline = q.deadline
             if deadline.tzinfo is None:
@@ -423,12 +643,12 @@ def list_questionnaires():
                 'link': q.link,
                 'created_at': q.created_at.isoformat(),
                 'deadline': deadline.isoformat(),
-                'num_responses': q.num_responses,
-                'num_questions': len(q.get_questions()),
-                'is_expired': datetime.now(timezone.utc) > deadline
+                'num_responses': q.num_responses + accumulation_buffer.pending_count(q.link),
+                'num_questions': q.num_questions,
+                'is_expired': now > deadline
             })
         
-        return jsonify({'questionnaires': result}), 200
+        return jsonify({'questionnaires': result, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         print(f"Error listing questionnaires: {e}")
@@ -447,11 +667,13 @@ def create_questionnaire_api():
     {
         'questions': [{'text': '...', 'options': [...]}],
         'deadline_datetime': '2025-12-31T23:59',
-        'link': 'optional-custom-link'
+        'link': 'optional-custom-link',
+        'num_shards': 4,  # optional, accumulator shards for concurrent writes
+        'pack_questions': true,  # optional, several questions per ciphertext
+        'profile': 'medium',  # optional, named BFV parameters (small/medium/large)
+        'accumulator_storage': 'log'  # optional, 'log', 'coefficients' (summed in SQL) or 'memmap'
     }
     """
-    from bfv.bfv_key_generator import BFVKeyGenerator
-    from util.secret_key import SecretKey
     import secrets as secrets_module
     
     session = get_session(DB_URL)
@@ -463,6 +685,10 @@ def create_questionnaire_api():
         deadline_datetime = data.get('deadline_datetime')
         custom_link = data.get('link')
         hide_results_until_deadline = data.get('hide_results_until_deadline', True)
+        num_shards = data.get('num_shards', DEFAULT_NUM_SHARDS)
+        pack_questions = data.get('pack_questions', True)
+        profile = data.get('profile')
+        accumulator_storage = data.get('accumulator_storage', DEFAULT_ACCUMULATOR_STORAGE)
 
         if not questions or len(questions) == 0:
             return jsonify({'error': 'No questions provided'}), 400
@@ -474,8 +700,17 @@ def create_questionnaire_api():
         for i, q in enumerate(questions):
             if 'text' not in q or 'options' not in q:
                 return jsonify({'error': f'Question {i+1} missing text or options'}), 400
-            if len(q['options']) != 8:
-                return jsonify({'error': f'Question {i+1} must have exactly 8 options'}), 400
+            if len(q['options']) != OPTIONS_PER_QUESTION:
+                return jsonify({'error': f'Question {i+1} must have exactly {OPTIONS_PER_QUESTION} options'}), 400
+        
+        if not isinstance(num_shards, int) or not 1 <= num_shards <= MAX_NUM_SHARDS:
+            return jsonify({'error': f'num_shards must be between 1 and {MAX_NUM_SHARDS}'}), 400
+        
+        if profile is not None and profile not in PROFILES:
+            return jsonify({'error': f"profile must be one of {', '.join(PROFILES)}"}), 400
+        
+        if accumulator_storage not in ACCUMULATOR_STORAGES:
+            return jsonify({'error': f"accumulator_storage must be one of {', '.join(ACCUMULATOR_STORAGES)}"}), 400
         
         # Generate unique link if not provided
         if custom_link:
@@ -501,50 +736,51 @@ def create_questionnaire_api():
         except ValueError as e:
             return jsonify({'error': f'Invalid datetime format: {str(e)}'}), 400
         
-        # BFV Parameters
-        degree = 8
-        plain_modulus = 17
-        ciph_modulus = 8000000000000
-        
-        params = BFVParameters(
-            poly_degree=degree,
-            plain_modulus=plain_modulus,
-            ciph_modulus=ciph_modulus
+        # BFV Parameters: a named profile, or a degree chosen from the question count
+        degree, plain_modulus, ciph_modulus, questions_per_ciphertext = resolve_parameters(
+            len(questions), profile=profile, packed=pack_questions
         )
         
-        # Generate keys
-        key_generator = BFVKeyGenerator(params)
-        public_key = key_generator.public_key
-        secret_key = key_generator.secret_key
-        
-        # Serialize keys
-        public_key_json = {
-            'p0': serialize_polynomial(public_key.p0),
-            'p1': serialize_polynomial(public_key.p1)
-        }
+        if accumulator_storage == STORAGE_COEFFICIENTS and not coefficient_storage_supports(ciph_modulus):
+            return jsonify({'error': 'The cipher modulus is too large for coefficients storage'}), 400
+        if accumulator_storage == STORAGE_MEMMAP and not memmap_storage_supports(ciph_modulus):
+            return jsonify({'error': 'The cipher modulus is too large for memmap storage'}), 400
+        if accumulator_storage != STORAGE_LOG:
+            # Shards only spread out log compaction, which the other storages do not use
+            num_shards = 1
         
-        secret_key_json = {
-            'coeffs': secret_key.s.coeffs,
-            'ring_degree': secret_key.s.ring_degree
-        }
+        # Take a pre-generated keypair (generated inline if the pool is empty)
+        public_key_json, secret_key_json = keypair_pool.take((degree, plain_modulus, ciph_modulus))
         
         # Create questionnaire
         questionnaire = Questionnaire(
             link=link,
             deadline=deadline,
             questions_json=json.dumps(questions),
+            num_questions=len(questions),
             poly_degree=degree,
             plain_modulus=plain_modulus,
             ciph_modulus=str(ciph_modulus),
-            public_key_json=json.dumps(public_key_json),
-            secret_key_json=json.dumps(secret_key_json),
-            accumulated_responses_json=None,
+            questions_per_ciphertext=questions_per_ciphertext,
+            public_key_json=public_key_json,
+            public_key_sha256=public_key_digest(public_key_json),
+            secret_key_json=secret_key_json,
+            accumulated_responses_blob=None,
+            num_shards=num_shards,
+            accumulator_storage=accumulator_storage,
             num_responses=0,
             hide_results_until_deadline=hide_results_until_deadline
         )
         
         session.add(questionnaire)
+        if accumulator_storage == STORAGE_COEFFICIENTS:
+            session.flush()
+            init_coefficients(session, questionnaire)
         session.commit()
+        submission_filter.track(questionnaire.id)
+        if accumulator_storage == STORAGE_MEMMAP and memmap_store is not None:
+            memmap_store.track(questionnaire)
+        deadline_scheduler.schedule(link, deadline)
         
         return jsonify({
             'success': True,
@@ -572,6 +808,9 @@ def get_results(link):
     session = get_session(DB_URL)
     
     try:
+        # Pending ballots count towards the results
+        accumulation_buffer.flush(link)
+        
         questionnaire = session.query(Questionnaire).filter_by(link=link).first()
         
         if not questionnaire:
@@ -595,7 +834,7 @@ def get_results(link):
                 'num_responses': 0
             }), 404
         
-        questionnaire.is_decrypted = False
+        # Decrypts only if ballots arrived since the stored results; a no-op once final
         if decrypt_questionnaire(questionnaire):
             session.commit()
         else:
@@ -603,19 +842,25 @@ def get_results(link):
                 'error': 'Failed to decrypt results',
             }), 500
 
-        results = questionnaire.get_decrypted_results()
-        
-        if not results:
-            return jsonify({'error': 'Results not available'}), 404
+        cache_key = (questionnaire.results_version, is_expired)
+        body = results_cache.get(link, cache_key)
+        if body is None:
+            results = questionnaire.get_decrypted_results()
+            
+            if not results:
+                return jsonify({'error': 'Results not available'}), 404
+            
+            body = app.json.dumps({
+                'link': questionnaire.link,
+                'created_at': questionnaire.created_at.isoformat(),
+                'deadline': deadline.isoformat(),
+                'num_responses': questionnaire.num_responses,
+                'is_expired': is_expired,
+                'results': results
+            })
+            results_cache.put(link, cache_key, body)
 
-        return jsonify({
-            'link': questionnaire.link,
-            'created_at': questionnaire.created_at.isoformat(),
-            'deadline': deadline.isoformat(),
-            'num_responses': questionnaire.num_responses,
-            'is_expired': is_expired,
-            'results': results
-        }), 200
+        return app.response_class(body, status=200, mimetype='application/json')
         
     except Exception as e:
         print(f"Error getting results: {e}")
@@ -644,9 +889,12 @@ if __name__ == '__main__':
 
     init_db(DB_URL)
     
-    decryption_thread = threading.Thread(target=check_expired_questionnaires, daemon=True)
-    decryption_thread.start()
-    print("✓ Automatic decryption service started")
+    print(f"✓ Submission filter warmed ({submission_filter.warm(DB_URL)} fingerprints)")
+    print(f"✓ Accumulator file mapped ({open_memmap_store().warm()} open memmap questionnaires)")
+    memmap_store.start()
+    keypair_pool.start()
+    deadline_scheduler.start()
+    print(f"✓ Automatic decryption service started ({deadline_scheduler.pending()} deadlines pending)")
     
     from werkzeug.serving import run_simple
 
@@ -673,4 +921,13 @@ if __name__ == '__main__':
     print("Server ready!")
     print("Access the application at: https://localhost:5000")
 
-    run_simple('0.0.0.0', 5000, wrapped_app, ssl_context=context, use_reloader=False, use_debugger=True, threaded=True)
+    try:
+        run_simple('0.0.0.0', 5000, wrapped_app, ssl_context=context, use_reloader=False, use_debugger=True, threaded=True)
+    finally:
+        keypair_pool.stop()
+        deadline_scheduler.stop()
+        decryption_service.stop()
+        # Write out ballots still queued, then checkpoint the accumulator file
+        accumulation_buffer.stop()
+        memmap_store.stop()
+        secret_keys.clear()
@@ -0,0 +1,494 @@
+"""
+ASGI variant of the questionnaire API (Starlette on uvicorn, asyncio database access).
+
+Serves the hot endpoints - questionnaire fetch, submit, stats, results and
+the list - from one event loop instead of a thread per connection. Database
+reads go through the aiosqlite engine (models.get_async_engine); ballot
+parsing, homomorphic accumulation and decryption run in the thread pool so
+they never block the loop. Everything else (questionnaire creation, static
+files) falls through to the Flask app from app.py, and both share the same
+accumulation buffer, results cache, keypair pool and deadline scheduler.
+
+Client certificates arrive through the ASGI TLS extension
+(scope['extensions']['tls']['client_cert_chain']). uvicorn does not fill it
+in, so PeerCertH11Protocol reads the peer certificate from the TLS transport
+when a connection is made and adds the extension to every request on it.
+
+Run with:
+    python asgi_app.py
+"""
+
+import sys
+import os
+
+# Add py-fhe to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'py-fhe'))
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import ssl
+from datetime import datetime, timezone
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from uvicorn.protocols.http.h11_impl import H11Protocol
+
+from models import (get_async_engine, get_session, remove_session, Questionnaire, SubmissionRecord,
+                    questionnaire_list_query, questionnaire_list_page, LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE)
+from serialization import deserialize_ciphertext, decode_ballot, BALLOT_MIME_TYPE
+from accumulator import DuplicateSubmissionError, InvalidBallotError, QuestionnaireClosedError
+from slot_packing import num_ciphertexts
+from crypto_context import context_for, secret_keys
+from app import (app as flask_app, DB_URL, accumulation_buffer, results_cache, keypair_pool, deadline_scheduler,
+                 decryption_service, decrypt_questionnaire, questionnaire_document, document_cache, public_key_cache,
+                 submission_filter, open_memmap_store, memmap_store_stats, DOCUMENT_CACHE_CONTROL, PUBLIC_KEY_CACHE_CONTROL, SUBMIT_TIMEOUT)
+
+# Questionnaire columns a submission needs; keys and accumulators stay unloaded
+_SUBMIT_COLUMNS = (
+    Questionnaire.id, Questionnaire.link, Questionnaire.deadline, Questionnaire.questions_json,
+    Questionnaire.poly_degree, Questionnaire.plain_modulus, Questionnaire.ciph_modulus,
+    Questionnaire.questions_per_ciphertext, Questionnaire.num_shards, Questionnaire.accumulator_storage,
+    Questionnaire.num_responses
+)
+
+
+# Attribute names in ssl's peer certificate dict -> RFC 4514 short names
+_RDN_KEYS = {
+    'commonName': 'CN',
+    'organizationName': 'O',
+    'organizationalUnitName': 'OU',
+    'localityName': 'L',
+    'stateOrProvinceName': 'ST',
+    'countryName': 'C',
+}
+
+
+def _utc(deadline):
+    """Deadlines are stored naive in UTC."""
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return deadline
+
+
+def _error(message, status_code, **extra):
+    return JSONResponse({'error': message, **extra}, status_code=status_code)
+
+
+def peer_certificate(scope):
+    """Return (fingerprint, subject name) of the client certificate, or (None, None)."""
+    tls = scope.get('extensions', {}).get('tls') or {}
+    chain = tls.get('client_cert_chain')
+    if not chain:
+        return None, None
+    fingerprint = hashlib.sha256(ssl.PEM_cert_to_DER_cert(chain[0])).hexdigest()
+    return fingerprint, tls.get('client_cert_name')
+
+
+class PeerCertH11Protocol(H11Protocol):
+    """uvicorn HTTP protocol that adds the ASGI TLS extension with the client certificate."""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        ssl_object = transport.get_extra_info('ssl_object')
+        cert = ssl_object.getpeercert(binary_form=True) if ssl_object else None
+        if not cert:
+            return
+
+        subject = ssl_object.getpeercert().get('subject', ())
+        tls = {
+            'server_cert': None,
+            'client_cert_chain': [ssl.DER_cert_to_PEM_cert(cert)],
+            'client_cert_name': ','.join(f'{_RDN_KEYS.get(key, key)}={value}'
+                                         for rdn in reversed(subject) for key, value in rdn),
+            'client_cert_error': None,
+            'tls_version': None,
+            'cipher_suite': None,
+        }
+        # One protocol instance per connection, so every request on it gets the same certificate
+        app = self.app
+
+        async def app_with_tls(scope, receive, send):
+            scope.setdefault('extensions', {})['tls'] = tls
+            await app(scope, receive, send)
+
+        self.app = app_with_tls
+
+
+def with_peer_certificate(wsgi_app):
+    """
+    Wrap the Flask app so its routes see the client certificate under ASGI.
+
+    Flask routes read environ['peercert_fingerprint'], which app.py's
+    werkzeug handler sets; a2wsgi passes the ASGI scope along as
+    environ['asgi.scope'], so the fingerprint is taken from its TLS extension.
+    """
+    def app_with_fingerprint(environ, start_response):
+        fingerprint, _ = peer_certificate(environ.get('asgi.scope') or {})
+        if fingerprint:
+            environ['peercert_fingerprint'] = fingerprint
+        return wsgi_app(environ, start_response)
+
+    return app_with_fingerprint
+
+
+def async_session():
+    return AsyncSession(get_async_engine(DB_URL))
+
+
+def _cached_json_response(request, etag, body, cache_control):
+    """JSON response with a strong ETag, or 304 Not Modified if If-None-Match has it."""
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if_none_match = request.headers.get('if-none-match', '')
+    tags = {tag.strip() for tag in if_none_match.split(',')}
+    if f'"{etag}"' in tags or '*' in tags:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+async def get_questionnaire(request):
+    """Get questionnaire details: questions, parameters and the public key URL."""
+    link = request.path_params['link']
+    cached = document_cache.get(link)
+    if cached is not None:
+        return _cached_json_response(request, *cached, DOCUMENT_CACHE_CONTROL)
+
+    async with async_session() as session:
+        questionnaire = (await session.execute(
+            select(Questionnaire).options(load_only(
+                Questionnaire.id, Questionnaire.link, Questionnaire.deadline, Questionnaire.questions_json,
+                Questionnaire.public_key_sha256, Questionnaire.poly_degree, Questionnaire.plain_modulus,
+                Questionnaire.ciph_modulus, Questionnaire.questions_per_ciphertext
+            )).filter_by(link=link)
+        )).scalar_one_or_none()
+
+    if not questionnaire:
+        return _error('Questionnaire not found', 404)
+
+    etag, body = questionnaire_document(questionnaire)
+    document_cache.put(link, None, (etag, body))
+    return _cached_json_response(request, etag, body, DOCUMENT_CACHE_CONTROL)
+
+
+async def get_public_key(request):
+    """Get a public key by its content address; the body never changes."""
+    key_id = request.path_params['key_id']
+    body = public_key_cache.get(key_id)
+    if body is None:
+        async with async_session() as session:
+            public_key_json = (await session.execute(
+                select(Questionnaire.public_key_json).filter_by(public_key_sha256=key_id).limit(1)
+            )).scalar()
+        if public_key_json is None:
+            return _error('Public key not found', 404)
+        body = public_key_json.encode('utf-8')
+        public_key_cache.put(key_id, None, body)
+    return _cached_json_response(request, key_id, body, PUBLIC_KEY_CACHE_CONTROL)
+
+
+async def get_cert_info(request):
+    fingerprint, name = peer_certificate(request.scope)
+    if not fingerprint:
+        return _error('No client certificate', 401)
+    cn = dict(part.split('=', 1) for part in (name or '').split(',') if '=' in part).get('CN')
+    return JSONResponse({'fingerprint': fingerprint, 'cn': cn})
+
+
+async def submit_answers(request):
+    """
+    Submit an encrypted ballot.
+
+    Accepts the same JSON and binary ballot formats as the Flask endpoint.
+    """
+    body = await request.body()
+    ballot_params_id = None
+    if request.headers.get('content-type', '').split(';')[0].strip() == BALLOT_MIME_TYPE:
+        try:
+            questionnaire_id, ballot_params_id, encrypted_answers = await run_in_threadpool(decode_ballot, body)
+        except ValueError as e:
+            return _error(f'Invalid ballot: {e}', 400)
+    else:
+        data = json.loads(body or b'{}')
+        questionnaire_id = data.get('questionnaire_id')
+        encrypted_answers = data.get('encrypted_answers')
+
+    cert_fingerprint, _ = peer_certificate(request.scope)
+    if not cert_fingerprint:
+        return _error('Client certificate required', 401)
+
+    if not questionnaire_id or not encrypted_answers:
+        return _error('Missing required fields', 400)
+
+    async with async_session() as session:
+        questionnaire = (await session.execute(
+            select(Questionnaire).options(load_only(*_SUBMIT_COLUMNS)).filter_by(link=questionnaire_id)
+        )).scalar_one_or_none()
+        if not questionnaire:
+            return _error('Questionnaire not found', 404)
+
+        if datetime.now(timezone.utc) > _utc(questionnaire.deadline):
+            return _error('Questionnaire has expired', 410)
+
+        # Index probe only when the filter cannot rule the fingerprint out
+        existing = submission_filter.might_contain(questionnaire.id, cert_fingerprint) and (await session.execute(
+            select(SubmissionRecord.id).filter_by(
+                questionnaire_id=questionnaire.id,
+                cert_fingerprint=cert_fingerprint
+            ).limit(1)
+        )).first()
+
+    if existing or accumulation_buffer.is_pending(questionnaire, cert_fingerprint):
+        return _error('Already submitted', 409)
+
+    expected_ciphertexts = num_ciphertexts(len(questionnaire.get_questions()), questionnaire.questions_per_ciphertext or 1)
+    if len(encrypted_answers) != expected_ciphertexts:
+        return _error(f'Expected {expected_ciphertexts} encrypted answers for this questionnaire', 400)
+
+    if ballot_params_id is None:
+        new_ciphertexts = await run_in_threadpool(
+            lambda: [deserialize_ciphertext(ciph_data) for ciph_data in encrypted_answers]
+        )
+    elif ballot_params_id != context_for(questionnaire).params_id:
+        return _error('Ballot was encrypted with different parameters', 400)
+    else:
+        new_ciphertexts = encrypted_answers
+
+    # Queued for the questionnaire's writer; the loop awaits the commit without holding a thread
+    try:
+        written = await run_in_threadpool(accumulation_buffer.submit, questionnaire, new_ciphertexts, cert_fingerprint)
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(written)), SUBMIT_TIMEOUT)
+    except InvalidBallotError as e:
+        return _error(f'Invalid ballot: {e}', 400)
+    except DuplicateSubmissionError:
+        return _error('Already submitted', 409)
+    except QuestionnaireClosedError:
+        return _error('Questionnaire has expired', 410)
+    except asyncio.TimeoutError:
+        # Still queued; the writer commits it once the database catches up
+        return JSONResponse({
+            'success': True,
+            'message': 'Answers queued',
+            'total_responses': questionnaire.num_responses + accumulation_buffer.pending_count(questionnaire.link)
+        }, status_code=202)
+
+    async with async_session() as session:
+        num_responses = (await session.execute(
+            select(Questionnaire.num_responses).filter_by(id=questionnaire.id)
+        )).scalar_one()
+
+    return JSONResponse({
+        'success': True,
+        'message': 'Answers submitted successfully',
+        'total_responses': num_responses + accumulation_buffer.pending_count(questionnaire.link)
+    })
+
+
+async def get_stats(request):
+    """Get basic statistics about a questionnaire (without decrypting)."""
+    link = request.path_params['link']
+    async with async_session() as session:
+        row = (await session.execute(
+            select(Questionnaire.link, Questionnaire.num_responses, Questionnaire.deadline,
+                   Questionnaire.created_at).filter_by(link=link)
+        )).first()
+
+    if not row:
+        return _error('Questionnaire not found', 404)
+
+    return JSONResponse({
+        'link': row.link,
+        'num_responses': row.num_responses + accumulation_buffer.pending_count(row.link),
+        'deadline': row.deadline.isoformat(),
+        'created_at': row.created_at.isoformat(),
+        'is_expired': datetime.now(timezone.utc) > _utc(row.deadline)
+    })
+
+
+async def list_questionnaires(request):
+    """Get one page of questionnaires with basic info, newest first (see app.list_questionnaires)."""
+    try:
+        limit = min(max(int(request.query_params.get('limit', LIST_PAGE_SIZE)), 1), LIST_MAX_PAGE_SIZE)
+        query = questionnaire_list_query(limit, request.query_params.get('cursor'), request.query_params.get('status'))
+    except ValueError as e:
+        return _error(str(e), 400)
+
+    async with async_session() as session:
+        rows, next_cursor = questionnaire_list_page((await session.execute(query)).all(), limit)
+
+    now = datetime.now(timezone.utc)
+    result = []
+    for row in rows:
+        deadline = _utc(row.deadline)
+        result.append({
+            'id': row.id,
+            'link': row.link,
+            'created_at': row.created_at.isoformat(),
+            'deadline': deadline.isoformat(),
+            'num_responses': row.num_responses + accumulation_buffer.pending_count(row.link),
+            'num_questions': row.num_questions,
+            'is_expired': now > deadline
+        })
+
+    return JSONResponse({'questionnaires': result, 'next_cursor': next_cursor})
+
+
+def _refresh_results(link):
+    """Decrypt a questionnaire if ballots changed its sum; runs in the thread pool."""
+    session = get_session(DB_URL)
+    try:
+        questionnaire = session.query(Questionnaire).filter_by(link=link).first()
+        if questionnaire is None or not decrypt_questionnaire(questionnaire):
+            return None
+        session.commit()
+        return questionnaire.results_version, questionnaire.num_responses, questionnaire.get_decrypted_results()
+    finally:
+        remove_session(DB_URL)
+
+
+async def get_results(request):
+    """Return decrypted results from a questionnaire."""
+    link = request.path_params['link']
+
+    # Pending ballots count towards the results
+    await run_in_threadpool(accumulation_buffer.flush, link)
+
+    async with async_session() as session:
+        row = (await session.execute(
+            select(Questionnaire.link, Questionnaire.created_at, Questionnaire.deadline,
+                   Questionnaire.num_responses, Questionnaire.hide_results_until_deadline,
+                   Questionnaire.is_decrypted, Questionnaire.results_version).filter_by(link=link)
+        )).first()
+
+    if not row:
+        return _error('Questionnaire not found', 404)
+
+    deadline = _utc(row.deadline)
+    is_expired = datetime.now(timezone.utc) > deadline
+
+    if row.hide_results_until_deadline and not is_expired:
+        return _error('Results are hidden until the deadline', 403, deadline=deadline.isoformat())
+
+    if row.num_responses == 0:
+        return _error('No responses yet', 404, num_responses=0)
+
+    # Final results never change; anything else may need decrypting first
+    version, num_responses, results = row.results_version, row.num_responses, None
+    if not row.is_decrypted:
+        refreshed = await run_in_threadpool(_refresh_results, link)
+        if refreshed is None:
+            return _error('Failed to decrypt results', 500)
+        version, num_responses, results = refreshed
+
+    cache_key = (version, is_expired)
+    body = results_cache.get(link, cache_key)
+    if body is None:
+        if results is None:
+            async with async_session() as session:
+                results_json = (await session.execute(
+                    select(Questionnaire.decrypted_results_json).filter_by(link=link)
+                )).scalar_one()
+            results = json.loads(results_json) if results_json else None
+
+        if not results:
+            return _error('Results not available', 404)
+
+        body = json.dumps({
+            'link': row.link,
+            'created_at': row.created_at.isoformat(),
+            'deadline': deadline.isoformat(),
+            'num_responses': num_responses,
+            'is_expired': is_expired,
+            'results': results
+        })
+        results_cache.put(link, cache_key, body)
+
+    return Response(body, media_type='application/json')
+
+
+async def health(request):
+    """Health check endpoint."""
+    return JSONResponse({
+        'status': 'healthy',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'decryption': decryption_service.stats(),
+        'keypair_pool': await run_in_threadpool(keypair_pool.stats),
+        'submission_filter': submission_filter.stats(),
+        'memmap_store': memmap_store_stats(),
+        'secret_keys': secret_keys.stats()
+    })
+
+
+async def server_error(request, exc):
+    print(f"Error handling {request.url.path}: {exc}")
+    return _error(str(exc), 500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    warmed = await run_in_threadpool(submission_filter.warm, DB_URL)
+    print(f"✓ Submission filter warmed ({warmed} fingerprints)")
+    memmap_store = open_memmap_store()
+    mapped = await run_in_threadpool(memmap_store.warm)
+    print(f"✓ Accumulator file mapped ({mapped} open memmap questionnaires)")
+    memmap_store.start()
+    keypair_pool.start()
+    deadline_scheduler.start()
+    print(f"✓ Automatic decryption service started ({deadline_scheduler.pending()} deadlines pending)")
+    try:
+        yield
+    finally:
+        keypair_pool.stop()
+        deadline_scheduler.stop()
+        decryption_service.stop()
+        # Write out ballots still queued, then checkpoint the accumulator file
+        accumulation_buffer.stop()
+        memmap_store.stop()
+        secret_keys.clear()
+        await get_async_engine(DB_URL).dispose()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/questionnaire/{link}', get_questionnaire, methods=['GET']),
+        Route('/api/public-key/{key_id}', get_public_key, methods=['GET']),
+        Route('/api/cert-info', get_cert_info, methods=['GET']),
+        Route('/api/submit-answers', submit_answers, methods=['POST']),
+        Route('/api/questionnaire/{link}/stats', get_stats, methods=['GET']),
+        Route('/api/questionnaire/{link}/results', get_results, methods=['GET']),
+        Route('/api/questionnaires', list_questionnaires, methods=['GET']),
+        Route('/api/health', health, methods=['GET']),
+        # Questionnaire creation, relayed batches and static files
+        Mount('/', WSGIMiddleware(with_peer_certificate(flask_app))),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={Exception: server_error},
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Starting ASGI server with mTLS...")
+    print("Database URL:", DB_URL)
+
+    # One process: the accumulation buffer, accumulator file and caches belong to it
+    uvicorn.run(
+        app,
+        host='0.0.0.0',
+        port=5000,
+        http=PeerCertH11Protocol,
+        ssl_certfile='certs/server.crt',
+        ssl_keyfile='certs/server.key',
+        ssl_ca_certs='certs/ca.crt',
+        ssl_cert_reqs=ssl.CERT_REQUIRED,
+    )
@@ -0,0 +1,127 @@
+"""
+Signed ballots for bulk submission by relays.
+
+A relay (kiosk, offline collection point) uploads ballots it has collected,
+so it cannot present each voter's client certificate over TLS. Instead every
+relayed ballot carries the voter's certificate and a signature over the
+ballot made with the voter's private key. The certificate has to be issued
+by the deployment CA (certs/ca.crt), and the identity recorded for the
+ballot is the SHA-256 fingerprint of the certificate, the same value the
+mTLS path records, so a voter is counted once across both paths.
+
+The signed message binds the ballot to its questionnaire:
+
+    b'bfv-ballot-signature-v1' || 0x00 || link || 0x00 || sha256(payload)
+
+where payload is the binary ballot (application/x-bfv-ballot) or, for JSON
+ballots, the encrypted answers as compact JSON with sorted keys. RSA keys
+sign with PKCS#1 v1.5, EC keys with ECDSA, both over SHA-256.
+
+Needs the cryptography package.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+from datetime import datetime, timezone
+
+CA_CERT_PATH = 'certs/ca.crt'
+SIGNATURE_CONTEXT = b'bfv-ballot-signature-v1'
+
+
+class SignatureError(ValueError):
+    """Raised when a relayed ballot's certificate or signature does not check out."""
+
+
+def ballot_digest(payload):
+    """SHA-256 of a binary ballot (bytes) or of JSON encrypted answers (list)."""
+    if not isinstance(payload, (bytes, bytearray, memoryview)):
+        payload = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(payload).digest()
+
+
+def signed_message(link, digest):
+    """The bytes a voter signs for a ballot with the given digest."""
+    return SIGNATURE_CONTEXT + b'\x00' + link.encode('utf-8') + b'\x00' + digest
+
+
+def sign_ballot(private_key_pem, link, digest):
+    """Sign a ballot digest with a PEM private key; returns the base64 signature (for relay tooling)."""
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding
+
+    key = serialization.load_pem_private_key(private_key_pem, password=None)
+    message = signed_message(link, digest)
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        signature = key.sign(message, ec.ECDSA(hashes.SHA256()))
+    else:
+        signature = key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+    return base64.b64encode(signature).decode('ascii')
+
+
+class BallotVerifier:
+    """Checks voter certificates against the CA and ballot signatures against the certificates."""
+
+    def __init__(self, ca_cert_path=CA_CERT_PATH):
+        self.ca_cert_path = ca_cert_path
+        self._ca = None
+        self._lock = threading.Lock()
+
+    def verify(self, certificate_pem, signature, link, digest):
+        """
+        Verify a relayed ballot.
+
+        Args:
+            certificate_pem: Voter's certificate (PEM string)
+            signature: Base64 signature over signed_message(link, digest)
+            link: Questionnaire link the ballot is for
+            digest: ballot_digest() of the ballot
+
+        Returns:
+            str: SHA-256 fingerprint of the certificate (hex)
+
+        Raises:
+            SignatureError: If the certificate or the signature is not valid
+        """
+        from cryptography import x509
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+        from cryptography.hazmat.primitives.serialization import Encoding
+
+        try:
+            cert = x509.load_pem_x509_certificate(certificate_pem.encode('ascii'))
+            signature = base64.b64decode(signature, validate=True)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise SignatureError(f'Malformed certificate or signature: {e}')
+
+        try:
+            cert.verify_directly_issued_by(self._ca_certificate())
+        except (ValueError, TypeError, InvalidSignature):
+            raise SignatureError('Certificate is not issued by the CA')
+        now = datetime.now(timezone.utc)
+        if not cert.not_valid_before_utc <= now <= cert.not_valid_after_utc:
+            raise SignatureError('Certificate is not valid at this time')
+
+        key = cert.public_key()
+        message = signed_message(link, digest)
+        try:
+            if isinstance(key, rsa.RSAPublicKey):
+                key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+            elif isinstance(key, ec.EllipticCurvePublicKey):
+                key.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+            else:
+                raise SignatureError('Unsupported certificate key type')
+        except InvalidSignature:
+            raise SignatureError('Invalid signature')
+
+        return hashlib.sha256(cert.public_bytes(Encoding.DER)).hexdigest()
+
+    def _ca_certificate(self):
+        with self._lock:
+            if self._ca is None:
+                from cryptography import x509
+                with open(self.ca_cert_path, 'rb') as f:
+                    self._ca = x509.load_pem_x509_certificate(f.read())
+            return self._ca
@@ -0,0 +1,221 @@
+"""
+NumPy storage format for accumulated ciphertexts.
+
+A list of ciphertexts is held as one coefficient array of shape
+(count, 2, degree): one row per ciphertext, c0 and c1 per row. Coefficients
+are kept reduced mod ciph_modulus. Moduli up to 2^64 use uint64; larger
+moduli fall back to Python-int object arrays.
+
+In the database the array is a BLOB: an 8-byte header (degree u32,
+count u16, 64-bit limbs per coefficient u16) followed by the little-endian
+limbs. With one limb per coefficient the stored bytes can be viewed as the
+array directly, without copying.
+
+Finalized accumulators (see modulus_switching) use a compact BLOB instead:
+a 7-byte header (degree u32, count u16, bytes per coefficient u8) followed
+by each coefficient in just that many little-endian bytes.
+
+Accumulation works on these arrays directly: add_arrays and sum_arrays add
+whole ballots (every question, c0 and c1) mod ciph_modulus in single NumPy
+operations. The result is the same as BFVEvaluator.add on each ciphertext,
+which reduces every coefficient sum mod ciph_modulus.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+_ARRAY_HEADER = struct.Struct('<IHH')  # degree, count, limbs per coefficient
+_COMPACT_HEADER = struct.Struct('<IHB')  # degree, count, bytes per coefficient
+_LIMB_BITS = 64
+_LIMB_MASK = (1 << _LIMB_BITS) - 1
+_UINT64_MAX = (1 << 64) - 1
+
+
+def coefficient_dtype(ciph_modulus):
+    """Array dtype able to hold coefficients reduced mod ciph_modulus."""
+    return np.uint64 if int(ciph_modulus) <= 1 << _LIMB_BITS else object
+
+
+def pack_ciphertext_array(array):
+    """
+    Encode a (count, 2, degree) coefficient array as a BLOB.
+
+    Args:
+        array: uint64 or object ndarray of reduced coefficients
+
+    Returns:
+        bytes
+    """
+    count, _, degree = array.shape
+    if array.dtype == object:
+        bits = max(int(array.max()).bit_length(), 1) if array.size else 1
+        limbs = -(-bits // _LIMB_BITS)
+        words = np.stack([((array >> (_LIMB_BITS * l)) & _LIMB_MASK).astype('<u8') for l in range(limbs)], axis=-1)
+    else:
+        limbs = 1
+        words = array.astype('<u8', copy=False)
+    return _ARRAY_HEADER.pack(degree, count, limbs) + words.tobytes()
+
+
+def unpack_ciphertext_array(blob):
+    """
+    Decode a BLOB written by pack_ciphertext_array.
+
+    For single-limb data the result is a read-only view over the BLOB
+    (np.frombuffer); copy it before modifying in place.
+
+    Returns:
+        ndarray of shape (count, 2, degree)
+    """
+    degree, count, limbs = _ARRAY_HEADER.unpack_from(blob)
+    words = np.frombuffer(blob, dtype='<u8', offset=_ARRAY_HEADER.size)
+    if limbs == 1:
+        return words.reshape(count, 2, degree)
+
+    words = words.reshape(count, 2, degree, limbs).astype(object)
+    array = words[..., 0]
+    for l in range(1, limbs):
+        array = array + (words[..., l] << (_LIMB_BITS * l))
+    return array
+
+
+def pack_compact_array(array, ciph_modulus):
+    """
+    Encode a (count, 2, degree) array of coefficients below ciph_modulus <= 2^64
+    in the fewest whole bytes per coefficient.
+
+    Returns:
+        bytes
+    """
+    count, _, degree = array.shape
+    width = max(1, -(-(int(ciph_modulus) - 1).bit_length() // 8))
+    if width > 8:
+        raise ValueError('Compact arrays hold coefficients of at most 64 bits')
+    as_bytes = np.ascontiguousarray(array, dtype='<u8').view(np.uint8).reshape(count, 2, degree, 8)
+    return _COMPACT_HEADER.pack(degree, count, width) + as_bytes[..., :width].tobytes()
+
+
+def unpack_compact_array(blob):
+    """
+    Decode a BLOB written by pack_compact_array.
+
+    Returns:
+        uint64 ndarray of shape (count, 2, degree)
+    """
+    degree, count, width = _COMPACT_HEADER.unpack_from(blob)
+    packed = np.frombuffer(blob, dtype=np.uint8, offset=_COMPACT_HEADER.size).reshape(count, 2, degree, width)
+    as_bytes = np.zeros((count, 2, degree, 8), dtype=np.uint8)
+    as_bytes[..., :width] = packed
+    return as_bytes.view('<u8').reshape(count, 2, degree).astype(np.uint64)
+
+
+def json_to_array(accumulated_json, ciph_modulus):
+    """
+    Convert a legacy JSON accumulator (list of serialized ciphertexts) to an array.
+
+    Returns:
+        ndarray of shape (count, 2, degree), or None for empty input
+    """
+    if not accumulated_json:
+        return None
+    ciph_modulus = int(ciph_modulus)
+    rows = [
+        [[c % ciph_modulus for c in ciph['c0']['coeffs']], [c % ciph_modulus for c in ciph['c1']['coeffs']]]
+        for ciph in json.loads(accumulated_json)
+    ]
+    return np.array(rows, dtype=coefficient_dtype(ciph_modulus))
+
+
+def add_arrays(a, b, ciph_modulus, out=None):
+    """
+    Add two reduced coefficient arrays mod ciph_modulus.
+
+    uint64 sums are corrected with a conditional subtraction instead of a
+    division; moduli above 2^63 can wrap past 2^64, which is detected and
+    corrected the same way.
+
+    Args:
+        a, b: Arrays of the same shape and dtype, coefficients in [0, ciph_modulus)
+        ciph_modulus: Cipher modulus
+        out: Optional array to write the result into (may be a)
+
+    Returns:
+        ndarray
+    """
+    ciph_modulus = int(ciph_modulus)
+    if a.dtype == object:
+        result = (a + b) % ciph_modulus
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    out = np.add(a, b, out=out)
+    if ciph_modulus == 1 << _LIMB_BITS:
+        return out  # uint64 wraparound is the reduction
+    modulus = np.uint64(ciph_modulus)
+    if ciph_modulus > 1 << (_LIMB_BITS - 1):
+        if out is a and out is b:
+            raise ValueError('out may alias only one operand when ciph_modulus exceeds 2^63')
+        # A wrapped sum is smaller than either operand
+        overflow = out < (b if out is a else a)
+        np.subtract(out, modulus, out=out, where=overflow | (out >= modulus))
+    else:
+        np.subtract(out, modulus, out=out, where=out >= modulus)
+    return out
+
+
+def sum_arrays(arrays, ciph_modulus):
+    """
+    Sum reduced coefficient arrays mod ciph_modulus.
+
+    uint64 arrays are added in place into one running total, reduced only as
+    often as needed to rule out overflow.
+
+    Returns:
+        ndarray, or None if arrays is empty
+    """
+    arrays = list(arrays)
+    if not arrays:
+        return None
+    ciph_modulus = int(ciph_modulus)
+    total = np.array(arrays[0])
+    if total.dtype == object:
+        for array in arrays[1:]:
+            total += array
+        return total % ciph_modulus
+
+    # Number of reduced terms that can be added without overflowing uint64
+    terms = _UINT64_MAX // (ciph_modulus - 1) if ciph_modulus > 1 else len(arrays)
+    if terms < 2:
+        for array in arrays[1:]:
+            add_arrays(array, total, ciph_modulus, out=total)
+        return total
+
+    modulus = np.uint64(ciph_modulus)
+    pending = 1
+    for array in arrays[1:]:
+        if pending == terms:
+            np.remainder(total, modulus, out=total)
+            pending = 1
+        np.add(total, array, out=total)
+        pending += 1
+    return np.remainder(total, modulus, out=total)
+
+
+def switch_modulus(array, from_modulus, to_modulus):
+    """
+    Scale reduced coefficients from one modulus to another, c -> round(c * to / from).
+
+    Applied to both halves of a ciphertext this is BFV modulus switching: the
+    result encrypts the same plaintext mod to_modulus, with the noise scaled
+    by to / from plus a small rounding term (see modulus_switching).
+
+    Returns:
+        ndarray of coefficients reduced mod to_modulus
+    """
+    from_modulus, to_modulus = int(from_modulus), int(to_modulus)
+    scaled = (2 * array.astype(object) * to_modulus + from_modulus) // (2 * from_modulus) % to_modulus
+    return scaled.astype(coefficient_dtype(to_modulus))
@@ -0,0 +1,94 @@
+"""
+Accumulator storage as one database row per ciphertext coefficient.
+
+An alternative to the CiphertextLog/AccumulatorShard storage, chosen per
+questionnaire with accumulator_storage = 'coefficients'. Each coefficient of
+the sum is a row (questionnaire_id, ciphertext_index, component,
+coeff_index, value) in accumulator_coefficients. A group of ballots is added
+with one executemany of
+
+    UPDATE accumulator_coefficients SET value = (value + :delta) % :modulus
+    WHERE <primary key>
+
+so the database does the modular addition. Nothing is read back into Python
+or re-encoded, and concurrent writers never lose each other's additions: on
+PostgreSQL each row is locked only for its own update. There is no log to
+compact.
+
+value is a signed 64-bit BIGINT and value + delta must not overflow it, so
+only cipher moduli below 2^MAX_MODULUS_BITS can use this storage. The rows
+are created, all zero, together with the questionnaire (init_coefficients).
+"""
+
+import numpy as np
+from sqlalchemy import bindparam
+
+from models import AccumulatorCoefficient
+from slot_packing import num_ciphertexts
+
+# value + delta must stay below 2^63
+MAX_MODULUS_BITS = 62
+
+_table = AccumulatorCoefficient.__table__
+
+_ADD_STATEMENT = _table.update().where(
+    _table.c.questionnaire_id == bindparam('q_id'),
+    _table.c.ciphertext_index == bindparam('c_index'),
+    _table.c.component == bindparam('c_component'),
+    _table.c.coeff_index == bindparam('c_coeff')
+).values(value=(_table.c.value + bindparam('delta')) % bindparam('modulus'))
+
+
+def supports(ciph_modulus):
+    """True if sums mod ciph_modulus can be kept in accumulator_coefficients."""
+    return (int(ciph_modulus) - 1).bit_length() <= MAX_MODULUS_BITS
+
+
+def init_coefficients(session, questionnaire):
+    """Insert the zero rows of a new questionnaire's sum; the caller commits."""
+    count = num_ciphertexts(questionnaire.num_questions, questionnaire.questions_per_ciphertext or 1)
+    session.execute(_table.insert(), [
+        {'questionnaire_id': questionnaire.id, 'ciphertext_index': c, 'component': k, 'coeff_index': i, 'value': 0}
+        for c in range(count) for k in range(2) for i in range(questionnaire.poly_degree)
+    ])
+
+
+def add_to_coefficients(session, questionnaire_id, ciph_modulus, array):
+    """
+    Add a (count, 2, degree) array into a questionnaire's rows; the caller commits.
+
+    Zero coefficients are skipped.
+    """
+    modulus = int(ciph_modulus)
+    positions = np.argwhere(array != 0)
+    if not len(positions):
+        return
+    session.execute(_ADD_STATEMENT, [
+        {'q_id': questionnaire_id, 'c_index': int(c), 'c_component': int(k), 'c_coeff': int(i),
+         'delta': int(array[c, k, i]), 'modulus': modulus}
+        for c, k, i in positions
+    ])
+
+
+def load_coefficients(session, questionnaire):
+    """
+    Read a questionnaire's sum back as an array.
+
+    Returns:
+        (ciphertexts, 2, degree) uint64 array, or None if nothing has been added yet
+    """
+    values = [value for (value,) in session.query(AccumulatorCoefficient.value).filter_by(
+        questionnaire_id=questionnaire.id
+    ).order_by(
+        AccumulatorCoefficient.ciphertext_index, AccumulatorCoefficient.component, AccumulatorCoefficient.coeff_index
+    )]
+    if not any(values):
+        return None
+    return np.array(values, dtype=np.uint64).reshape(-1, 2, questionnaire.poly_degree)
+
+
+def delete_coefficients(session, questionnaire_id):
+    """Remove a questionnaire's rows, e.g. once its sum is finalized; the caller commits."""
+    session.query(AccumulatorCoefficient).filter_by(
+        questionnaire_id=questionnaire_id
+    ).delete(synchronize_session=False)
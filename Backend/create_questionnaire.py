@@ -13,21 +13,17 @@ from datetime import datetime, timedelta, timezone
 import secrets
 import json
 
-from models import init_db, get_session, Questionnaire
-from bfv.bfv_key_generator import BFVKeyGenerator
-from bfv.bfv_parameters import BFVParameters
-from util.polynomial import Polynomial
+from models import init_db, get_session, Questionnaire, public_key_digest, DEFAULT_DB_URL
+from crypto_context import get_context, resolve_parameters, PROFILES
+from keypair_pool import KeypairPool
+from accumulator import (ACCUMULATOR_STORAGES, DEFAULT_ACCUMULATOR_STORAGE, STORAGE_LOG, STORAGE_COEFFICIENTS,
+                         STORAGE_MEMMAP)
+from coefficient_table import supports as coefficient_storage_supports, init_coefficients
+from memmap_store import supports as memmap_storage_supports
 
 
-def serialize_polynomial(poly):
-    """Serialize a Polynomial object to JSON."""
-    return {
-        'ring_degree': poly.ring_degree,
-        'coeffs': poly.coeffs
-    }
-
-
-def create_questionnaire(questions, deadline_days=7, link=None):
+def create_questionnaire(questions, deadline_days=7, link=None, num_shards=1, pack_questions=True, profile=None,
+                         accumulator_storage=DEFAULT_ACCUMULATOR_STORAGE):
     """
     Create a new questionnaire with BFV encryption.
     
@@ -35,6 +31,12 @@ def create_questionnaire(questions, deadline_days=7, link=None):
         questions: List of question dicts with 'text' and 'options'
         deadline_days: Number of days until deadline (default: 7)
         link: Custom link (optional, will be generated if not provided)
+        num_shards: Number of accumulator shards responses are spread over
+        pack_questions: Pack several questions into each ciphertext (default: True)
+        profile: Named BFV parameters from crypto_context.PROFILES (default: chosen
+            from the number of questions)
+        accumulator_storage: 'log', 'coefficients' (summed in SQL, see coefficient_table) or
+            'memmap' (summed in the server's accumulator file, see memmap_store)
     
     Returns:
         Questionnaire object
@@ -49,51 +51,50 @@ def create_questionnaire(questions, deadline_days=7, link=None):
         # Set deadline
         deadline = datetime.now(timezone.utc) + timedelta(days=deadline_days)
         
-        # BFV Parameters - adjust these based on security needs
-        degree = 8  # Should be power of 2
-        plain_modulus = 17  # Prime number
-        ciph_modulus = 8000000000000  # Large prime
-        
-        params = BFVParameters(
-            poly_degree=degree,
-            plain_modulus=plain_modulus,
-            ciph_modulus=ciph_modulus
+        # BFV Parameters - a named profile, or a degree chosen from the question count
+        degree, plain_modulus, ciph_modulus, questions_per_ciphertext = resolve_parameters(
+            len(questions), profile=profile, packed=pack_questions
         )
+        params = get_context(degree, plain_modulus, ciph_modulus).params
         
-        print(f"Generating BFV keys with parameters:")
-        params.print_parameters()
+        if accumulator_storage == STORAGE_COEFFICIENTS and not coefficient_storage_supports(ciph_modulus):
+            raise ValueError('The cipher modulus is too large for coefficients storage')
+        if accumulator_storage == STORAGE_MEMMAP and not memmap_storage_supports(ciph_modulus):
+            raise ValueError('The cipher modulus is too large for memmap storage')
+        if accumulator_storage != STORAGE_LOG:
+            num_shards = 1
         
-        # Generate keys
-        key_generator = BFVKeyGenerator(params)
-        public_key = key_generator.public_key
-        secret_key = key_generator.secret_key
-        print("Secret key generated", secret_key)
-        # Serialize keys
-        public_key_json = {
-            'p0': serialize_polynomial(public_key.p0),
-            'p1': serialize_polynomial(public_key.p1)
-        }
+        print(f"BFV parameters:")
+        params.print_parameters()
         
-        secret_key_json = {
-            'coeffs': secret_key.s.coeffs,
-            'ring_degree': secret_key.s.ring_degree
-        }
+        # Take a keypair pre-generated by the server, or generate one now
+        keypair_pool = KeypairPool(DEFAULT_DB_URL)
+        public_key_json, secret_key_json = keypair_pool.take((degree, plain_modulus, ciph_modulus))
+        print("Keypair taken from pool" if keypair_pool.hits else "Keypair generated")
         
         # Create questionnaire
         questionnaire = Questionnaire(
             link=link,
             deadline=deadline,
             questions_json=json.dumps(questions),
+            num_questions=len(questions),
             poly_degree=degree,
             plain_modulus=plain_modulus,
             ciph_modulus=str(ciph_modulus),
-            public_key_json=json.dumps(public_key_json),
-            secret_key_json=json.dumps(secret_key_json),
-            accumulated_responses_json=None,
+            questions_per_ciphertext=questions_per_ciphertext,
+            public_key_json=public_key_json,
+            public_key_sha256=public_key_digest(public_key_json),
+            secret_key_json=secret_key_json,
+            accumulated_responses_blob=None,
+            num_shards=num_shards,
+            accumulator_storage=accumulator_storage,
             num_responses=0
         )
         
         session.add(questionnaire)
+        if accumulator_storage == STORAGE_COEFFICIENTS:
+            session.flush()
+            init_coefficients(session, questionnaire)
         session.commit()
         
         # Store data before closing session to avoid DetachedInstanceError
@@ -122,7 +123,7 @@ def create_questionnaire(questions, deadline_days=7, link=None):
         session.close()
 
 
-def example_questionnaire():
+def example_questionnaire(profile=None, accumulator_storage=DEFAULT_ACCUMULATOR_STORAGE):
     """Create an example questionnaire."""
     questions = [
         {
@@ -143,10 +144,18 @@ def example_questionnaire():
         }
     ]
     
-    return create_questionnaire(questions, deadline_days=30)
+    return create_questionnaire(questions, deadline_days=30, profile=profile, accumulator_storage=accumulator_storage)
 
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Create an example encrypted questionnaire')
+    parser.add_argument('--profile', choices=list(PROFILES), help='BFV parameter profile (default: chosen from the questions)')
+    parser.add_argument('--storage', choices=list(ACCUMULATOR_STORAGES), default=DEFAULT_ACCUMULATOR_STORAGE,
+                        help='Accumulator storage (default: log)')
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("Creating Example Questionnaire")
     print("=" * 60)
@@ -155,7 +164,7 @@ if __name__ == '__main__':
     init_db()
     
     # Create example questionnaire
-    questionnaire = example_questionnaire()
+    questionnaire = example_questionnaire(args.profile, args.storage)
     
     if questionnaire:
         print("\n" + "=" * 60)
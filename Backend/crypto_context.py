@@ -0,0 +1,251 @@
+"""
+Named BFV parameter profiles and process-wide caches of prepared crypto contexts.
+
+Building BFVParameters, a BatchEncoder (with its NTT tables) and a
+BFVEvaluator costs far more than using them, so each distinct parameter set
+is prepared once and shared by the API, the CLIs and the debug scripts.
+Contexts hold no key material and are safe to share between threads.
+
+A questionnaire's secret key is parsed into a KeyContext (the key, its
+decryptor, and its coefficients as an array for modulus switching) by
+secret_keys, a bounded LRU cache whose entries also expire after
+KEY_CACHE_TTL seconds unused. An entry is pinned while acquired; once it is
+evicted, expired or discarded and no longer in use, its key coefficients
+are overwritten with zeros and its decryptor is dropped.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+from bfv.batch_encoder import BatchEncoder
+from bfv.bfv_decryptor import BFVDecryptor
+from bfv.bfv_evaluator import BFVEvaluator
+from bfv.bfv_parameters import BFVParameters
+from util.polynomial import Polynomial
+from util.secret_key import SecretKey
+
+from serialization import params_id
+from slot_packing import choose_parameters, OPTIONS_PER_QUESTION
+
+# Profile name -> (poly_degree, plain_modulus, ciph_modulus). Every plain
+# modulus is a prime congruent to 1 mod 2 * degree for batching, and every
+# degree * ciph_modulus stays below 2^53 so the frontend's arithmetic is exact.
+PROFILES = {
+    'small': (8, 17, 8000000000000),
+    'medium': (2048, 12289, 2000000000000),
+    'large': (8192, 65537, 500000000000),
+}
+
+# Distinct parameter sets kept prepared at once
+CONTEXT_CACHE_SIZE = 16
+
+# Questionnaire secret keys kept parsed at once, and seconds an unused one is kept
+KEY_CACHE_SIZE = 32
+KEY_CACHE_TTL = 300.0
+
+
+class CryptoContext:
+    """Prepared BFV parameters, batch encoder and evaluator for one parameter set."""
+
+    def __init__(self, poly_degree, plain_modulus, ciph_modulus):
+        self.params = BFVParameters(
+            poly_degree=poly_degree,
+            plain_modulus=plain_modulus,
+            ciph_modulus=ciph_modulus
+        )
+        self.encoder = BatchEncoder(self.params)
+        self.evaluator = BFVEvaluator(self.params)
+        self.params_tuple = (poly_degree, plain_modulus, ciph_modulus)
+        self.params_id = params_id(poly_degree, plain_modulus, ciph_modulus)
+
+    def decryptor(self, secret_key_data):
+        """Build a decryptor from a serialized secret key ({'ring_degree', 'coeffs'})."""
+        secret_key_poly = Polynomial(secret_key_data['ring_degree'], secret_key_data['coeffs'])
+        return BFVDecryptor(self.params, SecretKey(secret_key_poly))
+
+    def decode_all(self, decryptor, ciphertexts):
+        """Decrypt and batch-decode ciphertexts into their slot vectors."""
+        return [self.encoder.decode(decryptor.decrypt(ciphertext)) for ciphertext in ciphertexts]
+
+
+@lru_cache(maxsize=CONTEXT_CACHE_SIZE)
+def get_context(poly_degree, plain_modulus, ciph_modulus):
+    """Return the shared CryptoContext for a parameter set, preparing it on first use."""
+    return CryptoContext(poly_degree, plain_modulus, int(ciph_modulus))
+
+
+def context_for(questionnaire):
+    """Shared CryptoContext for a questionnaire's stored parameters."""
+    return get_context(questionnaire.poly_degree, questionnaire.plain_modulus, int(questionnaire.ciph_modulus))
+
+
+class KeyContext:
+    """One questionnaire's parsed secret key and decryptor over a shared CryptoContext."""
+
+    def __init__(self, context, secret_key_json):
+        self.context = context
+        secret_key_data = json.loads(secret_key_json)
+        coeffs = secret_key_data['coeffs']
+        self.secret_key = SecretKey(Polynomial(secret_key_data['ring_degree'], list(coeffs)))
+        self.decryptor = BFVDecryptor(context.params, self.secret_key)
+        self.secret_coeffs = np.array(coeffs, dtype=np.int64)
+        coeffs[:] = [0] * len(coeffs)
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.evicted = False
+
+    def decode_all(self, ciphertexts):
+        """Decrypt and batch-decode ciphertexts into their slot vectors."""
+        return self.context.decode_all(self.decryptor, ciphertexts)
+
+    def zeroize(self):
+        """Overwrite the key coefficients and drop the decryptor."""
+        coeffs = self.secret_key.s.coeffs
+        coeffs[:] = [0] * len(coeffs)
+        self.secret_coeffs.fill(0)
+        self.decryptor = None
+
+
+class KeyCache:
+    """
+    Thread-safe LRU/TTL cache of KeyContexts, keyed by parameters and a digest of the key.
+
+    acquire() pins an entry for the duration of a with block; a pinned entry
+    that is evicted is zeroized when its last user releases it. discard()
+    drops a key that will not be needed again, e.g. once a questionnaire's
+    results are final.
+    """
+
+    def __init__(self, max_entries=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'discards': 0}
+
+    @contextmanager
+    def acquire(self, params, secret_key_json):
+        """Yield the KeyContext for a parameter tuple and serialized secret key."""
+        cache_key = self._cache_key(params, secret_key_json)
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self._stats['hits'] += 1
+                entry.users += 1
+        if entry is None:
+            # Parse outside the lock; a racing miss for the same key keeps the first entry
+            built = KeyContext(get_context(*params), secret_key_json)
+            with self._lock:
+                self._stats['misses'] += 1
+                entry = self._entries.get(cache_key)
+                if entry is None:
+                    entry = self._entries[cache_key] = built
+                    while len(self._entries) > self.max_entries:
+                        self._remove_locked(next(iter(self._entries)), 'evictions')
+                    self._schedule_sweep_locked()
+                entry.users += 1
+            if entry is not built:
+                built.zeroize()
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                if entry.evicted and entry.users == 0:
+                    entry.zeroize()
+
+    def discard(self, params, secret_key_json):
+        """Drop and zeroize a cached key, if present."""
+        with self._lock:
+            self._remove_locked(self._cache_key(params, secret_key_json), 'discards')
+
+    def clear(self):
+        """Drop and zeroize every cached key."""
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._remove_locked(cache_key, 'discards')
+
+    def stats(self):
+        """Entries, hit rate and eviction counts, plus the parameter-set cache's hits."""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            contexts = get_context.cache_info()
+            return dict(self._stats, entries=len(self._entries),
+                        hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else None,
+                        context_hits=contexts.hits, context_misses=contexts.misses)
+
+    @staticmethod
+    def _cache_key(params, secret_key_json):
+        poly_degree, plain_modulus, ciph_modulus = params
+        digest = hashlib.blake2b(secret_key_json.encode(), digest_size=16).digest()
+        return int(poly_degree), int(plain_modulus), int(ciph_modulus), digest
+
+    def _remove_locked(self, cache_key, reason):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        self._stats[reason] += 1
+        entry.evicted = True
+        if entry.users == 0:
+            entry.zeroize()
+
+    def _expire_locked(self, now):
+        for cache_key, entry in list(self._entries.items()):
+            if entry.users == 0 and now - entry.last_used >= self.ttl:
+                self._remove_locked(cache_key, 'expirations')
+
+    def _schedule_sweep_locked(self):
+        # Expire idle keys even when no further lookups come
+        if self._timer is None and self._entries:
+            self._timer = threading.Timer(self.ttl, self._sweep)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _sweep(self):
+        with self._lock:
+            self._timer = None
+            self._expire_locked(time.monotonic())
+            self._schedule_sweep_locked()
+
+
+# Process-wide cache of parsed questionnaire keys
+secret_keys = KeyCache()
+
+
+def resolve_parameters(num_questions, profile=None, packed=True):
+    """
+    Pick BFV parameters and slot layout for a new questionnaire.
+
+    Without a profile the degree is chosen from the question count (see
+    slot_packing.choose_parameters). A named profile fixes the parameters and
+    packs as many questions per ciphertext as its degree allows.
+
+    Args:
+        num_questions: Number of questions
+        profile: Name from PROFILES, or None for automatic
+        packed: Pack several questions per ciphertext (default: True)
+
+    Returns:
+        (poly_degree, plain_modulus, ciph_modulus, questions_per_ciphertext) tuple
+
+    Raises:
+        ValueError: If the profile is unknown
+    """
+    if profile is None:
+        return choose_parameters(num_questions, packed=packed)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}' (expected one of {', '.join(PROFILES)})")
+    poly_degree, plain_modulus, ciph_modulus = PROFILES[profile]
+    questions_per_ciphertext = poly_degree // OPTIONS_PER_QUESTION if packed else 1
+    return poly_degree, plain_modulus, ciph_modulus, questions_per_ciphertext
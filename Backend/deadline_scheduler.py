@@ -0,0 +1,160 @@
+"""
+Deadline scheduler for the final decryption of questionnaires.
+
+Pending deadlines live in a min-heap. A single thread sleeps until the
+earliest one has passed and then calls the handler for that questionnaire,
+so decryption starts when a deadline passes instead of on the next polling
+tick, and no work is done while nothing is due.
+
+The heap is filled from an indexed (is_decrypted, deadline) query when the
+scheduler starts, which also picks up deadlines that passed while the server
+was down. New questionnaires are added with schedule(). Questionnaires created
+by another process (e.g. create_questionnaire.py) are found by a periodic
+resync that only looks at deadlines due before the next resync.
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import or_
+
+from models import get_session, remove_session, Questionnaire
+
+# Seconds to wait after a deadline before firing, so submissions accepted just
+# before it have been added to the write-behind buffer
+DEADLINE_GRACE = 2.0
+
+# Seconds between resyncs with the database
+RESYNC_INTERVAL = 300.0
+
+# Seconds before a failed handler is retried
+RETRY_DELAY = 60.0
+
+
+def _timestamp(deadline):
+    """POSIX timestamp of a deadline; naive datetimes are UTC."""
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return deadline.timestamp()
+
+
+class DeadlineScheduler:
+    """
+    Min-heap of (deadline, link) with one thread firing each deadline as it passes.
+
+    The handler is called as handler(link) on the scheduler thread. It should
+    return True when the questionnaire is done; False or an exception retries
+    it after RETRY_DELAY seconds.
+    """
+
+    def __init__(self, db_url, handler, grace=DEADLINE_GRACE, resync_interval=RESYNC_INTERVAL,
+                 retry_delay=RETRY_DELAY):
+        self.db_url = db_url
+        self.handler = handler
+        self.grace = grace
+        self.resync_interval = resync_interval
+        self.retry_delay = retry_delay
+        self._heap = []          # (fire time, link)
+        self._scheduled = {}     # link -> fire time of its live heap entry
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._next_resync = 0.0
+
+    def start(self):
+        """Load pending deadlines from the database and start the scheduler thread."""
+        self._resync()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler thread; a handler already running is allowed to finish."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def schedule(self, link, deadline):
+        """Fire the handler for link once deadline (a datetime) has passed."""
+        self._push(link, _timestamp(deadline) + self.grace)
+
+    def retry(self, link):
+        """Fire the handler for link again after the retry delay."""
+        self._push(link, time.time() + self.retry_delay)
+
+    def pending(self):
+        """Number of questionnaires waiting for their deadline."""
+        with self._condition:
+            return len(self._scheduled)
+
+    def _push(self, link, fire_at):
+        with self._condition:
+            # A later push replaces the earlier entry, which is skipped when popped
+            self._scheduled[link] = fire_at
+            heapq.heappush(self._heap, (fire_at, link))
+            if self._heap[0][1] == link:
+                self._condition.notify()
+
+    def _resync(self):
+        """Schedule undecrypted questionnaires due before the next resync."""
+        now = time.time()
+        horizon = datetime.fromtimestamp(now + self.resync_interval, timezone.utc).replace(tzinfo=None)
+        session = get_session(self.db_url)
+        try:
+            rows = session.query(Questionnaire.link, Questionnaire.deadline).filter(
+                Questionnaire.is_decrypted == 0,
+                Questionnaire.deadline <= horizon,
+                or_(Questionnaire.num_responses > 0,
+                    Questionnaire.deadline > datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None))
+            ).order_by(Questionnaire.deadline).all()
+        finally:
+            remove_session(self.db_url)
+
+        with self._condition:
+            known = set(self._scheduled)
+        for link, deadline in rows:
+            if link not in known:
+                self.schedule(link, deadline)
+        self._next_resync = now + self.resync_interval
+
+    def _pop_due(self):
+        """Wait for the next due link; returns None when stopped or a resync is due."""
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                if now >= self._next_resync:
+                    return None
+                while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)  # superseded entry
+                if self._heap and self._heap[0][0] <= now:
+                    fire_at, link = heapq.heappop(self._heap)
+                    del self._scheduled[link]
+                    return link
+                wake_at = min(self._heap[0][0] if self._heap else self._next_resync, self._next_resync)
+                self._condition.wait(wake_at - now)
+            return None
+
+    def _run(self):
+        while True:
+            link = self._pop_due()
+            with self._condition:
+                if self._stopped:
+                    return
+            if link is None:
+                try:
+                    self._resync()
+                except Exception as e:
+                    print(f"Error loading questionnaire deadlines: {e}")
+                    self._next_resync = time.time() + self.retry_delay
+                continue
+
+            try:
+                done = self.handler(link)
+            except Exception as e:
+                print(f"Error handling deadline for {link}: {e}")
+                done = False
+            if not done:
+                self.retry(link)
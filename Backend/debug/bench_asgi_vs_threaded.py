@@ -0,0 +1,209 @@
+"""
+Load comparison of the threaded Flask server and the ASGI server (asgi_app.py).
+
+Each server is started in its own process on a throwaway database and driven
+by the same concurrent mix of questionnaire fetches, stats requests and
+ballot submissions. Throughput and latency percentiles are reported per
+server and concurrency level.
+
+TLS is left out so that both servers see the same plain HTTP load; the client
+certificate fingerprint is taken from an X-Bench-Client header instead.
+Background services (keypair pool, deadline scheduler) are not started.
+
+Usage:
+    python debug/bench_asgi_vs_threaded.py [requests_per_level] [concurrency ...]
+"""
+import sys
+import os
+import http.client
+import json
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path for imports
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'py-fhe'))
+
+NUM_QUESTIONS = 4
+BASE_PORT = 5600
+
+
+def serve(kind, port):
+    """Run one server in this process (called in the child)."""
+    if kind == 'threaded':
+        from werkzeug.serving import run_simple
+        import app as app_module
+
+        def with_bench_client(environ, start_response):
+            client = environ.get('HTTP_X_BENCH_CLIENT')
+            if client:
+                import hashlib
+                environ['peercert_fingerprint'] = hashlib.sha256(client.encode()).hexdigest()
+            return app_module.app(environ, start_response)
+
+        run_simple('127.0.0.1', port, with_bench_client, threaded=True)
+    else:
+        import uvicorn
+        import asgi_app
+
+        async def with_bench_client(scope, receive, send):
+            if scope['type'] == 'http':
+                client = dict(scope['headers']).get(b'x-bench-client')
+                if client:
+                    # Hashes to sha256(client), like the threaded shim
+                    scope.setdefault('extensions', {})['tls'] = {'client_cert_chain': [ssl.DER_cert_to_PEM_cert(client)]}
+            await asgi_app.app(scope, receive, send)
+
+        uvicorn.run(with_bench_client, host='127.0.0.1', port=port, lifespan='off', log_level='warning')
+
+
+def request_json(port, method, path, data=None):
+    """One request on a fresh connection; returns (status, decoded JSON body)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    try:
+        body = json.dumps(data) if data is not None else None
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        res = conn.getresponse()
+        return res.status, json.loads(res.read())
+    finally:
+        conn.close()
+
+
+def start_server(kind, port):
+    workdir = tempfile.mkdtemp(prefix=f'bench_{kind}_')
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', kind, str(port)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(200):
+        try:
+            request_json(port, 'GET', '/api/health')
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{kind} server did not start')
+
+
+def make_ballots(data, count):
+    from crypto_context import get_context
+    from serialization import deserialize_public_key, serialize_ciphertext
+    from slot_packing import pack_answers
+    from bfv.bfv_encryptor import BFVEncryptor
+
+    params_data = data['params']
+    context = get_context(params_data['poly_degree'], params_data['plain_modulus'], params_data['ciph_modulus'])
+    public_key = deserialize_public_key(data['public_key'], context.params.ciph_modulus)
+    encryptor = BFVEncryptor(context.params, public_key)
+    ballots = []
+    for i in range(count):
+        answers = [(i + q) % 8 for q in range(NUM_QUESTIONS)]
+        vectors = pack_answers(answers, context.params.poly_degree, params_data['questions_per_ciphertext'])
+        ballots.append([serialize_ciphertext(encryptor.encrypt(context.encoder.encode(v))) for v in vectors])
+    return ballots
+
+
+def run_level(port, link, ballots, num_requests, concurrency, offset):
+    """Send num_requests mixed requests from concurrency keep-alive connections."""
+    latencies = {'fetch': [], 'stats': [], 'submit': []}
+    errors = []
+    indices = iter(range(num_requests))
+    lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                i = next(indices, None)
+            if i is None:
+                break
+            kind = ('fetch', 'stats', 'submit')[i % 3]
+            start = time.perf_counter()
+            if kind == 'fetch':
+                conn.request('GET', f'/api/questionnaire/{link}')
+            elif kind == 'stats':
+                conn.request('GET', f'/api/questionnaire/{link}/stats')
+            else:
+                n = offset + i
+                body = json.dumps({'questionnaire_id': link, 'encrypted_answers': ballots[n % len(ballots)]})
+                conn.request('POST', '/api/submit-answers', body=body, headers={
+                    'Content-Type': 'application/json', 'X-Bench-Client': f'client-{n}'
+                })
+            res = conn.getresponse()
+            res.read()
+            latencies[kind].append(time.perf_counter() - start)
+            if res.status != 200:
+                errors.append(res.status)
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, len(errors)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    levels = [int(v) for v in sys.argv[2:]] or [8, 64]
+
+    results = {}
+    ballots = None
+    for index, kind in enumerate(('threaded', 'asgi')):
+        port = BASE_PORT + index
+        process = start_server(kind, port)
+        try:
+            deadline = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+            status, created = request_json(port, 'POST', '/api/create-questionnaire', {
+                'questions': [{'text': f'Q{i}', 'options': [f'O{j}' for j in range(8)]} for i in range(NUM_QUESTIONS)],
+                'deadline_datetime': deadline,
+                'link': 'bench'
+            })
+            assert status == 200, created
+            _, data = request_json(port, 'GET', '/api/questionnaire/bench')
+            _, data['public_key'] = request_json(port, 'GET', data['public_key_url'])
+            if ballots is None:
+                print(f"Encrypting {min(num_requests, 64)} ballots (degree {data['params']['poly_degree']})...")
+                ballots = make_ballots(data, min(num_requests, 64))
+            else:
+                # Same parameters, but each server generated its own keys
+                ballots = make_ballots(data, len(ballots))
+
+            offset = 0
+            for concurrency in levels:
+                results[kind, concurrency] = run_level(port, 'bench', ballots, num_requests, concurrency, offset)
+                offset += num_requests
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"\n{num_requests} requests per level (fetch/stats/submit in equal parts)\n")
+    print(f"{'server':>9} {'conc':>5} {'req/s':>8} {'errors':>6}   "
+          f"{'fetch p50/p99 ms':>17} {'stats p50/p99 ms':>17} {'submit p50/p99 ms':>18}")
+    for concurrency in levels:
+        for kind in ('threaded', 'asgi'):
+            elapsed, latencies, errors = results[kind, concurrency]
+            cells = [f"{statistics.median(v) * 1000:7.1f}/{percentile(v, 0.99) * 1000:<7.1f}"
+                     for v in (latencies['fetch'], latencies['stats'], latencies['submit'])]
+            print(f"{kind:>9} {concurrency:>5} {num_requests / elapsed:8.1f} {errors:>6}   "
+                  f"{cells[0]:>17} {cells[1]:>17} {cells[2]:>18}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
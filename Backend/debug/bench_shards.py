@@ -0,0 +1,109 @@
+"""
+Benchmark concurrent submission throughput against the number of accumulator shards.
+
+Every submitting thread waits until its ballot is written, as the API does.
+The questionnaire's single writer commits whatever has queued up meanwhile,
+appending one log row per shard touched, so the shard count mostly changes
+the number of rows per transaction.
+
+Usage:
+    python debug/bench_shards.py [--threads 8] [--ballots 400] [--db-url sqlite:///bench.db]
+"""
+import sys
+import os
+import argparse
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'py-fhe'))
+
+from models import init_db, get_session, remove_session, Questionnaire
+from accumulator import AccumulationBuffer
+from bfv.batch_encoder import BatchEncoder
+from bfv.bfv_encryptor import BFVEncryptor
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+
+NUM_QUESTIONS = 4
+SHARD_COUNTS = [1, 2, 4, 8, 16]
+
+
+def create_questionnaire(db_url, params, num_shards):
+    session = get_session(db_url)
+    questionnaire = Questionnaire(
+        link=f'bench-shards-{num_shards}-{time.time_ns()}',
+        deadline=datetime.now(timezone.utc) + timedelta(days=1),
+        questions_json='[]',
+        num_questions=0,
+        poly_degree=params.poly_degree,
+        plain_modulus=params.plain_modulus,
+        ciph_modulus=str(params.ciph_modulus),
+        public_key_json='{}',
+        secret_key_json='{}',
+        num_shards=num_shards,
+        num_responses=0
+    )
+    session.add(questionnaire)
+    session.commit()
+    session.refresh(questionnaire)
+    session.expunge(questionnaire)
+    remove_session(db_url)
+    return questionnaire
+
+
+def run(db_url, questionnaire, ballots, num_threads, num_ballots):
+    buffer = AccumulationBuffer(db_url)
+    counter = iter(range(num_ballots))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            buffer.submit(questionnaire, ballots[i % len(ballots)], f'{i:064x}').result()
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    buffer.stop()
+    return num_ballots / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark submission throughput vs shard count')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ballots', type=int, default=400)
+    parser.add_argument('--db-url', type=str, default=None)
+    args = parser.parse_args()
+
+    db_url = args.db_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_shards.db')}"
+    init_db(db_url)
+
+    params = BFVParameters(poly_degree=8, plain_modulus=17, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = BatchEncoder(params)
+    encryptor = BFVEncryptor(params, key_generator.public_key)
+    ballots = []
+    for b in range(16):
+        ballot = []
+        for q in range(NUM_QUESTIONS):
+            vec = [0] * params.poly_degree
+            vec[(b + q) % 8] = 1
+            ballot.append(encryptor.encrypt(encoder.encode(vec)))
+        ballots.append(ballot)
+
+    print(f"{args.ballots} ballots, {args.threads} submitting threads, {db_url}\n")
+    for num_shards in SHARD_COUNTS:
+        questionnaire = create_questionnaire(db_url, params, num_shards)
+        throughput = run(db_url, questionnaire, ballots, args.threads, args.ballots)
+        print(f"  K={num_shards:3d}: {throughput:8.1f} ballots/s")
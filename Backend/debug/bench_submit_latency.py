@@ -0,0 +1,106 @@
+"""
+Benchmark per-request latency of /api/submit-answers.
+
+Compares the legacy behaviour (a new engine and sessionmaker per call to
+get_session) against the shared pooled engine with scoped sessions.
+
+Usage:
+    python debug/bench_submit_latency.py [num_requests]
+"""
+import sys
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'py-fhe'))
+
+# Work in a throwaway directory so the real questionnaires.db is untouched
+os.chdir(tempfile.mkdtemp(prefix='bench_submit_'))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app as app_module
+from crypto_context import get_context
+from serialization import deserialize_public_key
+from slot_packing import pack_answers
+from bfv.bfv_encryptor import BFVEncryptor
+
+NUM_QUESTIONS = 4
+
+
+def legacy_get_session(db_url='sqlite:///questionnaires.db'):
+    """Per-call engine creation, as get_session() used to do."""
+    engine = create_engine(db_url, echo=False)
+    Session = sessionmaker(bind=engine)
+    return Session()
+
+
+def create_questionnaire(client, link):
+    deadline = (datetime.now(timezone.utc) + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+    questions = [{'text': f'Q{i}', 'options': [f'O{j}' for j in range(8)]} for i in range(NUM_QUESTIONS)]
+    res = client.post('/api/create-questionnaire', json={
+        'questions': questions,
+        'deadline_datetime': deadline,
+        'link': link
+    })
+    assert res.status_code == 200, res.get_json()
+    data = client.get(f'/api/questionnaire/{link}').get_json()
+    data['public_key'] = client.get(data['public_key_url']).get_json()
+    return data
+
+
+def make_ballots(data, count):
+    params_data = data['params']
+    context = get_context(params_data['poly_degree'], params_data['plain_modulus'], params_data['ciph_modulus'])
+    public_key = deserialize_public_key(data['public_key'], context.params.ciph_modulus)
+    encryptor = BFVEncryptor(context.params, public_key)
+
+    ballots = []
+    for b in range(count):
+        choices = [(b + q) % 8 for q in range(NUM_QUESTIONS)]
+        vectors = pack_answers(choices, params_data['poly_degree'], params_data['questions_per_ciphertext'])
+        ballots.append([app_module.serialize_ciphertext(encryptor.encrypt(context.encoder.encode(vec)))
+                        for vec in vectors])
+    return ballots
+
+
+def run(label, client, link, ballots, offset):
+    latencies = []
+    for i, answers in enumerate(ballots):
+        fingerprint = f'{offset + i:064x}'
+        start = time.perf_counter()
+        res = client.post(
+            '/api/submit-answers',
+            json={'questionnaire_id': link, 'encrypted_answers': answers},
+            environ_overrides={'peercert_fingerprint': fingerprint}
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert res.status_code == 200, res.get_json()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:>16s}: mean {statistics.mean(latencies):7.2f} ms | "
+          f"p50 {statistics.median(latencies):7.2f} ms | p95 {p95:7.2f} ms")
+
+
+if __name__ == '__main__':
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    client = app_module.app.test_client()
+
+    data = create_questionnaire(client, 'bench-legacy')
+    ballots = make_ballots(data, num_requests)
+
+    print(f"Submitting {num_requests} ballots x {NUM_QUESTIONS} questions\n")
+
+    shared_get_session = app_module.get_session
+    app_module.get_session = legacy_get_session
+    run('per-call engine', client, 'bench-legacy', ballots, 0)
+
+    app_module.get_session = shared_get_session
+    data = create_questionnaire(client, 'bench-pooled')
+    run('pooled engine', client, 'bench-pooled', make_ballots(data, num_requests), num_requests)
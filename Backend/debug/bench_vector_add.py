@@ -0,0 +1,83 @@
+"""
+Compare accumulating a ballot with BFVEvaluator.add per question against the
+vectorized coefficient-array add, and check both give identical sums.
+
+Usage:
+    python debug/bench_vector_add.py [num_ballots]
+"""
+import sys
+import os
+import random
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'py-fhe'))
+
+from ciphertext_arrays import add_arrays, sum_arrays
+from serialization import ciphertexts_to_array
+from bfv.bfv_evaluator import BFVEvaluator
+from bfv.bfv_parameters import BFVParameters
+from util.ciphertext import Ciphertext
+from util.polynomial import Polynomial
+
+# (poly_degree, plain_modulus, ciph_modulus, number of questions)
+CASES = [
+    (8, 17, 8000000000000, 4),
+    (8, 17, 8000000000000, 50),
+    (2048, 12289, 2000000000000, 4),
+    (8, 17, (1 << 64) - 59, 20),   # uint64 with wraparound correction
+    (8, 17, (1 << 89) - 1, 20),    # object arrays
+]
+
+
+def random_ciphertext(degree, modulus):
+    c0 = Polynomial(degree, [random.randrange(modulus) for _ in range(degree)])
+    c1 = Polynomial(degree, [random.randrange(modulus) for _ in range(degree)])
+    return Ciphertext(c0, c1)
+
+
+def evaluator_sum(evaluator, ballots):
+    """The old per-question loop."""
+    total = ballots[0]
+    for ballot in ballots[1:]:
+        total = [evaluator.add(acc, new) for acc, new in zip(total, ballot)]
+    return total
+
+
+def array_sum(ballots, ciph_modulus):
+    """Running sum as PendingGroup keeps it: one array add per ballot."""
+    total = ballots[0].copy()
+    for ballot in ballots[1:]:
+        add_arrays(ballot, total, ciph_modulus, out=total)
+    return total
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+if __name__ == '__main__':
+    num_ballots = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print(f"Accumulating {num_ballots} ballots\n")
+    print(f"{'degree':>6s} {'questions':>9s} {'modulus bits':>12s} | {'evaluator':>10s} {'array add':>10s} "
+          f"{'sum_arrays':>10s} {'speedup':>8s} | identical")
+    for degree, plain_modulus, ciph_modulus, num_questions in CASES:
+        params = BFVParameters(poly_degree=degree, plain_modulus=plain_modulus, ciph_modulus=ciph_modulus)
+        evaluator = BFVEvaluator(params)
+        ballots = [[random_ciphertext(degree, ciph_modulus) for _ in range(num_questions)]
+                   for _ in range(num_ballots)]
+        arrays = [ciphertexts_to_array(ballot, ciph_modulus) for ballot in ballots]
+
+        expected, evaluator_time = timed(lambda: evaluator_sum(evaluator, ballots))
+        running, array_time = timed(lambda: array_sum(arrays, ciph_modulus))
+        reduced, sum_time = timed(lambda: sum_arrays(arrays, ciph_modulus))
+
+        expected = ciphertexts_to_array(expected, ciph_modulus).tolist()
+        identical = running.tolist() == expected and reduced.tolist() == expected
+        print(f"{degree:6d} {num_questions:9d} {ciph_modulus.bit_length():12d} | {evaluator_time:8.2f}ms "
+              f"{array_time:8.2f}ms {sum_time:8.2f}ms {evaluator_time / array_time:7.1f}x | {identical}")
+        assert identical, 'vectorized sum differs from BFVEvaluator.add'
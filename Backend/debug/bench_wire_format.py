@@ -0,0 +1,67 @@
+"""
+Compare the JSON and binary ballot formats: payload size and server-side parse time.
+
+Usage:
+    python debug/bench_wire_format.py
+"""
+import sys
+import os
+import json
+import random
+import timeit
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'py-fhe'))
+
+from serialization import encode_ballot, decode_ballot, deserialize_ciphertext
+from util.ciphertext import Ciphertext
+from util.polynomial import Polynomial
+
+# (poly_degree, plain_modulus, ciph_modulus, number of questions)
+CASES = [
+    (8, 17, 8000000000000, 4),
+    (8, 17, 8000000000000, 20),
+    (8, 17, 8000000000000, 50),
+    (2048, 12289, 2000000000000, 4),
+]
+
+
+def random_ciphertext(degree, modulus):
+    c0 = Polynomial(degree, [random.randrange(modulus) for _ in range(degree)])
+    c1 = Polynomial(degree, [random.randrange(modulus) for _ in range(degree)])
+    return Ciphertext(c0, c1)
+
+
+def json_ballot(link, ciphertexts):
+    """Same shape as the frontend's Ciphertext.toJSON() request body."""
+    return json.dumps({
+        'questionnaire_id': link,
+        'encrypted_answers': [
+            {'c0': {'ringDegree': c.c0.ring_degree, 'coeffs': c.c0.coeffs},
+             'c1': {'ringDegree': c.c1.ring_degree, 'coeffs': c.c1.coeffs}}
+            for c in ciphertexts
+        ]
+    }).encode()
+
+
+def parse_json(body):
+    data = json.loads(body)
+    return [deserialize_ciphertext(c) for c in data['encrypted_answers']]
+
+
+if __name__ == '__main__':
+    link = 'Xk3v9QmZpL2aB7cD1eF4gH'
+    print(f"{'degree':>6s} {'questions':>9s} | {'json bytes':>10s} {'binary bytes':>12s} {'ratio':>6s} | "
+          f"{'json parse':>10s} {'binary parse':>12s}")
+    for degree, plain_modulus, ciph_modulus, num_questions in CASES:
+        ciphertexts = [random_ciphertext(degree, ciph_modulus) for _ in range(num_questions)]
+        as_json = json_ballot(link, ciphertexts)
+        as_binary = encode_ballot(link, (degree, plain_modulus, ciph_modulus), ciphertexts)
+
+        runs = max(3, 2000 // (degree * num_questions // 8))
+        json_time = timeit.timeit(lambda: parse_json(as_json), number=runs) / runs * 1000
+        binary_time = timeit.timeit(lambda: decode_ballot(as_binary), number=runs) / runs * 1000
+
+        print(f"{degree:6d} {num_questions:9d} | {len(as_json):10d} {len(as_binary):12d} "
+              f"{len(as_json) / len(as_binary):5.1f}x | {json_time:8.3f}ms {binary_time:10.3f}ms")
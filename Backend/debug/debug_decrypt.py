@@ -8,10 +8,11 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import sqlite3
 import json
-from bfv.bfv_parameters import BFVParameters
 from bfv.bfv_decryptor import BFVDecryptor
-from bfv.batch_encoder import BatchEncoder
-from util.ciphertext import Ciphertext
+from models import get_session, Questionnaire
+from accumulator import load_accumulated
+from slot_packing import unpack_slots
+from crypto_context import get_context
 from util.polynomial import Polynomial
 from util.secret_key import SecretKey
 
@@ -54,7 +55,7 @@ else:
 # Get questionnaire details
 cursor.execute("""
     SELECT poly_degree, plain_modulus, ciph_modulus,
-           secret_key_json, accumulated_responses_json, num_responses
+           secret_key_json, num_responses
     FROM questionnaires
     WHERE link = ?
 """, (selected_link,))
@@ -66,7 +67,7 @@ if not result:
     print("Error: Could not retrieve questionnaire details!")
     sys.exit(1)
 
-poly_degree, plain_modulus, ciph_modulus, secret_key_json, accumulated_json, num_responses = result
+poly_degree, plain_modulus, ciph_modulus, secret_key_json, num_responses = result
 
 print("="*80)
 print("DEBUGGING DECRYPTION")
@@ -77,12 +78,9 @@ print(f"  poly_degree: {poly_degree}")
 print(f"  plain_modulus: {plain_modulus}")
 print(f"  ciph_modulus: {ciph_modulus}")
 
-# Create parameters
-params = BFVParameters(
-    poly_degree=poly_degree,
-    plain_modulus=plain_modulus,
-    ciph_modulus=int(ciph_modulus)
-)
+# Shared parameters and encoder for this parameter set
+context = get_context(poly_degree, plain_modulus, int(ciph_modulus))
+params = context.params
 
 print(f"\nBFVParameters created")
 print(f"  scaling_factor: {params.scaling_factor}")
@@ -100,28 +98,25 @@ print(f"\nSecret key reconstructed")
 
 # Create decryptor and encoder
 decryptor = BFVDecryptor(params, secret_key)
-encoder = BatchEncoder(params)
+encoder = context.encoder
 
 print(f"\nDecryptor and Encoder created")
 
-# Get accumulated responses
-accumulated = json.loads(accumulated_json)
+# Get accumulated responses (sum of shards and log entries)
+session = get_session(f'sqlite:///{db_path}')
+questionnaire = session.query(Questionnaire).filter_by(link=selected_link).one()
+accumulated = load_accumulated(session, questionnaire)
+num_questions = len(questionnaire.get_questions())
+questions_per_ciphertext = questionnaire.questions_per_ciphertext or 1
+session.close()
 
 print(f"\n{'='*80}")
-print(f"DECRYPTING {len(accumulated)} QUESTIONS")
+print(f"DECRYPTING {len(accumulated)} CIPHERTEXTS ({num_questions} questions, {questions_per_ciphertext} per ciphertext)")
 print(f"{'='*80}")
 
-for i, ciph_data in enumerate(accumulated):
-    print(f"\n--- Pregunta {i+1} ---")
-    
-    # Reconstruct ciphertext
-    c0 = Polynomial(ciph_data['c0']['ring_degree'], ciph_data['c0']['coeffs'])
-    c1 = Polynomial(ciph_data['c1']['ring_degree'], ciph_data['c1']['coeffs'])
-    
-    scaling_factor = ciph_data.get('scaling_factor')
-    modulus = ciph_data.get('modulus')
-    
-    ciphertext = Ciphertext(c0, c1, scaling_factor, modulus)
+decoded_ciphertexts = []
+for i, ciphertext in enumerate(accumulated):
+    print(f"\n--- Ciphertext {i+1} ---")
     
     print(f"Ciphertext reconstructed:")
     print(f"  c0.ring_degree: {ciphertext.c0.ring_degree}")
@@ -142,10 +137,12 @@ for i, ciph_data in enumerate(accumulated):
     decoded = encoder.decode(plaintext)
     
     print(f"Decoded values: {decoded}")
-    
-    # Show results
+    decoded_ciphertexts.append(decoded)
+
+# Show results
+for i, votes_per_option in enumerate(unpack_slots(decoded_ciphertexts, num_questions, questions_per_ciphertext)):
     print(f"\nResults for question {i+1}:")
-    for j, votes in enumerate(decoded):
+    for j, votes in enumerate(votes_per_option):
         if votes > 0:
             print(f"  Option {j}: {votes} votes")
 
@@ -0,0 +1,325 @@
+"""
+Stress test for the single-writer accumulation path: no ballot may be lost or counted twice.
+
+Many threads submit ballots to a few questionnaires at once through
+AccumulationBuffer.submit(), each waiting on its ballot's future as the API
+does. Every --duplicate-every'th fingerprint is submitted a second time,
+with a different ballot, from another thread. Afterwards each
+questionnaire's num_responses, its SubmissionRecord rows and its decrypted
+sums must match the accepted ballots exactly, and every distinct
+fingerprint must have been accepted once.
+
+--storage coefficients runs the same checks against questionnaires that keep
+their sums in accumulator_coefficients (see coefficient_table). --storage
+memmap also adds them into a MemmapStore once committed, and checks that the
+mapped sums equal the database's, that a checkpoint keeps them and empties
+the log, and that a cold restart of the store maps them again.
+
+With --compare the same load is first written one ballot per transaction
+through write_batch() (per-shard lock, retry on IntegrityError), as a
+lock-and-retry design would, and both throughputs are printed.
+
+Exits with status 1 if any check fails.
+
+Usage:
+    python debug/stress_accumulation.py [--threads 16] [--ballots 2000] [--questionnaires 4]
+                                        [--storage log|coefficients|memmap] [--compare]
+"""
+import sys
+import os
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'py-fhe'))
+
+from models import (init_db, get_session, remove_session, Questionnaire, SubmissionRecord, CiphertextLog,
+                    public_key_digest)
+from accumulator import (AccumulationBuffer, DuplicateSubmissionError, load_accumulated_array, params_of, ballot_array,
+                         attach_memmap_store, DEFAULT_NUM_SHARDS, ACCUMULATOR_STORAGES, STORAGE_LOG,
+                         STORAGE_COEFFICIENTS, STORAGE_MEMMAP)
+from coefficient_table import init_coefficients
+from memmap_store import MemmapStore
+from crypto_context import context_for, resolve_parameters
+from decryption_service import decrypt_votes
+from keypair_pool import generate_keypair
+from serialization import deserialize_public_key
+from slot_packing import pack_answers, OPTIONS_PER_QUESTION
+from bfv.bfv_encryptor import BFVEncryptor
+
+NUM_QUESTIONS = 4
+
+# Distinct encrypted ballots per questionnaire; submissions cycle through them
+NUM_PATTERNS = 8
+
+
+def create_questionnaire(db_url, link, storage):
+    degree, plain_modulus, ciph_modulus, questions_per_ciphertext = resolve_parameters(NUM_QUESTIONS)
+    public_key_json, secret_key_json = generate_keypair((degree, plain_modulus, ciph_modulus))
+    questions = [{'text': f'Q{i}', 'options': [f'O{j}' for j in range(OPTIONS_PER_QUESTION)]}
+                 for i in range(NUM_QUESTIONS)]
+
+    session = get_session(db_url)
+    questionnaire = Questionnaire(
+        link=link,
+        deadline=datetime.now(timezone.utc) + timedelta(days=1),
+        questions_json=json.dumps(questions),
+        num_questions=NUM_QUESTIONS,
+        poly_degree=degree,
+        plain_modulus=plain_modulus,
+        ciph_modulus=str(ciph_modulus),
+        questions_per_ciphertext=questions_per_ciphertext,
+        public_key_json=public_key_json,
+        public_key_sha256=public_key_digest(public_key_json),
+        secret_key_json=secret_key_json,
+        num_shards=DEFAULT_NUM_SHARDS if storage == STORAGE_LOG else 1,
+        accumulator_storage=storage,
+        num_responses=0
+    )
+    session.add(questionnaire)
+    if storage == STORAGE_COEFFICIENTS:
+        session.flush()
+        init_coefficients(session, questionnaire)
+    session.commit()
+    session.refresh(questionnaire)
+    session.expunge(questionnaire)
+    remove_session(db_url)
+    return questionnaire
+
+
+def make_ballots(questionnaire):
+    """NUM_PATTERNS (choices, ciphertexts) pairs encrypted under the questionnaire's key."""
+    context = context_for(questionnaire)
+    public_key = deserialize_public_key(json.loads(questionnaire.public_key_json), context.params.ciph_modulus)
+    encryptor = BFVEncryptor(context.params, public_key)
+
+    ballots = []
+    for b in range(NUM_PATTERNS):
+        choices = [(b + q) % OPTIONS_PER_QUESTION for q in range(NUM_QUESTIONS)]
+        vectors = pack_answers(choices, questionnaire.poly_degree, questionnaire.questions_per_ciphertext)
+        ballots.append((choices, [encryptor.encrypt(context.encoder.encode(vec)) for vec in vectors]))
+    return ballots
+
+
+def make_jobs(num_ballots, num_questionnaires, duplicate_every, seed):
+    """Shuffled (questionnaire index, fingerprint, pattern) submissions, duplicates included."""
+    jobs = []
+    for i in range(num_ballots):
+        jobs.append((i % num_questionnaires, f'{i:064x}', i % NUM_PATTERNS))
+        if duplicate_every and i % duplicate_every == 0:
+            jobs.append((i % num_questionnaires, f'{i:064x}', (i + 1) % NUM_PATTERNS))
+    random.Random(seed).shuffle(jobs)
+    return jobs
+
+
+def submit_through_writer(buffer, questionnaire, fingerprint, ciphertexts):
+    try:
+        buffer.submit(questionnaire, ciphertexts, fingerprint).result()
+        return True
+    except DuplicateSubmissionError:
+        return False
+
+
+def submit_with_lock_and_retry(buffer, questionnaire, fingerprint, ciphertexts):
+    return fingerprint in buffer.write_batch(questionnaire, [(fingerprint, ballot_array(questionnaire, ciphertexts))])
+
+
+def run(db_url, label, submit_one, storage, num_threads, num_ballots, num_questionnaires, duplicate_every, seed):
+    """
+    Submit the whole load from num_threads threads.
+
+    Returns:
+        (questionnaires, ballots, accepted jobs, seconds, submissions, True if none raised)
+    """
+    questionnaires = [create_questionnaire(db_url, f'stress-{label}-{q}-{time.time_ns()}', storage)
+                      for q in range(num_questionnaires)]
+    ballots = [make_ballots(questionnaire) for questionnaire in questionnaires]
+    jobs = make_jobs(num_ballots, num_questionnaires, duplicate_every, seed)
+
+    buffer = AccumulationBuffer(db_url)
+    accepted = []
+    results_lock = threading.Lock()
+    errors = []
+    next_job = iter(jobs)
+
+    def worker():
+        while True:
+            with results_lock:
+                job = next(next_job, None)
+            if job is None:
+                return
+            q, fingerprint, pattern = job
+            try:
+                ok = submit_one(buffer, questionnaires[q], fingerprint, ballots[q][pattern][1])
+            except Exception as e:
+                with results_lock:
+                    errors.append(f'{fingerprint[-8:]}: {e}')
+                continue
+            if ok:
+                with results_lock:
+                    accepted.append(job)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    buffer.stop()
+
+    for error in errors:
+        print(f"  ❌ submission failed: {error}")
+    return questionnaires, ballots, accepted, elapsed, len(jobs), not errors
+
+
+def verify(db_url, questionnaires, ballots, accepted, num_ballots):
+    """Check every questionnaire against the accepted ballots; returns True if all checks pass."""
+    session = get_session(db_url)
+    passed = True
+    try:
+        for q, questionnaire in enumerate(questionnaires):
+            mine = [(fingerprint, pattern) for (job_q, fingerprint, pattern) in accepted if job_q == q]
+            fingerprints = [fingerprint for fingerprint, _ in mine]
+            submitted = {f'{i:064x}' for i in range(q, num_ballots, len(questionnaires))}
+
+            plain_modulus = questionnaire.plain_modulus
+            expected = [[0] * OPTIONS_PER_QUESTION for _ in range(NUM_QUESTIONS)]
+            for _, pattern in mine:
+                for question, choice in enumerate(ballots[q][pattern][0]):
+                    expected[question][choice] += 1
+            expected = [[count % plain_modulus for count in votes] for votes in expected]
+
+            row = session.query(Questionnaire).filter_by(id=questionnaire.id).one()
+            recorded = {fingerprint for (fingerprint,) in session.query(
+                SubmissionRecord.cert_fingerprint
+            ).filter_by(questionnaire_id=questionnaire.id)}
+            total = load_accumulated_array(session, row)
+            votes = decrypt_votes(params_of(row), row.secret_key_json, total,
+                                  NUM_QUESTIONS, row.questions_per_ciphertext) if total is not None else None
+
+            checks = [
+                ('each fingerprint accepted once', len(fingerprints) == len(set(fingerprints))),
+                ('no submitted fingerprint lost', set(fingerprints) == submitted),
+                ('num_responses matches', row.num_responses == len(fingerprints)),
+                ('submission records match', recorded == set(fingerprints)),
+                ('decrypted sums match', votes == expected),
+            ]
+            failed = [name for name, ok in checks if not ok]
+            status = '✓' if not failed else '❌'
+            print(f"  {status} {questionnaire.link}: {len(fingerprints)} accepted, "
+                  f"{row.num_responses} counted, {len(recorded)} recorded")
+            for name in failed:
+                print(f"      failed: {name}")
+            passed = passed and not failed
+    finally:
+        remove_session(db_url)
+    return passed
+
+
+def check_memmap(db_url, store, questionnaires):
+    """Mapped sums must equal the database's, before and after a checkpoint and a cold restart."""
+    session = get_session(db_url)
+
+    def sums(memmap_store):
+        attach_memmap_store(memmap_store)
+        session.commit()  # Read what is committed now
+        return [load_accumulated_array(session, session.query(Questionnaire).filter_by(id=q.id).one())
+                for q in questionnaires]
+
+    def same(a, b):
+        return all(x is not None and y is not None and (x == y).all() for x, y in zip(a, b))
+
+    try:
+        counted = [q.num_responses for q in session.query(Questionnaire).filter(
+            Questionnaire.id.in_([q.id for q in questionnaires])).order_by(Questionnaire.id)]
+        stats = store.stats()
+        mapped, stored = sums(store), sums(None)
+        checkpointed = store.checkpoint()
+        stored_after = sums(None)
+        logged = session.query(CiphertextLog).filter(
+            CiphertextLog.questionnaire_id.in_([q.id for q in questionnaires])
+        ).count()
+        store.stop()
+        reopened = MemmapStore(db_url, store.path)
+        restarted = sums(reopened)
+        rebuilds = reopened.stats()['rebuilds']
+        reopened.warm()
+        session.commit()
+        counted_after = [q.num_responses for q in session.query(Questionnaire).filter(
+            Questionnaire.id.in_([q.id for q in questionnaires])).order_by(Questionnaire.id)]
+        reopened.stop()
+    finally:
+        attach_memmap_store(None)
+        remove_session(db_url)
+
+    checks = [
+        ('mapped sums equal the database', same(mapped, stored)),
+        (f'checkpoint of {checkpointed} slots keeps the database sums and empties the log',
+         same(stored, stored_after) and logged == 0),
+        ('cold restart maps the same sums without rebuilding', same(mapped, restarted) and rebuilds == 0),
+        ('warming the restarted store keeps every count', counted == counted_after),
+    ]
+    print(f"  {stats['added']} ballots added from memory, {stats['folded']} log entries read back")
+    for name, ok in checks:
+        print(f"  {'✓' if ok else '❌'} {name}")
+    return all(ok for _, ok in checks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stress the single-writer accumulation path and check no ballot is lost')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ballots', type=int, default=2000, help='Distinct fingerprints submitted')
+    parser.add_argument('--questionnaires', type=int, default=4)
+    parser.add_argument('--duplicate-every', type=int, default=10,
+                        help='Submit every Nth fingerprint twice (0 disables duplicates)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', choices=list(ACCUMULATOR_STORAGES), default='log',
+                        help='Accumulator storage of the questionnaires')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also run the load one transaction per ballot and compare throughput')
+    parser.add_argument('--db-url', type=str, default=None)
+    args = parser.parse_args()
+
+    db_url = args.db_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress_accumulation.db')}"
+    init_db(db_url)
+
+    modes = [('writer', submit_through_writer)]
+    if args.compare:
+        modes.insert(0, ('lock-retry', submit_with_lock_and_retry))
+
+    print("=" * 60)
+    print(f"{args.ballots} ballots over {args.questionnaires} questionnaires ({args.storage} storage), "
+          f"{args.threads} threads, {db_url}")
+    print("=" * 60)
+
+    all_passed = True
+    throughputs = {}
+    for label, submit_one in modes:
+        print(f"\n{label}:")
+        store = None
+        if args.storage == STORAGE_MEMMAP:
+            store = MemmapStore(db_url, os.path.join(tempfile.mkdtemp(), 'accumulators.mmap'))
+            attach_memmap_store(store)
+            store.start()
+        questionnaires, ballots, accepted, elapsed, num_jobs, no_errors = run(
+            db_url, label, submit_one, args.storage, args.threads, args.ballots, args.questionnaires,
+            args.duplicate_every, args.seed
+        )
+        throughputs[label] = num_jobs / elapsed
+        print(f"  {num_jobs} submissions in {elapsed:.2f}s ({throughputs[label]:.1f}/s)")
+        all_passed = verify(db_url, questionnaires, ballots, accepted, args.ballots) and no_errors and all_passed
+        if store is not None:
+            all_passed = check_memmap(db_url, store, questionnaires) and all_passed
+
+    print("\n" + "=" * 60)
+    if args.compare:
+        print(f"writer / lock-retry throughput: {throughputs['writer'] / throughputs['lock-retry']:.2f}x")
+    print("PASSED: no ballots lost or double-counted" if all_passed else "FAILED")
+    sys.exit(0 if all_passed else 1)
@@ -0,0 +1,339 @@
+"""
+Process-pool decryption service for questionnaires whose deadline has passed.
+
+Decryption is pure-Python polynomial arithmetic, so running it on a web
+process thread competes with request handling for the GIL. Expired
+questionnaires are queued here instead. One service thread loads each
+questionnaire's accumulated sum and hands a worker process only what it needs:
+the BFV parameters, the serialized secret key and the packed accumulator. At
+most DECRYPT_WORKERS jobs run at once. Finished results are written back in
+batches of up to WRITE_BATCH_SIZE per transaction, so a burst of deadlines
+does not turn into a burst of single-row commits.
+
+Each worker also finalizes the sum it decrypted, modulus-switching it down
+to the smallest modulus that still decrypts it (see modulus_switching). The
+compact form is written in the same transaction as the final results and
+replaces the stored accumulator. That transaction first checks that
+num_responses and the sum are still what the worker was given; if ballots
+arrived in between, the job is queued again rather than finalizing a sum
+that misses them.
+
+Every job logs its queue wait, worker time and the queue depth; stats()
+returns the totals.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from models import get_session, remove_session, Questionnaire
+from accumulator import load_accumulated_array, store_final_array, accumulator_version, params_of, last_log_id
+from ciphertext_arrays import pack_ciphertext_array, unpack_ciphertext_array
+from serialization import array_to_ciphertexts
+from slot_packing import unpack_slots
+from crypto_context import secret_keys
+from modulus_switching import compact_accumulator
+
+# Worker processes; half the cores so request threads keep the rest
+DECRYPT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Finished jobs written per transaction, and the longest a result waits for its batch
+WRITE_BATCH_SIZE = 16
+WRITE_BATCH_DELAY = 1.0
+
+
+def decrypt_votes(params, secret_key_json, accumulated_array, num_questions, questions_per_ciphertext):
+    """
+    Decrypt an accumulated sum into vote counts per question and option.
+
+    Args:
+        params: (poly_degree, plain_modulus, ciph_modulus) tuple
+        secret_key_json: Serialized secret key ({'ring_degree', 'coeffs'})
+        accumulated_array: (ciphertexts, 2, degree) coefficient array
+        num_questions: Number of questions
+        questions_per_ciphertext: Questions packed into each ciphertext
+
+    Returns:
+        list of per-question vote lists
+    """
+    accumulated = array_to_ciphertexts(accumulated_array)
+    with secret_keys.acquire(params, secret_key_json) as key:
+        decoded_ciphertexts = key.decode_all(accumulated)
+    return [[int(v) for v in votes]
+            for votes in unpack_slots(decoded_ciphertexts, num_questions, questions_per_ciphertext)]
+
+
+def format_results(questions, question_votes, num_responses):
+    """Pair vote counts with option labels and percentages, leaving out N/A options."""
+    results = []
+    for question, votes in zip(questions, question_votes):
+        options_results = []
+        for j, option in enumerate(question['options']):
+            if option.strip().upper() == 'N/A':
+                continue
+            percentage = (votes[j] / num_responses * 100) if num_responses > 0 else 0
+            options_results.append({
+                'option': option,
+                'votes': int(votes[j]),
+                'percentage': round(percentage, 2)
+            })
+        results.append({
+            'question': question['text'],
+            'results': options_results
+        })
+    return results
+
+
+def _init_worker(path):
+    # Spawned workers need the parent's import path (py-fhe, Backend)
+    sys.path[:] = path
+
+
+def _run_job(params, secret_key_json, accumulated_blob, num_questions, questions_per_ciphertext, decrypt=True):
+    """
+    Worker entry point.
+
+    Returns:
+        (question votes or None without decrypt, finalized (ciph_modulus, array) or None, seconds spent)
+    """
+    start = time.perf_counter()
+    accumulated_array = unpack_ciphertext_array(accumulated_blob)
+    votes = None
+    if decrypt:
+        votes = decrypt_votes(params, secret_key_json, accumulated_array, num_questions, questions_per_ciphertext)
+    final = compact_accumulator(params, secret_key_json, accumulated_array)
+    # The questionnaire is closed; its key is not needed in this worker again
+    secret_keys.discard(params, secret_key_json)
+    return votes, final, time.perf_counter() - start
+
+
+class DecryptionJob:
+    """One questionnaire moving through the queue, the pool and the write batch."""
+
+    def __init__(self, link):
+        self.link = link
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.version = None
+        self.num_responses = None
+        self.max_log_id = None
+        self.votes = None
+        self.final = None
+        self.worker_seconds = None
+        self.error = None
+
+
+class DecryptionService:
+    """
+    Bounded job queue feeding a ProcessPoolExecutor, with batched result writes.
+
+    submit(link) queues a questionnaire for final decryption. A job that fails
+    is passed to on_failure(link), e.g. to retry it later. Queued jobs that
+    have not started when the service stops are simply dropped; their
+    questionnaires are still undecrypted and get queued again after a restart.
+    """
+
+    def __init__(self, db_url, accumulation_buffer, max_workers=DECRYPT_WORKERS,
+                 batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY, on_failure=None):
+        self.db_url = db_url
+        self.accumulation_buffer = accumulation_buffer
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.on_failure = on_failure
+        self._condition = threading.Condition()
+        self._queue = deque()      # DecryptionJob waiting for a worker
+        self._queued = set()       # links queued or in flight
+        self._in_flight = 0
+        self._done = []            # DecryptionJob finished by a worker, not yet written
+        self._batch_started = None
+        self._stopped = False
+        self._thread = None
+        self._pool = None
+        self._stats = {'completed': 0, 'failed': 0, 'skipped': 0, 'requeued': 0, 'finalized': 0,
+                       'worker_seconds': 0.0, 'max_queue_depth': 0}
+
+    def submit(self, link):
+        """Queue a questionnaire for final decryption; returns False once stopped."""
+        with self._condition:
+            if self._stopped:
+                return False
+            if link not in self._queued:
+                self._queued.add(link)
+                self._queue.append(DecryptionJob(link))
+                self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], len(self._queue))
+                self._condition.notify()
+        self._ensure_started()
+        return True
+
+    def queue_depth(self):
+        """Jobs waiting for a worker."""
+        with self._condition:
+            return len(self._queue)
+
+    def stats(self):
+        """Queue depth, jobs in flight and totals since start."""
+        with self._condition:
+            return dict(self._stats, queue_depth=len(self._queue), in_flight=self._in_flight)
+
+    def stop(self):
+        """Finish and write the jobs already running, then shut the pool down."""
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _ensure_started(self):
+        with self._condition:
+            if self._thread is None and not self._stopped:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_init_worker, initargs=(list(sys.path),)
+                )
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    can_start = bool(self._queue) and self._in_flight < self.max_workers
+                    wait_left = self._batch_started + self.batch_delay - time.perf_counter() if self._done else None
+                    batch_due = bool(self._done) and (len(self._done) >= self.batch_size or self._in_flight == 0
+                                                      or wait_left <= 0)
+                    if can_start or batch_due or (self._stopped and self._in_flight == 0):
+                        break
+                    self._condition.wait(wait_left)
+
+                if batch_due:
+                    batch, self._done = self._done, []
+                elif can_start:
+                    job = self._queue.popleft()
+                    self._in_flight += 1
+                else:
+                    return
+
+            if batch_due:
+                self._write(batch)
+            else:
+                self._start(job)
+
+    def _start(self, job):
+        """Load a queued questionnaire and hand its decryption to a worker."""
+        session = get_session(self.db_url)
+        try:
+            # Include ballots still waiting in the write-behind buffer
+            if self.accumulation_buffer.flush(job.link):
+                session.commit()
+            q = session.query(Questionnaire).filter_by(link=job.link).first()
+            total = None
+            if q is not None and q.final_accumulator_blob is None and q.num_responses:
+                # Read in the same transaction as the sum, so finalizing deletes exactly what was summed
+                job.max_log_id = last_log_id(session, q.id)
+                total = load_accumulated_array(session, q)
+            if total is None:
+                self._finish(job, skipped=True)
+                return
+
+            job.version = accumulator_version(q, total)
+            job.num_responses = q.num_responses
+            # Final results never change, and results decrypted from this sum
+            # before the deadline only need marking final; either way the sum
+            # still gets finalized
+            decrypt = not q.is_decrypted and not (job.version == q.results_version and q.decrypted_results_json)
+
+            job.started_at = time.perf_counter()
+            future = self._pool.submit(
+                _run_job, params_of(q), q.secret_key_json, pack_ciphertext_array(total),
+                len(q.get_questions()), q.questions_per_ciphertext or 1, decrypt
+            )
+            future.add_done_callback(lambda f: self._collect(job, f))
+        except Exception as e:
+            job.error = e
+            self._finish(job)
+        finally:
+            remove_session(self.db_url)
+
+    def _collect(self, job, future):
+        try:
+            job.votes, job.final, job.worker_seconds = future.result()
+        except Exception as e:
+            job.error = e
+        self._finish(job)
+
+    def _finish(self, job, skipped=False):
+        with self._condition:
+            self._in_flight -= 1
+            if skipped:
+                self._queued.discard(job.link)
+                self._stats['skipped'] += 1
+            else:
+                if not self._done:
+                    self._batch_started = time.perf_counter()
+                self._done.append(job)
+            self._condition.notify()
+
+    def _write(self, batch):
+        """Store a batch of finished jobs in one transaction."""
+        failed = [job for job in batch if job.error is not None]
+        written = [job for job in batch if job.error is None]
+        stale = []
+        session = get_session(self.db_url)
+        try:
+            by_link = {q.link: q for q in session.query(Questionnaire).filter(
+                Questionnaire.link.in_([job.link for job in written])
+            ).with_for_update()} if written else {}
+            for job in list(written):
+                q = by_link[job.link]
+                # Ballots written since the sum was read (a write in flight, a
+                # queued ballot, a retry): decrypt and finalize the new sum instead
+                if q.num_responses != job.num_responses or accumulator_version(
+                        q, load_accumulated_array(session, q)) != job.version:
+                    written.remove(job)
+                    stale.append(job)
+                    continue
+                if job.votes is None:
+                    q.is_decrypted = 1
+                else:
+                    results = format_results(q.get_questions(), job.votes, job.num_responses)
+                    q.set_decrypted_results(results, version=job.version, final=True)
+                if job.final is not None and q.final_accumulator_blob is None:
+                    store_final_array(session, q, *job.final, job.max_log_id)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for job in written + stale:
+                job.error = e
+            failed, written, stale = batch, [], []
+        finally:
+            remove_session(self.db_url)
+
+        now = time.perf_counter()
+        with self._condition:
+            depth = len(self._queue)
+            for job in batch:
+                self._queued.discard(job.link)
+            self._stats['completed'] += len(written)
+            self._stats['requeued'] += len(stale)
+            self._stats['failed'] += len(failed)
+            self._stats['finalized'] += sum(1 for job in written if job.final is not None)
+            self._stats['worker_seconds'] += sum(job.worker_seconds or 0.0 for job in written)
+
+        for job in written:
+            finalized = f", stored mod 2^{(job.final[0] - 1).bit_length()}" if job.final is not None else ""
+            print(f"✓ Decrypted {job.link}: waited {(job.started_at or now) - job.queued_at:.2f}s, "
+                  f"worker {job.worker_seconds or 0.0:.2f}s, total {now - job.queued_at:.2f}s "
+                  f"(batch of {len(written)}, queue depth {depth}{finalized})")
+        for job in stale:
+            print(f"↻ {job.link} received ballots while it was decrypted; queued again")
+            self.submit(job.link)
+        for job in failed:
+            print(f"✗ Error decrypting questionnaire {job.link}: {job.error}")
+            if self.on_failure is not None:
+                self.on_failure(job.link)
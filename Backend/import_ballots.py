@@ -0,0 +1,372 @@
+"""
+Script to bulk-import encrypted ballots into a questionnaire's accumulator.
+
+Streams a dump of ballots, e.g. to migrate a questionnaire from another
+server or to replay collected ballots, without going through HTTP. Two
+formats are read:
+
+  NDJSON  One ballot per line: {"fingerprint": ..., "encrypted_answers": [...]}
+          or {"fingerprint": ..., "ballot": <base64 binary ballot>}. An
+          optional "questionnaire_id" must match the target.
+  binary  Back-to-back records of a <HI header (fingerprint length, ballot
+          length), the UTF-8 fingerprint and an application/x-bfv-ballot
+          ballot (see encode_dump_record).
+
+The file is read as a generator of records, cut into chunks and summed by
+worker processes, with at most two chunks per worker in flight, so memory
+stays bounded however large the dump is. The parent folds each chunk's sum
+into one running total and, at the end, writes it as a single log entry
+(or adds it into the coefficient rows, for 'coefficients' storage)
+together with the num_responses update and the submission records, in one
+transaction. Nothing is written if the import fails or is interrupted.
+
+Fingerprints that already voted, and repeats within the dump, are skipped.
+Ballots submitted to a running server while the import runs are not seen.
+If one of them shares a fingerprint with an imported ballot, the unique
+submission index rolls the whole import back; running it again then skips
+that fingerprint. Questionnaires past their deadline, or with a finalized
+sum, are refused: their sum no longer takes new ballots.
+"""
+
+import sys
+import os
+
+# Add py-fhe to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'py-fhe'))
+
+import base64
+import json
+import struct
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+
+from sqlalchemy.exc import IntegrityError
+
+from models import init_db, get_session, Questionnaire, CiphertextLog, SubmissionRecord, DEFAULT_DB_URL
+from accumulator import params_of, checked_ballot_array, STORAGE_COEFFICIENTS
+from coefficient_table import add_to_coefficients
+from ciphertext_arrays import add_arrays
+from serialization import deserialize_ciphertext, decode_ballot, params_id
+from slot_packing import num_ciphertexts
+
+# Ballots per chunk handed to a worker
+CHUNK_SIZE = 500
+
+# Worker processes summing chunks
+IMPORT_WORKERS = os.cpu_count() or 1
+
+# Seconds between progress lines
+REPORT_INTERVAL = 2.0
+
+# Submission records per INSERT statement in the final transaction
+INSERT_BATCH_SIZE = 10000
+
+# Binary dump record header: fingerprint length, ballot length
+_RECORD_HEADER = struct.Struct('<HI')
+
+
+def encode_dump_record(fingerprint, ballot):
+    """Frame one binary ballot (bytes from encode_ballot) for a binary dump."""
+    fingerprint = fingerprint.encode('utf-8')
+    return _RECORD_HEADER.pack(len(fingerprint), len(ballot)) + fingerprint + ballot
+
+
+def read_records(f, fmt):
+    """
+    Yield (record number, raw record) pairs from an open binary file.
+
+    NDJSON records are raw lines; binary records are (fingerprint, ballot bytes).
+    """
+    if fmt == 'ndjson':
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                yield number, line
+        return
+
+    number = 0
+    while True:
+        header = f.read(_RECORD_HEADER.size)
+        if not header:
+            return
+        number += 1
+        if len(header) < _RECORD_HEADER.size:
+            raise ValueError(f'Record {number}: truncated header')
+        fingerprint_len, ballot_len = _RECORD_HEADER.unpack(header)
+        body = f.read(fingerprint_len + ballot_len)
+        if len(body) < fingerprint_len + ballot_len:
+            raise ValueError(f'Record {number}: truncated body')
+        yield number, (body[:fingerprint_len].decode('utf-8'), body[fingerprint_len:])
+
+
+def chunked(records, size):
+    """Group an iterator into lists of at most size items."""
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_record(record, target):
+    """Decode one record; returns (fingerprint, ciphertexts)."""
+    link, expected_params_id = target[:2]
+    if isinstance(record, tuple):
+        fingerprint, ballot = record
+        encrypted_answers = None
+    else:
+        data = json.loads(record)
+        fingerprint = data.get('fingerprint')
+        if data.get('questionnaire_id', link) != link:
+            raise ValueError('Ballot is for a different questionnaire')
+        ballot = base64.b64decode(data['ballot'], validate=True) if data.get('ballot') else None
+        encrypted_answers = data.get('encrypted_answers')
+
+    if not isinstance(fingerprint, str) or not 0 < len(fingerprint) <= 64:
+        raise ValueError('Missing or invalid fingerprint')
+
+    if ballot is not None:
+        ballot_link, ballot_params_id, ciphertexts = decode_ballot(ballot)
+        if ballot_link != link:
+            raise ValueError('Ballot is for a different questionnaire')
+        if ballot_params_id != expected_params_id:
+            raise ValueError('Ballot was encrypted with different parameters')
+    elif encrypted_answers:
+        ciphertexts = [deserialize_ciphertext(ciph_data) for ciph_data in encrypted_answers]
+    else:
+        raise ValueError('Missing ballot')
+    return fingerprint, ciphertexts
+
+
+def _reduce_chunk(target, ciph_modulus, records, exclude=frozenset()):
+    """
+    Sum the valid ballots of one chunk; runs in worker processes.
+
+    Returns:
+        (sum array or None, accepted fingerprints, [(record number, reason)])
+    """
+    total = None
+    fingerprints = []
+    rejected = []
+    seen = set()
+    for number, record in records:
+        try:
+            fingerprint, ciphertexts = _parse_record(record, target)
+            if fingerprint in seen or fingerprint in exclude:
+                raise ValueError('Already submitted')
+            ballot = checked_ballot_array(ciphertexts, target[2], target[3], ciph_modulus)
+        except ValueError as e:
+            rejected.append((number, str(e) or 'Invalid ballot'))
+            continue
+        except (TypeError, KeyError, AttributeError) as e:
+            rejected.append((number, f'Invalid ballot: {e!r}'))
+            continue
+        if total is None:
+            total = ballot
+        else:
+            add_arrays(ballot, total, ciph_modulus, out=total)
+        seen.add(fingerprint)
+        fingerprints.append(fingerprint)
+    return total, fingerprints, rejected
+
+
+def _init_worker(path):
+    # Spawned workers need the parent's import path (py-fhe, Backend)
+    sys.path[:] = path
+
+
+def _detect_format(path):
+    return 'ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'binary'
+
+
+def import_ballots(link, path, fmt=None, workers=IMPORT_WORKERS, chunk_size=CHUNK_SIZE,
+                   db_url=DEFAULT_DB_URL, dry_run=False):
+    """
+    Stream a ballot dump into a questionnaire.
+
+    Args:
+        link: Questionnaire link/ID
+        path: Dump file
+        fmt: 'ndjson' or 'binary' (default: from the file extension)
+        workers: Worker processes
+        chunk_size: Ballots per chunk
+        db_url: SQLAlchemy database URL
+        dry_run: Validate and sum without writing anything
+
+    Returns:
+        dict with accepted/rejected counts and timing, or None if the questionnaire cannot take ballots
+    """
+    fmt = fmt or _detect_format(path)
+    session = get_session(db_url)
+    try:
+        questionnaire = session.query(Questionnaire).filter_by(link=link).first()
+        if not questionnaire:
+            print(f"❌ Questionnaire with link '{link}' not found")
+            return None
+        if questionnaire.is_decrypted or questionnaire.final_accumulator_blob is not None:
+            print(f"❌ Questionnaire '{link}' already has final results")
+            return None
+        if _is_expired(questionnaire):
+            print(f"❌ Questionnaire '{link}' has expired; its sum is about to be finalized")
+            return None
+
+        params = params_of(questionnaire)
+        ciph_modulus = params[2]
+        # (link, params id, ciphertexts per ballot, ring degree) every ballot is checked against
+        target = (link, params_id(*params),
+                  num_ciphertexts(len(questionnaire.get_questions()), questionnaire.questions_per_ciphertext or 1),
+                  questionnaire.poly_degree)
+        # One query for every fingerprint that already voted
+        seen = {fingerprint for (fingerprint,) in session.query(SubmissionRecord.cert_fingerprint).filter_by(
+            questionnaire_id=questionnaire.id
+        )}
+        session.rollback()
+
+        total = None
+        accepted = []
+        rejected = 0
+        read = 0
+        start = last_report = time.perf_counter()
+        size = os.path.getsize(path)
+
+        def fold(future, records):
+            nonlocal total, rejected
+            chunk_total, fingerprints, chunk_rejected = future.result()
+            duplicates = [fp for fp in fingerprints if fp in seen]
+            if duplicates:
+                # Seen in the database or an earlier chunk: sum this chunk again without them
+                chunk_total, fingerprints, chunk_rejected = pool.submit(
+                    _reduce_chunk, target, ciph_modulus, records, frozenset(duplicates)
+                ).result()
+            if chunk_total is not None:
+                total = chunk_total if total is None else add_arrays(total, chunk_total, ciph_modulus, out=total)
+            seen.update(fingerprints)
+            accepted.extend(fingerprints)
+            rejected += len(chunk_rejected)
+            for number, reason in chunk_rejected[:5]:
+                print(f"  ✗ record {number}: {reason}")
+
+        with open(path, 'rb') as f, ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(list(sys.path),)
+        ) as pool:
+            in_flight = deque()
+            for records in chunked(read_records(f, fmt), chunk_size):
+                read += len(records)
+                in_flight.append((pool.submit(_reduce_chunk, target, ciph_modulus, records), records))
+                # Chunks are folded in file order, so the first ballot of a fingerprint wins
+                while len(in_flight) >= 2 * workers:
+                    fold(*in_flight.popleft())
+
+                now = time.perf_counter()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    elapsed = now - start
+                    print(f"  {read} read, {len(accepted)} accepted, {rejected} rejected | "
+                          f"{read / elapsed:.0f} ballots/s, {f.tell() / elapsed / 1e6:.1f} MB/s, "
+                          f"{f.tell() / size * 100 if size else 100:.0f}%")
+            while in_flight:
+                fold(*in_flight.popleft())
+
+        elapsed = time.perf_counter() - start
+        if accepted and not dry_run:
+            write_start = time.perf_counter()
+            if _is_expired(questionnaire):
+                print(f"❌ Questionnaire '{link}' expired during the import; nothing was written")
+                return None
+            try:
+                if not _write_import(session, questionnaire, total, accepted):
+                    print(f"❌ Questionnaire '{link}' was finalized during the import; nothing was written")
+                    return None
+            except IntegrityError:
+                print(f"❌ Some fingerprints were recorded by another writer during the import; "
+                      f"nothing was written, run the import again")
+                return None
+            print(f"  wrote {len(accepted)} ballots in {time.perf_counter() - write_start:.2f}s")
+
+        return {
+            'read': read,
+            'accepted': len(accepted),
+            'rejected': rejected,
+            'seconds': elapsed,
+            'ballots_per_second': read / elapsed if elapsed else 0.0
+        }
+    finally:
+        session.close()
+
+
+def _is_expired(questionnaire):
+    deadline = questionnaire.deadline
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) > deadline
+
+
+def _write_import(session, questionnaire, total, fingerprints):
+    """
+    Store the imported sum, the response count and the submission records in one transaction.
+
+    Returns:
+        False, with nothing written, if the questionnaire's sum was finalized meanwhile
+    """
+    questionnaire_id = questionnaire.id
+    try:
+        # The count is bumped first and only while the sum is not finalized, so
+        # no log entry can be written after the final sum that would ignore it
+        updated = session.query(Questionnaire).filter(
+            Questionnaire.id == questionnaire_id,
+            Questionnaire.final_accumulator_blob.is_(None)
+        ).update(
+            {Questionnaire.num_responses: Questionnaire.num_responses + len(fingerprints)},
+            synchronize_session=False
+        )
+        if not updated:
+            session.rollback()
+            return False
+        if questionnaire.accumulator_storage == STORAGE_COEFFICIENTS:
+            add_to_coefficients(session, questionnaire_id, questionnaire.ciph_modulus, total)
+        else:
+            entry = CiphertextLog(questionnaire_id=questionnaire_id, shard_id=0, num_ballots=len(fingerprints))
+            entry.set_ciphertext_array(total)
+            session.add(entry)
+        now = datetime.now(timezone.utc)
+        for i in range(0, len(fingerprints), INSERT_BATCH_SIZE):
+            session.execute(SubmissionRecord.__table__.insert(), [
+                {'questionnaire_id': questionnaire_id, 'cert_fingerprint': fingerprint, 'submitted_at': now}
+                for fingerprint in fingerprints[i:i + INSERT_BATCH_SIZE]
+            ])
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import a dump of encrypted ballots into a questionnaire')
+    parser.add_argument('--link', type=str, required=True, help='Questionnaire link/ID to import into')
+    parser.add_argument('--file', type=str, required=True, help='NDJSON or binary ballot dump')
+    parser.add_argument('--format', choices=['ndjson', 'binary'], help='Dump format (default: from the file extension)')
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS, help='Worker processes')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Ballots per chunk')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and sum without writing')
+
+    args = parser.parse_args()
+
+    # Initialize database
+    init_db()
+
+    print("=" * 60)
+    print(f"Importing {args.file} into {args.link}")
+    print("=" * 60)
+
+    summary = import_ballots(args.link, args.file, fmt=args.format, workers=args.workers,
+                             chunk_size=args.chunk_size, dry_run=args.dry_run)
+    if summary:
+        print("=" * 60)
+        print(f"Read: {summary['read']}  Accepted: {summary['accepted']}  Rejected: {summary['rejected']}")
+        print(f"Time: {summary['seconds']:.2f}s ({summary['ballots_per_second']:.0f} ballots/s)"
+              + (" — dry run, nothing written" if args.dry_run else ""))
@@ -0,0 +1,241 @@
+"""
+Pool of pre-generated BFV keypairs, so creating a questionnaire does not wait for key generation.
+
+Keypairs are kept in the keypair_pool table, grouped by parameter set, and
+survive restarts. A background thread tops every parameter set up to
+POOL_TARGET_DEPTH once a questionnaire has asked for it, and the profiles
+listed in POOL_PROFILES from the start. The keys themselves are generated
+in a dedicated worker process, so pure-Python key generation never holds
+the web process's GIL, and stop() terminates it instead of waiting for the
+keypair in progress. take() hands out a
+stored keypair and deletes its row in the same transaction, so no keypair is
+ever given to two questionnaires; when the pool is empty it generates one
+inline instead.
+
+Pooled secret keys sit in the same database as the questionnaires' own
+secret keys and need the same protection.
+
+With SEEDED_PUBLIC_KEYS the uniformly random p1 half of each public key is
+derived from a fresh seed and stored as that seed (see
+serialization.expand_seed), which roughly halves the stored and downloaded
+public key.
+"""
+
+import json
+import multiprocessing
+import secrets
+import sys
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from bfv.bfv_key_generator import BFVKeyGenerator
+from util.polynomial import Polynomial
+from util.random_sample import sample_triangle
+from util.secret_key import SecretKey
+
+from models import get_engine, PooledKeypair
+from serialization import serialize_polynomial, serialize_seeded_polynomial, expand_seed, SEED_BYTES
+from crypto_context import get_context, PROFILES
+
+# Generate public keys whose p1 is stored as a seed
+SEEDED_PUBLIC_KEYS = True
+
+# Keypairs kept ready per parameter set
+POOL_TARGET_DEPTH = 4
+
+# Names of crypto_context.PROFILES filled from start(); other parameter sets
+# are only filled once take() has asked for them
+POOL_PROFILES = ()
+
+# Seconds between refill checks when nothing wakes the worker
+POOL_REFILL_INTERVAL = 30.0
+
+
+def generate_keypair(params, seeded=SEEDED_PUBLIC_KEYS):
+    """
+    Generate a BFV keypair.
+
+    Args:
+        params: (poly_degree, plain_modulus, ciph_modulus) tuple
+        seeded: Derive p1 from a random seed and store only the seed
+
+    Returns:
+        (public_key_json, secret_key_json) serialized as stored on a Questionnaire
+    """
+    if seeded:
+        public_key_json, secret_key = _generate_seeded_keypair(params)
+    else:
+        key_generator = BFVKeyGenerator(get_context(*params).params)
+        public_key = key_generator.public_key
+        secret_key = key_generator.secret_key
+        public_key_json = {
+            'p0': serialize_polynomial(public_key.p0),
+            'p1': serialize_polynomial(public_key.p1)
+        }
+    secret_key_json = {
+        'coeffs': secret_key.s.coeffs,
+        'ring_degree': secret_key.s.ring_degree
+    }
+    return json.dumps(public_key_json), json.dumps(secret_key_json)
+
+
+def _generate_seeded_keypair(params):
+    """Same construction as BFVKeyGenerator, with p1 expanded from a seed."""
+    poly_degree, _, ciph_modulus = params
+    seed = secrets.token_hex(SEED_BYTES)
+    secret_key = SecretKey(Polynomial(poly_degree, sample_triangle(poly_degree)))
+    p1 = Polynomial(poly_degree, list(expand_seed(seed, poly_degree, ciph_modulus)))
+    error = Polynomial(poly_degree, sample_triangle(poly_degree))
+    p0 = error.add(p1.multiply(secret_key.s, ciph_modulus), ciph_modulus).scalar_multiply(-1, ciph_modulus)
+    public_key_json = {
+        'p0': serialize_polynomial(p0),
+        'p1': serialize_seeded_polynomial(seed, poly_degree)
+    }
+    return public_key_json, secret_key
+
+
+def _init_worker(path):
+    # Spawned workers need the parent's import path (py-fhe, Backend)
+    sys.path[:] = path
+
+
+def _params_filter(params):
+    poly_degree, plain_modulus, ciph_modulus = params
+    return (PooledKeypair.poly_degree == poly_degree,
+            PooledKeypair.plain_modulus == plain_modulus,
+            PooledKeypair.ciph_modulus == str(int(ciph_modulus)))
+
+
+class KeypairPool:
+    """
+    Database-backed keypair pool with a background refill thread.
+
+    take() works without start(), e.g. from the CLI; it then only uses
+    keypairs already in the table.
+    """
+
+    def __init__(self, db_url, target_depth=POOL_TARGET_DEPTH, refill_interval=POOL_REFILL_INTERVAL,
+                 profiles=POOL_PROFILES):
+        self.db_url = db_url
+        self.target_depth = target_depth
+        self.refill_interval = refill_interval
+        self._targets = {tuple(int(v) for v in PROFILES[name]) for name in profiles}
+        self._workers = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+
+    def take(self, params):
+        """
+        Return a keypair for a parameter set, generating it inline if none is ready.
+
+        Args:
+            params: (poly_degree, plain_modulus, ciph_modulus) tuple
+
+        Returns:
+            (public_key_json, secret_key_json) strings
+        """
+        params = tuple(int(v) for v in params)
+        keypair = self._take_stored(params)
+        with self._lock:
+            if keypair is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._targets.add(params)
+        self._wakeup.set()
+        if keypair is None:
+            keypair = generate_keypair(params)
+        return keypair
+
+    def depths(self):
+        """Stored keypairs per parameter set."""
+        columns = (PooledKeypair.poly_degree, PooledKeypair.plain_modulus, PooledKeypair.ciph_modulus)
+        with get_engine(self.db_url).connect() as conn:
+            rows = conn.execute(select(*columns, func.count(PooledKeypair.id)).group_by(*columns)).all()
+        return {(degree, plain, int(ciph)): count for degree, plain, ciph, count in rows}
+
+    def stats(self):
+        """Hit/miss counters and the stored depth of each parameter set."""
+        with self._lock:
+            hits, misses, generated = self.hits, self.misses, self.generated
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'generated': generated,
+            'depths': {'/'.join(map(str, params)): count for params, count in sorted(self.depths().items())}
+        }
+
+    def start(self):
+        """Start the refill thread and its key generation process."""
+        if self._thread is None:
+            self._workers = multiprocessing.Pool(1, initializer=_init_worker, initargs=(list(sys.path),))
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refill thread, abandoning the keypair being generated, if any."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._workers is not None:
+            self._workers.terminate()
+            self._workers.join()
+
+    def _take_stored(self, params):
+        """Claim the oldest stored keypair for params, or return None."""
+        with get_engine(self.db_url).begin() as conn:
+            while True:
+                row = conn.execute(
+                    PooledKeypair.__table__.select().where(*_params_filter(params))
+                    .order_by(PooledKeypair.id).limit(1)
+                ).first()
+                if row is None:
+                    return None
+                # Another process may have claimed the same row first
+                deleted = conn.execute(
+                    PooledKeypair.__table__.delete().where(PooledKeypair.id == row.id)
+                ).rowcount
+                if deleted:
+                    return row.public_key_json, row.secret_key_json
+
+    def _refill(self):
+        """Generate keypairs, one at a time in the worker, for every parameter set below its target depth."""
+        with self._lock:
+            targets = sorted(self._targets)
+        depths = self.depths()
+        for params in targets:
+            for _ in range(self.target_depth - depths.get(params, 0)):
+                result = self._workers.apply_async(generate_keypair, (params,))
+                while not result.ready():
+                    if self._stopped.wait(0.1):
+                        return
+                public_key_json, secret_key_json = result.get()
+                with get_engine(self.db_url).begin() as conn:
+                    conn.execute(PooledKeypair.__table__.insert().values(
+                        poly_degree=params[0],
+                        plain_modulus=params[1],
+                        ciph_modulus=str(params[2]),
+                        public_key_json=public_key_json,
+                        secret_key_json=secret_key_json,
+                        created_at=datetime.now(timezone.utc)
+                    ))
+                with self._lock:
+                    self.generated += 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._refill()
+            except Exception as e:
+                print(f"Error refilling keypair pool: {e}")
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
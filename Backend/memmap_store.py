@@ -0,0 +1,481 @@
+"""
+Memory-mapped accumulators for open questionnaires.
+
+Questionnaires created with accumulator_storage 'memmap' keep their running
+sum in one file-backed NumPy memmap shared by all of them. Each has a slot
+in the file: a 64-byte header followed by its (ciphertexts, 2, degree)
+uint64 array. A small JSON index next to the file maps each link to its
+slot's offset.
+
+Ballots are still appended to CiphertextLog, in the same transaction as
+their SubmissionRecord rows and num_responses increment, so the commit is
+the durability point: the database alone always holds the full sum, the
+AccumulatorShard row 0 checkpoint plus every log entry after it, and
+processes without a store read that. Once the write has committed, the
+serving process adds the group it already holds in memory straight into
+the slot (add_arrays with out= on the mapped array, see add), so the entry
+is never read back. Entries from other processes (e.g. import_ballots) are
+folded in from the log. The slot header remembers the last entry id
+included, so an entry is never added twice, and a slot only ever holds
+committed ballots.
+
+In the background the store msyncs the file every MSYNC_INTERVAL seconds
+and every CHECKPOINT_INTERVAL seconds writes each slot into the
+questionnaire's AccumulatorShard row 0, with the number of ballots it
+holds, and deletes the log entries it covers, in one transaction. Each
+slot header carries its ballot count and a digest of its array. On startup
+(warm) a slot whose digest does not match, that is missing, or whose count
+differs from num_responses after folding the log is rebuilt from the
+database, so losing the file loses no ballots.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+from sqlalchemy import func, or_
+
+from models import get_session_factory, Questionnaire, AccumulatorShard, CiphertextLog
+from accumulator import STORAGE_MEMMAP
+from ciphertext_arrays import add_arrays, sum_arrays, pack_ciphertext_array, unpack_ciphertext_array, coefficient_dtype
+from slot_packing import num_ciphertexts
+
+# Seconds between background folds and msyncs
+MSYNC_INTERVAL = 1.0
+
+# Seconds between checkpoints of every slot into the database
+CHECKPOINT_INTERVAL = 60.0
+
+# Size of a new accumulator file; it doubles whenever it runs out of room
+INITIAL_FILE_SIZE = 1 << 20
+
+_MAGIC = b'BFVACC02'
+# magic, questionnaire id, last folded log id, ballots summed, ballots checkpointed, has sum, digest
+_SLOT_HEADER = struct.Struct('<8sqqqqq16s')
+_SLOT_ALIGNMENT = 64
+_HEADER_SIZE = -(-_SLOT_HEADER.size // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+
+
+def supports(ciph_modulus):
+    """True if sums mod ciph_modulus fit the store's uint64 slots."""
+    return coefficient_dtype(ciph_modulus) == np.uint64
+
+
+class _Slot:
+    """Where one questionnaire's sum lives in the file, and how far it has been folded."""
+
+    def __init__(self, questionnaire_id, link, offset, shape, ciph_modulus):
+        self.questionnaire_id = questionnaire_id
+        self.link = link
+        self.offset = offset
+        self.shape = tuple(shape)
+        self.ciph_modulus = int(ciph_modulus)
+        self.watermark = 0      # Last CiphertextLog id added or folded in
+        self.responses = 0      # Ballots summed into the slot
+        self.checkpointed = 0   # Ballots in its last database checkpoint
+        self.has_sum = False
+        self.valid = False      # Header and array agree; otherwise rebuilt before use
+
+    @property
+    def nbytes(self):
+        return _HEADER_SIZE + int(np.prod(self.shape)) * 8
+
+
+class MemmapStore:
+    """
+    File-backed running sums of the open 'memmap' questionnaires.
+
+    Safe to share between threads. Only one process may open a given file.
+    """
+
+    def __init__(self, db_url, path, msync_interval=MSYNC_INTERVAL, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.db_url = db_url
+        self.path = path
+        self.index_path = path + '.index.json'
+        self.msync_interval = msync_interval
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._slots = {}  # questionnaire id -> _Slot
+        self._free = []   # [offset, size] of released slots
+        self._end = 0     # First byte past the last slot
+        self._dirty = False
+        self._stats = {'added': 0, 'loads': 0, 'rebuilds': 0, 'folded': 0, 'checkpoints': 0}
+        self._stopped = threading.Event()
+        self._thread = None
+        self._open()
+
+    def track(self, questionnaire):
+        """Give a new questionnaire its slot."""
+        with self._lock:
+            self._ensure_slot_locked(None, questionnaire)
+
+    def add(self, session, questionnaire_id, entry_id, array, count):
+        """
+        Add a committed log entry, the sum of count ballots, into a questionnaire's slot.
+
+        The caller passes the array it wrote, so the entry is not read back.
+        Earlier entries are folded in first; an entry already folded is skipped.
+        """
+        with self._lock:
+            slot = self._slots.get(questionnaire_id)
+            if slot is None or not slot.valid:
+                slot = self._ensure_slot_locked(session, session.get(Questionnaire, questionnaire_id))
+            self._fold_locked(session, slot, before=entry_id)
+            if entry_id <= slot.watermark:
+                return
+            target = self._array(slot)
+            add_arrays(array, target, slot.ciph_modulus, out=target)
+            slot.watermark = entry_id
+            slot.responses += count
+            slot.has_sum = True
+            self._write_header_locked(slot)
+            self._stats['added'] += count
+
+    def invalidate(self, questionnaire_id):
+        """Have a slot rebuilt from the database before its next use, e.g. after a failed add."""
+        with self._lock:
+            slot = self._slots.get(questionnaire_id)
+            if slot is not None:
+                slot.valid = False
+
+    def load(self, session, questionnaire):
+        """
+        Fold the questionnaire's new log entries into its slot and return its sum.
+
+        The slot may already include entries committed after the session's
+        transaction began, if another thread folded or added them first.
+
+        Returns:
+            A copy of the (ciphertexts, 2, degree) array, or None if nothing has been stored yet
+        """
+        with self._lock:
+            self._stats['loads'] += 1
+            slot = self._ensure_slot_locked(session, questionnaire)
+            self._fold_locked(session, slot)
+            if not slot.has_sum:
+                return None
+            return self._array(slot).copy()
+
+    def drop(self, questionnaire_id):
+        """Release a questionnaire's slot, e.g. once its sum is finalized."""
+        with self._lock:
+            self._drop_locked(questionnaire_id)
+
+    def warm(self):
+        """
+        Make sure every open 'memmap' questionnaire has a valid, folded slot.
+
+        A slot whose ballot count does not match num_responses once the log
+        is folded in is rebuilt from the database.
+
+        Returns:
+            int: Slots ready
+        """
+        session = get_session_factory(self.db_url).session_factory()
+        try:
+            questionnaires = session.query(Questionnaire).filter(
+                Questionnaire.accumulator_storage == STORAGE_MEMMAP,
+                Questionnaire.final_accumulator_blob.is_(None),
+                or_(Questionnaire.is_decrypted.is_(None), Questionnaire.is_decrypted == 0)
+            ).all()
+            with self._lock:
+                for questionnaire in questionnaires:
+                    counted = questionnaire.num_responses or 0
+                    slot = self._ensure_slot_locked(session, questionnaire)
+                    self._fold_locked(session, slot)
+                    if slot.responses != counted:
+                        slot.valid = False
+                        slot = self._ensure_slot_locked(session, questionnaire)
+                        self._fold_locked(session, slot)
+                    if slot.responses != counted:
+                        print(f"Error: questionnaire {questionnaire.link} has {counted} ballots counted "
+                              f"but {slot.responses} in its checkpoint and log")
+                self._flush_locked()
+            return len(questionnaires)
+        finally:
+            session.close()
+
+    def fold(self):
+        """Fold the new log entries of every slot and msync the file."""
+        session = get_session_factory(self.db_url).session_factory()
+        try:
+            with self._lock:
+                for slot in list(self._slots.values()):
+                    if slot.valid:
+                        self._fold_locked(session, slot)
+                self._flush_locked()
+        finally:
+            session.close()
+
+    def checkpoint(self):
+        """
+        Write every slot changed since its last checkpoint into its AccumulatorShard row 0.
+
+        The log entries the slot covers are deleted in the same transaction.
+        Slots of questionnaires whose sum has been finalized are released.
+
+        Returns:
+            int: Slots checkpointed
+        """
+        session = get_session_factory(self.db_url).session_factory()
+        try:
+            done = 0
+            for questionnaire_id in list(self._slots):
+                done += self._checkpoint_slot(session, questionnaire_id)
+            with self._lock:
+                self._stats['checkpoints'] += done
+                self._flush_locked()
+            return done
+        finally:
+            session.close()
+
+    def stats(self):
+        """Slots held, file size, ballots added, and how often sums were read, rebuilt, folded and checkpointed."""
+        with self._lock:
+            return dict(self._stats, slots=len(self._slots), bytes=len(self._map))
+
+    def start(self):
+        """Start msyncing, folding and checkpointing in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and checkpoint everything."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.checkpoint()
+
+    def _run(self):
+        since_checkpoint = 0.0
+        while not self._stopped.wait(self.msync_interval):
+            since_checkpoint += self.msync_interval
+            try:
+                if since_checkpoint >= self.checkpoint_interval:
+                    since_checkpoint = 0.0
+                    self.checkpoint()
+                else:
+                    self.fold()
+            except Exception as e:
+                print(f"Error updating accumulator file: {e}")
+
+    def _checkpoint_slot(self, session, questionnaire_id):
+        """Checkpoint one slot in its own transaction; returns 1 if it was written."""
+        try:
+            # Same row update as every write's num_responses increment, so a
+            # finalization cannot commit between this check and the checkpoint.
+            # The slot only ever holds committed entries; its array, count and
+            # watermark are copied together under the lock add() takes.
+            still_open = session.query(Questionnaire).filter(
+                Questionnaire.id == questionnaire_id,
+                Questionnaire.final_accumulator_blob.is_(None)
+            ).update({Questionnaire.num_responses: Questionnaire.num_responses}, synchronize_session=False)
+            with self._lock:
+                slot = self._slots.get(questionnaire_id)
+                if slot is None or not slot.valid or not still_open:
+                    session.rollback()
+                    if slot is not None and not still_open:
+                        self._drop_locked(questionnaire_id)
+                    return 0
+                self._fold_locked(session, slot)
+                if slot.responses == slot.checkpointed:
+                    session.rollback()
+                    return 0
+                blob = pack_ciphertext_array(self._array(slot))
+                responses, watermark = slot.responses, slot.watermark
+
+            shard = session.query(AccumulatorShard).filter_by(questionnaire_id=questionnaire_id, shard_id=0).first()
+            if shard is None:
+                shard = AccumulatorShard(questionnaire_id=questionnaire_id, shard_id=0)
+                session.add(shard)
+            shard.accumulated_responses_blob = blob
+            shard.num_responses = responses
+            session.query(Questionnaire).filter_by(id=questionnaire_id).update(
+                {Questionnaire.accumulated_responses_blob: None}, synchronize_session=False
+            )
+            session.query(CiphertextLog).filter(
+                CiphertextLog.questionnaire_id == questionnaire_id,
+                CiphertextLog.id <= watermark
+            ).delete(synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        with self._lock:
+            if self._slots.get(questionnaire_id) is slot:
+                slot.checkpointed = responses
+                self._write_header_locked(slot)
+        return 1
+
+    def _open(self):
+        """Map the file and take back every slot of the index whose header and digest check out."""
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                f.truncate(INITIAL_FILE_SIZE)
+            # An index left without its file describes nothing
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r+')
+
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path) as f:
+            index = json.load(f)
+        self._end = index['end']
+        self._free = index['free']
+        if self._end > len(self._map):
+            self._grow_locked(self._end)
+        for link, entry in index['slots'].items():
+            slot = _Slot(entry['questionnaire_id'], link, entry['offset'], entry['shape'], entry['ciph_modulus'])
+            magic, questionnaire_id, watermark, responses, checkpointed, has_sum, digest = _SLOT_HEADER.unpack_from(
+                self._map, slot.offset
+            )
+            if magic == _MAGIC and questionnaire_id == slot.questionnaire_id and digest == self._digest(slot):
+                slot.watermark, slot.responses, slot.checkpointed = watermark, responses, checkpointed
+                slot.has_sum = bool(has_sum)
+                slot.valid = True
+            self._slots[slot.questionnaire_id] = slot
+
+    def _ensure_slot_locked(self, session, questionnaire):
+        """The questionnaire's slot, allocated and rebuilt from its checkpoint as needed; fold the log after."""
+        slot = self._slots.get(questionnaire.id)
+        if slot is not None and slot.valid:
+            return slot
+        if slot is None:
+            count = num_ciphertexts(questionnaire.num_questions or len(questionnaire.get_questions()),
+                                    questionnaire.questions_per_ciphertext or 1)
+            slot = _Slot(questionnaire.id, questionnaire.link, 0, (count, 2, questionnaire.poly_degree),
+                         questionnaire.ciph_modulus)
+            slot.offset = self._allocate_locked(slot.nbytes)
+            self._slots[questionnaire.id] = slot
+            self._write_index_locked()
+
+        own_session = session is None
+        if own_session:
+            session = get_session_factory(self.db_url).session_factory()
+        try:
+            shards = session.query(AccumulatorShard).filter_by(questionnaire_id=questionnaire.id).all()
+            legacy, counted = session.query(
+                Questionnaire.accumulated_responses_blob, Questionnaire.num_responses
+            ).filter_by(id=questionnaire.id).one()
+            logged = session.query(func.sum(CiphertextLog.num_ballots)).filter_by(
+                questionnaire_id=questionnaire.id
+            ).scalar() or 0
+        finally:
+            if own_session:
+                session.close()
+        parts = [shard.get_accumulated_array() for shard in shards if shard.accumulated_responses_blob]
+        responses = sum(shard.num_responses or 0 for shard in shards)
+        if legacy:
+            # Checkpoint kept on the Questionnaire row by earlier versions, when every
+            # ballot was also logged: it holds whatever the log does not
+            parts.append(unpack_ciphertext_array(legacy))
+            responses = (counted or 0) - logged
+        array = self._array(slot)
+        array[...] = sum_arrays(parts, slot.ciph_modulus) if parts else 0
+        slot.watermark = 0
+        slot.responses = slot.checkpointed = responses
+        slot.has_sum = bool(parts)
+        slot.valid = True
+        self._write_header_locked(slot)
+        self._stats['rebuilds'] += 1
+        return slot
+
+    def _fold_locked(self, session, slot, before=None):
+        """Add the slot's log entries past its watermark (and before the given id) into it, in id order."""
+        own_session = session is None
+        if own_session:
+            session = get_session_factory(self.db_url).session_factory()
+        try:
+            query = session.query(CiphertextLog).filter(
+                CiphertextLog.questionnaire_id == slot.questionnaire_id,
+                CiphertextLog.id > slot.watermark
+            )
+            if before is not None:
+                query = query.filter(CiphertextLog.id < before)
+            entries = query.order_by(CiphertextLog.id).all()
+        finally:
+            if own_session:
+                session.close()
+        if not entries:
+            return
+
+        array = self._array(slot)
+        for entry in entries:
+            add_arrays(entry.get_ciphertext_array(), array, slot.ciph_modulus, out=array)
+        slot.watermark = entries[-1].id
+        slot.responses += sum(entry.num_ballots for entry in entries)
+        slot.has_sum = True
+        self._write_header_locked(slot)
+        self._stats['folded'] += len(entries)
+
+    def _array(self, slot):
+        start = slot.offset + _HEADER_SIZE
+        return self._map[start:start + slot.nbytes - _HEADER_SIZE].view(np.uint64).reshape(slot.shape)
+
+    def _digest(self, slot):
+        return hashlib.blake2b(self._array(slot).tobytes(), digest_size=16).digest()
+
+    def _write_header_locked(self, slot):
+        _SLOT_HEADER.pack_into(self._map, slot.offset, _MAGIC, slot.questionnaire_id, slot.watermark,
+                               slot.responses, slot.checkpointed, int(slot.has_sum), self._digest(slot))
+        self._dirty = True
+
+    def _drop_locked(self, questionnaire_id):
+        slot = self._slots.pop(questionnaire_id, None)
+        if slot is None:
+            return
+        self._map[slot.offset:slot.offset + _HEADER_SIZE] = 0
+        self._free.append([slot.offset, slot.nbytes])
+        self._write_index_locked()
+
+    def _allocate_locked(self, nbytes):
+        """Offset of nbytes of free space: a released slot if one fits, else the end of the file."""
+        for i, (offset, size) in enumerate(self._free):
+            if size >= nbytes:
+                if size - nbytes >= _HEADER_SIZE:
+                    self._free[i] = [offset + nbytes, size - nbytes]
+                else:
+                    del self._free[i]
+                return offset
+
+        offset = self._end
+        self._end += -(-nbytes // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+        if self._end > len(self._map):
+            self._grow_locked(self._end)
+        return offset
+
+    def _grow_locked(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.flush()
+        del self._map
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r+')
+
+    def _write_index_locked(self):
+        """Replace the index file atomically."""
+        index = {
+            'end': self._end,
+            'free': self._free,
+            'slots': {slot.link: {'questionnaire_id': slot.questionnaire_id, 'offset': slot.offset,
+                                  'shape': list(slot.shape), 'ciph_modulus': str(slot.ciph_modulus)}
+                      for slot in self._slots.values()}
+        }
+        self._map.flush()
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+
+    def _flush_locked(self):
+        if self._dirty:
+            self._map.flush()
+            self._dirty = False
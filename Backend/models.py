@@ -2,14 +2,42 @@
 Database models for the encrypted questionnaire system using SQLAlchemy ORM.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON, PickleType
+from sqlalchemy import (create_engine, event, inspect, text, select, and_, or_, Column, Integer, BigInteger, String, Text,
+                        DateTime, JSON, PickleType, LargeBinary, UniqueConstraint, Index)
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from datetime import datetime, timezone
+import base64
+import hashlib
+import threading
 import json
 
+from ciphertext_arrays import (pack_ciphertext_array, unpack_ciphertext_array, pack_compact_array,
+                               unpack_compact_array, json_to_array)
+
 Base = declarative_base()
 
+DEFAULT_DB_URL = 'sqlite:///questionnaires.db'
+
+# Connection pool settings for the process-wide engine
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600  # Seconds before a pooled connection is replaced
+
+# SQLite tuning applied once per new DBAPI connection
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# Questionnaires per page of the list endpoint, by default and at most
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
+
+_engines = {}
+_async_engines = {}
+_sessions = {}
+_engine_lock = threading.Lock()
+
 
 class Questionnaire(Base):
     """
@@ -28,29 +56,54 @@ class Questionnaire(Base):
     link = Column(String(255), unique=True, nullable=False, index=True)
     deadline = Column(DateTime, nullable=False)
     questions_json = Column(Text, nullable=False)  # JSON string with questions
+    num_questions = Column(Integer, nullable=True)  # len(questions), kept by set_questions
     
     # BFV Parameters
     poly_degree = Column(Integer, nullable=False)
     plain_modulus = Column(Integer, nullable=False)
     ciph_modulus = Column(String(100), nullable=False)  # Store as string for large numbers
     
+    # Questions sharing one ciphertext's slots (see slot_packing)
+    questions_per_ciphertext = Column(Integer, nullable=False, default=1, server_default='1')
+    
     # Encryption keys (stored as JSON serialized polynomials)
     public_key_json = Column(Text, nullable=False)
+    public_key_sha256 = Column(String(64), nullable=True, index=True)  # public_key_digest(public_key_json)
     secret_key_json = Column(Text, nullable=False)
     
     # Accumulated encrypted responses
-    # This is a list of lists: one list per question, each containing accumulated ciphertext
-    accumulated_responses_json = Column(Text, nullable=True)  # JSON string
+    # Packed coefficient array of shape ciphertexts x 2 x poly_degree (see ciphertext_arrays)
+    accumulated_responses_blob = Column(LargeBinary, nullable=True)
+    
+    # Number of AccumulatorShard rows new responses are spread over
+    num_shards = Column(Integer, nullable=False, default=1, server_default='1')
+    
+    # Where ballots are summed: 'log' (CiphertextLog and AccumulatorShard rows) or
+    # 'coefficients' (one AccumulatorCoefficient row per coefficient, see coefficient_table)
+    accumulator_storage = Column(String(16), nullable=False, default='log', server_default='log')
+    
+    # Finalized sum, modulus-switched down once no more ballots can arrive (see
+    # modulus_switching); replaces the accumulator, shards and log when set
+    final_accumulator_blob = Column(LargeBinary, nullable=True)  # Compact array (see ciphertext_arrays)
+    final_ciph_modulus = Column(String(100), nullable=True)  # Modulus of final_accumulator_blob
     
     # Decrypted results (stored after deadline)
     decrypted_results_json = Column(Text, nullable=True)  # JSON string with decrypted results
-    is_decrypted = Column(Integer, default=0)  # Boolean flag: 0=not decrypted, 1=decrypted
+    results_version = Column(String(100), nullable=True)  # Accumulator version the results were decrypted from
+    is_decrypted = Column(Integer, default=0)  # Boolean flag: 1=final results decrypted after the deadline
     hide_results_until_deadline = Column(Integer, default=1)  # 1=true, 0=false
 
     # Metadata
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     num_responses = Column(Integer, default=0)
     
+    __table_args__ = (
+        # Pending deadlines in order, for the deadline scheduler
+        Index('ix_questionnaires_decrypted_deadline', 'is_decrypted', 'deadline'),
+        # Keyset pagination of the questionnaire list
+        Index('ix_questionnaires_created_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f"<Questionnaire(id={self.id}, link='{self.link}', deadline='{self.deadline}')>"
     
@@ -61,6 +114,7 @@ class Questionnaire(Base):
     def set_questions(self, questions):
         """Set questions from Python object."""
         self.questions_json = json.dumps(questions)
+        self.num_questions = len(questions)
     
     def get_public_key(self):
         """Parse and return public key."""
@@ -69,6 +123,7 @@ class Questionnaire(Base):
     def set_public_key(self, public_key):
         """Set public key from Python object."""
         self.public_key_json = json.dumps(public_key)
+        self.public_key_sha256 = public_key_digest(self.public_key_json)
     
     def get_secret_key(self):
         """Parse and return secret key."""
@@ -78,22 +133,35 @@ class Questionnaire(Base):
         """Set secret key from Python object."""
         self.secret_key_json = json.dumps(secret_key)
     
-    def get_accumulated_responses(self):
-        """Parse and return accumulated responses."""
-        if self.accumulated_responses_json:
-            return json.loads(self.accumulated_responses_json)
+    def get_accumulated_array(self):
+        """Return accumulated responses as a read-only (ciphertexts, 2, degree) array view."""
+        if self.accumulated_responses_blob:
+            return unpack_ciphertext_array(self.accumulated_responses_blob)
         return None
     
-    def set_accumulated_responses(self, responses):
-        """Set accumulated responses from Python object."""
-        self.accumulated_responses_json = json.dumps(responses)
+    def set_accumulated_array(self, array):
+        """Store accumulated responses from a (ciphertexts, 2, degree) array."""
+        self.accumulated_responses_blob = pack_ciphertext_array(array)
+    
+    def get_final_array(self):
+        """Return the finalized sum as (ciph_modulus, array), or None if not finalized."""
+        if self.final_accumulator_blob:
+            return int(self.final_ciph_modulus), unpack_compact_array(self.final_accumulator_blob)
+        return None
+    
+    def set_final_array(self, ciph_modulus, array):
+        """Store the finalized sum, reduced mod ciph_modulus."""
+        self.final_accumulator_blob = pack_compact_array(array, ciph_modulus)
+        self.final_ciph_modulus = str(int(ciph_modulus))
+        self.accumulated_responses_blob = None
     
     def get_params(self):
         """Return BFV parameters as dict."""
         return {
             'poly_degree': self.poly_degree,
             'plain_modulus': self.plain_modulus,
-            'ciph_modulus': int(self.ciph_modulus)
+            'ciph_modulus': int(self.ciph_modulus),
+            'questions_per_ciphertext': self.questions_per_ciphertext or 1
         }
     
     def get_decrypted_results(self):
@@ -102,10 +170,23 @@ class Questionnaire(Base):
             return json.loads(self.decrypted_results_json)
         return None
     
-    def set_decrypted_results(self, results):
-        """Set decrypted results from Python object."""
+    def set_decrypted_results(self, results, version=None, final=True):
+        """
+        Set decrypted results from Python object.
+        
+        Args:
+            results: Per-question results
+            version: Accumulator version they were decrypted from (see accumulator.accumulator_version)
+            final: Whether these are the final results, decrypted after the deadline
+        """
         self.decrypted_results_json = json.dumps(results)
-        self.is_decrypted = 1
+        self.results_version = version
+        self.is_decrypted = 1 if final else 0
+
+
+def public_key_digest(public_key_json):
+    """Content address of a serialized public key (hex SHA-256 of the stored JSON text)."""
+    return hashlib.sha256(public_key_json.encode('utf-8')).hexdigest()
 
 
 class SubmissionRecord(Base):
@@ -120,12 +201,413 @@ class SubmissionRecord(Base):
     submitted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
     __table_args__ = (
+        # One submission per certificate: the duplicate check is a single index
+        # probe, and two writers can never both record the same fingerprint
+        Index('ux_submission_records_questionnaire_cert', 'questionnaire_id', 'cert_fingerprint', unique=True),
+        {'sqlite_autoincrement': True}
+    )
+
+
+class AccumulatorShard(Base):
+    """
+    Checkpointed partial sum of a questionnaire's encrypted responses.
+    
+    Ballots are spread over the questionnaire's num_shards shards by certificate
+    fingerprint. New ballots are appended to CiphertextLog and periodically
+    compacted into the shard row, so concurrent writers never update the same
+    row. The full accumulator is the homomorphic sum of all shards plus the
+    entries still in the log.
+    """
+    __tablename__ = 'accumulator_shards'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    questionnaire_id = Column(Integer, nullable=False, index=True)
+    shard_id = Column(Integer, nullable=False)
+    accumulated_responses_blob = Column(LargeBinary, nullable=True)  # Same layout as Questionnaire
+    num_responses = Column(Integer, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint('questionnaire_id', 'shard_id'),
+        {'sqlite_autoincrement': True}
+    )
+    
+    def get_accumulated_array(self):
+        """Return this shard's partial sum as a read-only (ciphertexts, 2, degree) array view."""
+        if self.accumulated_responses_blob:
+            return unpack_ciphertext_array(self.accumulated_responses_blob)
+        return None
+    
+    def set_accumulated_array(self, array):
+        """Store this shard's partial sum from a (ciphertexts, 2, degree) array."""
+        self.accumulated_responses_blob = pack_ciphertext_array(array)
+
+
+class CiphertextLog(Base):
+    """
+    Append-only log of encrypted ballots waiting to be compacted.
+    
+    Each entry holds the homomorphic sum of num_ballots ballots for one shard.
+    Entries are only ever inserted and, once folded into the shard checkpoint,
+    deleted.
+    """
+    __tablename__ = 'ciphertext_log'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    questionnaire_id = Column(Integer, nullable=False)
+    shard_id = Column(Integer, nullable=False)
+    num_ballots = Column(Integer, nullable=False, default=1)
+    ciphertexts_blob = Column(LargeBinary, nullable=True)  # Same layout as Questionnaire
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        Index('ix_ciphertext_log_shard', 'questionnaire_id', 'shard_id'),
+        {'sqlite_autoincrement': True}
+    )
+    
+    def get_ciphertext_array(self):
+        """Return the logged sum as a read-only (ciphertexts, 2, degree) array view."""
+        return unpack_ciphertext_array(self.ciphertexts_blob)
+    
+    def set_ciphertext_array(self, array):
+        """Store the logged sum from a (ciphertexts, 2, degree) array."""
+        self.ciphertexts_blob = pack_ciphertext_array(array)
+
+
+class AccumulatorCoefficient(Base):
+    """
+    One coefficient of a questionnaire's accumulated sum.
+    
+    Used by questionnaires with accumulator_storage 'coefficients'. A ballot is
+    added with UPDATE ... SET value = (value + delta) % modulus, so the database
+    does the arithmetic and nothing is read back (see coefficient_table).
+    """
+    __tablename__ = 'accumulator_coefficients'
+    
+    questionnaire_id = Column(Integer, primary_key=True, autoincrement=False)
+    ciphertext_index = Column(Integer, primary_key=True, autoincrement=False)  # Ciphertext (group of questions)
+    component = Column(Integer, primary_key=True, autoincrement=False)  # 0 for c0, 1 for c1
+    coeff_index = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class PooledKeypair(Base):
+    """
+    Pre-generated BFV keypair waiting to be given to a new questionnaire.
+    
+    Each row is handed out once and deleted when taken (see keypair_pool), so
+    a keypair is never shared between questionnaires.
+    """
+    __tablename__ = 'keypair_pool'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    poly_degree = Column(Integer, nullable=False)
+    plain_modulus = Column(Integer, nullable=False)
+    ciph_modulus = Column(String(100), nullable=False)  # Same format as Questionnaire
+    public_key_json = Column(Text, nullable=False)
+    secret_key_json = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        Index('ix_keypair_pool_params', 'poly_degree', 'plain_modulus', 'ciph_modulus'),
         {'sqlite_autoincrement': True}
     )
 
 
 # Database initialization
-def init_db(db_url='sqlite:///questionnaires.db'):
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL journaling and relaxed syncing on every new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+def get_engine(db_url=DEFAULT_DB_URL, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+               pool_recycle=POOL_RECYCLE):
+    """
+    Return the process-wide engine for a database URL, creating it on first use.
+    
+    Args:
+        db_url: SQLAlchemy database URL
+        pool_size: Number of connections kept open in the pool
+        max_overflow: Extra connections allowed above pool_size under load
+        pool_recycle: Seconds after which a pooled connection is recycled
+    
+    Returns:
+        engine: Shared database engine
+    """
+    with _engine_lock:
+        engine = _engines.get(db_url)
+        if engine is not None:
+            return engine
+        
+        kwargs = {'echo': False}
+        is_sqlite = db_url.startswith('sqlite')
+        if is_sqlite:
+            # Pooled connections are handed between request threads
+            kwargs['connect_args'] = {'check_same_thread': False}
+        if not (is_sqlite and ':memory:' in db_url):
+            kwargs.update(
+                poolclass=QueuePool,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_recycle=pool_recycle,
+                pool_pre_ping=True
+            )
+        
+        engine = create_engine(db_url, **kwargs)
+        if is_sqlite:
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+        
+        _engines[db_url] = engine
+        _sessions[db_url] = scoped_session(sessionmaker(bind=engine))
+        return engine
+
+
+def get_async_engine(db_url=DEFAULT_DB_URL, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                     pool_recycle=POOL_RECYCLE):
+    """
+    Return the process-wide asyncio engine for a database URL (see get_engine).
+    
+    SQLite URLs are served through the aiosqlite driver, which together with
+    greenlet is only needed by the ASGI server (asgi_app.py).
+    
+    Args:
+        db_url: SQLAlchemy database URL, e.g. 'sqlite:///questionnaires.db'
+    
+    Returns:
+        AsyncEngine: Shared asyncio engine
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    
+    is_sqlite = db_url.startswith('sqlite')
+    if db_url.startswith('sqlite://'):
+        db_url = 'sqlite+aiosqlite://' + db_url[len('sqlite://'):]
+    with _engine_lock:
+        engine = _async_engines.get(db_url)
+        if engine is not None:
+            return engine
+        
+        kwargs = {'echo': False}
+        if not (is_sqlite and ':memory:' in db_url):
+            kwargs.update(
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_recycle=pool_recycle,
+                pool_pre_ping=True
+            )
+        
+        engine = create_async_engine(db_url, **kwargs)
+        if is_sqlite:
+            event.listen(engine.sync_engine, 'connect', _set_sqlite_pragmas)
+        
+        _async_engines[db_url] = engine
+        return engine
+
+
+def get_session_factory(db_url=DEFAULT_DB_URL):
+    """
+    Return the thread-local session registry bound to the shared engine.
+    
+    Args:
+        db_url: SQLAlchemy database URL
+    
+    Returns:
+        Session: scoped_session registry
+    """
+    get_engine(db_url)
+    return _sessions[db_url]
+
+
+def _add_missing_columns(engine):
+    """Add columns introduced after an existing table was created."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+
+
+def _dedupe_submission_records(engine):
+    """
+    Delete duplicate submission records so the unique index can be created.
+    
+    Only databases from before the index can hold duplicates; the oldest
+    record of each (questionnaire, fingerprint) is kept.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table('submission_records'):
+        return
+    if 'ux_submission_records_questionnaire_cert' in {index['name'] for index in inspector.get_indexes('submission_records')}:
+        return
+    with engine.begin() as conn:
+        deleted = conn.execute(text(
+            'DELETE FROM submission_records WHERE id NOT IN ('
+            'SELECT MIN(id) FROM submission_records GROUP BY questionnaire_id, cert_fingerprint)'
+        )).rowcount
+    if deleted:
+        print(f"Removed {deleted} duplicate submission records")
+
+
+def _add_missing_indexes(engine):
+    """Create indexes introduced after an existing table was created."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+# Accumulator columns that used to hold JSON text: (table, JSON column, BLOB column, questionnaire id column)
+_LEGACY_JSON_ACCUMULATORS = [
+    ('questionnaires', 'accumulated_responses_json', 'accumulated_responses_blob', 'id'),
+    ('accumulator_shards', 'accumulated_responses_json', 'accumulated_responses_blob', 'questionnaire_id'),
+    ('ciphertext_log', 'ciphertexts_json', 'ciphertexts_blob', 'questionnaire_id'),
+]
+
+
+def migrate_json_accumulators(engine):
+    """
+    Convert accumulators stored as JSON text into packed array BLOBs.
+    
+    Each row is converted in place and the JSON column is dropped afterwards.
+    Tables without the legacy column are left alone, so this is safe to run
+    on every start.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        moduli = None
+        for table, json_column, blob_column, questionnaire_column in _LEGACY_JSON_ACCUMULATORS:
+            if not inspector.has_table(table):
+                continue
+            if json_column not in {column['name'] for column in inspector.get_columns(table)}:
+                continue
+            
+            if moduli is None:
+                moduli = dict(conn.execute(text('SELECT id, ciph_modulus FROM questionnaires')).all())
+            
+            rows = conn.execute(text(
+                f'SELECT id, {questionnaire_column}, {json_column} FROM {table} WHERE {json_column} IS NOT NULL'
+            )).all()
+            for row_id, questionnaire_id, value in rows:
+                array = json_to_array(value, moduli[questionnaire_id])
+                conn.execute(
+                    text(f'UPDATE {table} SET {blob_column} = :blob WHERE id = :id'),
+                    {'blob': pack_ciphertext_array(array) if array is not None else None, 'id': row_id}
+                )
+            
+            conn.exec_driver_sql(f'ALTER TABLE {table} DROP COLUMN {json_column}')
+            print(f"Migrated {len(rows)} JSON accumulators in {table} to binary storage")
+
+
+def _reset_unversioned_results(engine):
+    """
+    Clear the final flag on results stored before they carried an accumulator version.
+    
+    Those results may have been decrypted before the deadline, so they are
+    decrypted once more and stored with a version.
+    """
+    with engine.begin() as conn:
+        conn.execute(text(
+            'UPDATE questionnaires SET is_decrypted = 0 WHERE is_decrypted = 1 AND results_version IS NULL'
+        ))
+
+
+def _backfill_num_questions(engine):
+    """Fill num_questions for questionnaires created before the column existed."""
+    with engine.begin() as conn:
+        rows = conn.execute(text('SELECT id, questions_json FROM questionnaires WHERE num_questions IS NULL')).all()
+        for questionnaire_id, questions_json in rows:
+            conn.execute(text('UPDATE questionnaires SET num_questions = :n WHERE id = :id'),
+                         {'n': len(json.loads(questions_json)), 'id': questionnaire_id})
+
+
+def _backfill_public_key_digests(engine):
+    """Fill public_key_sha256 for questionnaires created before the column existed."""
+    with engine.begin() as conn:
+        rows = conn.execute(text('SELECT id, public_key_json FROM questionnaires WHERE public_key_sha256 IS NULL')).all()
+        for questionnaire_id, public_key_json in rows:
+            conn.execute(text('UPDATE questionnaires SET public_key_sha256 = :digest WHERE id = :id'),
+                         {'digest': public_key_digest(public_key_json), 'id': questionnaire_id})
+
+
+def encode_list_cursor(created_at, questionnaire_id):
+    """Opaque cursor pointing just past a questionnaire in the list order."""
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{questionnaire_id}'.encode()).decode('ascii')
+
+
+def decode_list_cursor(cursor):
+    """
+    Decode a cursor from encode_list_cursor.
+
+    Returns:
+        (created_at, id) tuple, created_at as naive UTC like the stored values
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, questionnaire_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode().split('|')
+        created_at = datetime.fromisoformat(created_at)
+        questionnaire_id = int(questionnaire_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at, questionnaire_id
+
+
+def questionnaire_list_query(limit=LIST_PAGE_SIZE, cursor=None, status=None):
+    """
+    Build the query for one page of the questionnaire list, newest first.
+
+    Only the listed columns are selected, never the keys or accumulators.
+    Pages are cut by keyset on (created_at, id), so every page is an index
+    range scan however deep it is. One row more than limit is selected; if it
+    comes back there is a next page (see questionnaire_list_page).
+
+    Args:
+        limit: Page size
+        cursor: Cursor from the previous page (default: first page)
+        status: 'open', 'expired' or None for all
+
+    Raises:
+        ValueError: If the cursor or status is invalid
+    """
+    query = select(
+        Questionnaire.id, Questionnaire.link, Questionnaire.created_at, Questionnaire.deadline,
+        Questionnaire.num_responses, Questionnaire.num_questions
+    )
+    if cursor:
+        created_at, questionnaire_id = decode_list_cursor(cursor)
+        query = query.where(or_(
+            Questionnaire.created_at < created_at,
+            and_(Questionnaire.created_at == created_at, Questionnaire.id < questionnaire_id)
+        ))
+    if status is not None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if status == 'open':
+            query = query.where(Questionnaire.deadline > now)
+        elif status == 'expired':
+            query = query.where(Questionnaire.deadline <= now)
+        else:
+            raise ValueError(f'Unknown status {status!r}')
+    return query.order_by(Questionnaire.created_at.desc(), Questionnaire.id.desc()).limit(limit + 1)
+
+
+def questionnaire_list_page(rows, limit):
+    """Split rows from questionnaire_list_query into (page rows, next cursor or None)."""
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_list_cursor(last.created_at, last.id)
+
+
+def init_db(db_url=DEFAULT_DB_URL):
     """
     Initialize the database.
     
@@ -133,17 +615,27 @@ def init_db(db_url='sqlite:///questionnaires.db'):
         db_url: SQLAlchemy database URL (default: SQLite)
     
     Returns:
-        engine, Session: Database engine and session maker
+        engine, Session: Shared database engine and scoped session registry
     """
-    engine = create_engine(db_url, echo=False)
+    engine = get_engine(db_url)
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return engine, Session
+    _add_missing_columns(engine)
+    _dedupe_submission_records(engine)
+    _add_missing_indexes(engine)
+    _backfill_num_questions(engine)
+    _backfill_public_key_digests(engine)
+    migrate_json_accumulators(engine)
+    _reset_unversioned_results(engine)
+    return engine, get_session_factory(db_url)
 
 
-def get_session(db_url='sqlite:///questionnaires.db'):
+def get_session(db_url=DEFAULT_DB_URL):
     """
-    Get a new database session.
+    Get the current thread's database session.
+    
+    Sessions come from a scoped registry on the shared engine, so repeated
+    calls on the same thread return the same session and connections are
+    reused from the pool instead of being opened per call.
     
     Args:
         db_url: SQLAlchemy database URL
@@ -151,9 +643,13 @@ def get_session(db_url='sqlite:///questionnaires.db'):
     Returns:
         session: Database session
     """
-    engine = create_engine(db_url, echo=False)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return get_session_factory(db_url)()
+
+
+def remove_session(db_url=DEFAULT_DB_URL):
+    """Discard the current thread's session (e.g. at the end of a request)."""
+    if db_url in _sessions:
+        _sessions[db_url].remove()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+"""
+Modulus switching of finalized accumulators.
+
+After the deadline no more ballots are added, yet the sum would keep its
+full ciph_modulus width forever. BFV decryption only needs each
+ciphertext's noise to stay well below q / (2t). A sum of ballots carries
+far less noise than that, so the sum can be switched to a much smaller
+modulus q' (c -> round(c * q' / q), see ciphertext_arrays.switch_modulus).
+The switch scales the noise by q' / q and adds a small rounding term.
+
+The smallest usable modulus is found with the secret key. Candidates are
+powers of two, searched by bit length. Each candidate's switched sum is
+decrypted to its phase c0 + c1 * s and its worst noise is measured. A
+candidate is accepted only if every coefficient decrypts exactly as before,
+with NOISE_MARGIN_BITS to spare. The result is stored in ceil(bits / 8)
+bytes per coefficient instead of eight (see ciphertext_arrays.pack_compact_array).
+
+The decryption service finalizes each questionnaire together with its final
+results. Questionnaires closed before this existed are finalized with:
+
+    python modulus_switching.py --all
+"""
+
+import sys
+import os
+
+import numpy as np
+
+# Add py-fhe to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'py-fhe'))
+
+from models import init_db, get_session, Questionnaire
+from accumulator import load_accumulated_array, store_final_array, params_of, last_log_id
+from ciphertext_arrays import switch_modulus, pack_ciphertext_array
+from crypto_context import secret_keys
+
+# Noise headroom kept below the decryption limit, in bits
+NOISE_MARGIN_BITS = 2
+
+# Coefficients are split into limbs of this many bits so the convolutions stay in int64
+_LIMB_BITS = 16
+
+
+def _negacyclic_multiply(coeffs, secret, modulus):
+    """coeffs * secret mod (x^n + 1, modulus), for a small-coefficient secret."""
+    degree = len(coeffs)
+    coeffs = coeffs.astype(object)
+    product = np.zeros(degree, dtype=object)
+    num_limbs = -(-max(int(modulus - 1).bit_length(), 1) // _LIMB_BITS)
+    for l in range(num_limbs):
+        limb = ((coeffs >> (_LIMB_BITS * l)) & ((1 << _LIMB_BITS) - 1)).astype(np.int64)
+        full = np.convolve(limb, secret)
+        wrapped = full[:degree].copy()
+        wrapped[:degree - 1] -= full[degree:]  # x^n = -1
+        product += wrapped.astype(object) << (_LIMB_BITS * l)
+    return product % modulus
+
+
+def measure(array, secret, plain_modulus, ciph_modulus):
+    """
+    Decrypt a (count, 2, degree) array without decoding.
+
+    Returns:
+        (plaintext coefficients, noise) as (count, degree) object arrays. The
+        noise is t * phase - q * round(t * phase / q); a ciphertext decrypts
+        correctly while every |noise| < q / 2.
+    """
+    t, q = int(plain_modulus), int(ciph_modulus)
+    phase = np.array([
+        (row[0].astype(object) + _negacyclic_multiply(row[1], secret, q)) % q for row in array
+    ], dtype=object)
+    rounded = (2 * t * phase + q) // (2 * q)
+    return rounded % t, t * phase - q * rounded
+
+
+def compact_accumulator(params, secret_key_json, array, margin_bits=NOISE_MARGIN_BITS):
+    """
+    Switch a sum to the smallest power-of-two modulus that decrypts it unchanged.
+
+    Args:
+        params: (poly_degree, plain_modulus, ciph_modulus) tuple the sum is under
+        secret_key_json: Serialized secret key ({'ring_degree', 'coeffs'})
+        array: (ciphertexts, 2, degree) coefficient array
+        margin_bits: Noise headroom required below the decryption limit
+
+    Returns:
+        (ciph_modulus, array), or None if no smaller modulus of at most 64 bits works
+    """
+    _, plain_modulus, ciph_modulus = params
+    ciph_modulus = int(ciph_modulus)
+    with secret_keys.acquire(params, secret_key_json) as key:
+        return _compact(array, key.secret_coeffs, plain_modulus, ciph_modulus, margin_bits)
+
+
+def _compact(array, secret, plain_modulus, ciph_modulus, margin_bits):
+    expected, _ = measure(array, secret, plain_modulus, ciph_modulus)
+
+    def switched_if_exact(bits):
+        modulus = 1 << bits
+        switched = switch_modulus(array, ciph_modulus, modulus)
+        decrypted, noise = measure(switched, secret, plain_modulus, modulus)
+        if np.array_equal(decrypted, expected) and max(abs(int(v)) for v in noise.flat) << (margin_bits + 1) < modulus:
+            return switched
+        return None
+
+    # Noise falls as the modulus grows, so the smallest exact bit length is found by bisection
+    low, high = int(plain_modulus).bit_length() + 1, min((ciph_modulus - 1).bit_length() - 1, 64)
+    best = None
+    while low <= high:
+        bits = (low + high) // 2
+        switched = switched_if_exact(bits)
+        if switched is None:
+            low = bits + 1
+        else:
+            best = (1 << bits, switched)
+            high = bits - 1
+    return best
+
+
+def finalize_questionnaire(session, questionnaire):
+    """
+    Store a questionnaire's sum in its finalized form; the caller commits.
+
+    Returns:
+        (bytes before, bytes after), or None if there is nothing to finalize
+    """
+    if questionnaire.final_accumulator_blob is not None:
+        return None
+    max_log_id = last_log_id(session, questionnaire.id)
+    total = load_accumulated_array(session, questionnaire)
+    if total is None:
+        return None
+    final = compact_accumulator(params_of(questionnaire), questionnaire.secret_key_json, total)
+    if final is None:
+        return None
+    store_final_array(session, questionnaire, *final, max_log_id)
+    return len(pack_ciphertext_array(total)), len(questionnaire.final_accumulator_blob)
+
+
+def finalize_all(link=None):
+    """Finalize every questionnaire with final results (or just link) whose sum is not finalized yet."""
+    session = get_session()
+
+    try:
+        query = session.query(Questionnaire).filter(
+            Questionnaire.is_decrypted == 1,
+            Questionnaire.final_accumulator_blob.is_(None),
+            Questionnaire.num_responses > 0
+        )
+        if link:
+            query = query.filter(Questionnaire.link == link)
+        links = [q.link for q in query.with_entities(Questionnaire.link)]
+
+        if not links:
+            print("No questionnaires to finalize.")
+            return
+
+        before_total = after_total = 0
+        for questionnaire_link in links:
+            questionnaire = session.query(Questionnaire).filter_by(link=questionnaire_link).first()
+            sizes = finalize_questionnaire(session, questionnaire)
+            session.commit()
+            if sizes is None:
+                continue
+            before, after = sizes
+            before_total += before
+            after_total += after
+            bits = (int(questionnaire.final_ciph_modulus) - 1).bit_length()
+            print(f"✓ {questionnaire_link}: {before} -> {after} bytes ({bits}-bit modulus)")
+
+        print("=" * 60)
+        print(f"Finalized {len(links)} questionnaires: {before_total} -> {after_total} bytes")
+
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error finalizing: {e}")
+        import traceback
+        traceback.print_exc()
+
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Modulus-switch the sums of closed questionnaires to compact storage')
+    parser.add_argument('--link', type=str, help='Questionnaire link/ID to finalize')
+    parser.add_argument('--all', action='store_true', help='Finalize every questionnaire with final results')
+
+    args = parser.parse_args()
+
+    # Initialize database
+    init_db()
+
+    if args.link or args.all:
+        finalize_all(args.link)
+    else:
+        print("Usage:")
+        print("  python modulus_switching.py --all                    # Finalize every closed questionnaire")
+        print("  python modulus_switching.py --link <questionnaire_link>  # Finalize one")
@@ -0,0 +1,49 @@
+"""
+In-process LRU cache of serialized JSON response bodies.
+
+Each entry belongs to one questionnaire link and carries a version key; a
+lookup only hits when the caller's current key matches the stored one, so
+stale bodies are never served and simply get replaced. Bodies that never
+change are stored under the default key None.
+"""
+
+import threading
+from collections import OrderedDict
+
+# Questionnaires whose response bodies are kept at once
+RESPONSE_CACHE_SIZE = 256
+
+
+class ResponseCache:
+    """Thread-safe LRU map of link -> (version key, serialized body)."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, link, key=None):
+        """Return the cached body for link if it was stored under key, else None."""
+        with self._lock:
+            entry = self._entries.get(link)
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(link)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, link, key, body):
+        """Store body for link under key, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[link] = (key, body)
+            self._entries.move_to_end(link)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, link):
+        """Drop the cached body for link, if any."""
+        with self._lock:
+            self._entries.pop(link, None)
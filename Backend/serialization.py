@@ -0,0 +1,255 @@
+"""
+Serialization helpers for BFV polynomials and ciphertexts.
+Shared by the API and the accumulation buffer.
+
+Ciphertexts travel either as JSON (nested dicts of coefficient lists) or in
+a compact binary ballot format (see encode_ballot/decode_ballot), and are
+stored as NumPy coefficient arrays (see ciphertext_arrays). A public key's
+uniformly random half may travel as a seed instead (see expand_seed).
+"""
+
+import functools
+import hashlib
+import struct
+import zlib
+
+import numpy as np
+
+from ciphertext_arrays import coefficient_dtype
+from util.ciphertext import Ciphertext
+from util.polynomial import Polynomial
+from util.public_key import PublicKey
+
+# Seed-compressed polynomials
+#
+# A uniformly random polynomial mod ciph_modulus (the public key's p1) can be
+# stored and sent as a SEED_BYTES seed, {'ring_degree': n, 'seed': hex}. The
+# seed is expanded with SHA-256 in counter mode: block i is
+# SHA-256(SEED_DOMAIN || seed || i as u32 little-endian), read as one byte
+# stream. Each coefficient takes the next byte length of (ciph_modulus - 1)
+# bytes, little-endian, masked to the bit length of ciph_modulus - 1, and is
+# drawn again if it is not below ciph_modulus. Mirrored by expandSeed in
+# Frontend/src/crypto.js.
+SEED_DOMAIN = b'bfv-seeded-poly-v1'
+SEED_BYTES = 32
+
+# Expanded seeds kept at once
+EXPANDED_SEED_CACHE_SIZE = 64
+
+
+@functools.lru_cache(maxsize=EXPANDED_SEED_CACHE_SIZE)
+def expand_seed(seed, degree, modulus):
+    """
+    Expand a hex seed into degree coefficients uniform in [0, modulus).
+
+    Returns:
+        tuple of ints (cached, so expansion runs once per seed)
+    """
+    seed_bytes = bytes.fromhex(seed)
+    bits = (modulus - 1).bit_length()
+    width = (bits + 7) // 8
+    mask = (1 << bits) - 1
+    coeffs = []
+    stream = b''
+    offset = 0
+    counter = 0
+    while len(coeffs) < degree:
+        if len(stream) - offset < width:
+            block = hashlib.sha256(SEED_DOMAIN + seed_bytes + struct.pack('<I', counter)).digest()
+            stream = stream[offset:] + block
+            offset = 0
+            counter += 1
+            continue
+        value = int.from_bytes(stream[offset:offset + width], 'little') & mask
+        offset += width
+        if value < modulus:
+            coeffs.append(value)
+    return tuple(coeffs)
+
+
+def serialize_seeded_polynomial(seed, ring_degree):
+    """Serialize a polynomial given by its seed (see expand_seed)."""
+    return {
+        'ring_degree': ring_degree,
+        'seed': seed
+    }
+
+
+def serialize_polynomial(poly):
+    """Serialize a Polynomial object to JSON."""
+    return {
+        'ring_degree': poly.ring_degree,
+        'coeffs': poly.coeffs
+    }
+
+
+def deserialize_polynomial(data, modulus=None):
+    """
+    Deserialize a Polynomial from JSON.
+
+    Args:
+        data: {'ring_degree', 'coeffs'}, or {'ring_degree', 'seed'} for a seeded polynomial
+        modulus: Coefficient modulus, needed to expand a seed
+    """
+    # Support both camelCase (from JS) and snake_case
+    ring_degree = data.get('ring_degree') or data.get('ringDegree')
+    if 'seed' in data:
+        if modulus is None:
+            raise ValueError('A seeded polynomial needs its modulus to be expanded')
+        return Polynomial(ring_degree, list(expand_seed(data['seed'], ring_degree, int(modulus))))
+    return Polynomial(ring_degree, data['coeffs'])
+
+
+def deserialize_public_key(data, ciph_modulus):
+    """Deserialize a PublicKey from JSON, expanding a seeded p1."""
+    return PublicKey(deserialize_polynomial(data['p0'], ciph_modulus),
+                     deserialize_polynomial(data['p1'], ciph_modulus))
+
+
+def serialize_ciphertext(ciph):
+    """Serialize a Ciphertext object to JSON."""
+    return {
+        'c0': serialize_polynomial(ciph.c0),
+        'c1': serialize_polynomial(ciph.c1),
+        'scaling_factor': ciph.scaling_factor,
+        'modulus': ciph.modulus
+    }
+
+
+def deserialize_ciphertext(data):
+    """Deserialize a Ciphertext from JSON."""
+    c0 = deserialize_polynomial(data['c0'])
+    c1 = deserialize_polynomial(data['c1'])
+    # Support both camelCase and snake_case
+    scaling_factor = data.get('scaling_factor') or data.get('scalingFactor')
+    return Ciphertext(c0, c1, scaling_factor, data.get('modulus'))
+
+
+# Binary ballot format
+#
+# All integers are little-endian:
+#   magic      4 bytes   b'BFVB'
+#   version    u8        BALLOT_FORMAT_VERSION
+#   width      u8        bytes per coefficient (byte length of ciph_modulus - 1)
+#   count      u16       number of ciphertexts
+#   degree     u32       polynomial ring degree
+#   params_id  u32       CRC-32 of 'poly_degree:plain_modulus:ciph_modulus'
+#   link_len   u16       length of the questionnaire link
+#   link       link_len  UTF-8 questionnaire link
+#   body       count * 2 * degree coefficients of width bytes: c0 then c1 per ciphertext
+BALLOT_MIME_TYPE = 'application/x-bfv-ballot'
+BALLOT_MAGIC = b'BFVB'
+BALLOT_FORMAT_VERSION = 1
+_BALLOT_HEADER = struct.Struct('<4sBBHIIH')
+
+
+def params_id(poly_degree, plain_modulus, ciph_modulus):
+    """Short identifier of a BFV parameter set, carried in binary ballots."""
+    return zlib.crc32(f'{poly_degree}:{plain_modulus}:{ciph_modulus}'.encode())
+
+
+def coefficient_width(ciph_modulus):
+    """Number of bytes needed for one coefficient reduced mod ciph_modulus."""
+    return max(1, ((int(ciph_modulus) - 1).bit_length() + 7) // 8)
+
+
+def _pack_coeffs(coeffs, width):
+    if width <= 8:
+        # Pack as u64 and keep the low `width` bytes of each coefficient
+        packed = struct.pack(f'<{len(coeffs)}Q', *coeffs)
+        if width == 8:
+            return packed
+        out = bytearray(len(coeffs) * width)
+        for k in range(width):
+            out[k::width] = packed[k::8]
+        return bytes(out)
+    return b''.join(c.to_bytes(width, 'little') for c in coeffs)
+
+
+def _unpack_coeffs(view, offset, count, width):
+    end = offset + count * width
+    if width <= 8:
+        # Widen each coefficient to u64 with strided copies, then unpack in one call
+        padded = bytearray(count * 8)
+        for k in range(width):
+            padded[k::8] = view[offset + k:end:width]
+        return list(struct.unpack(f'<{count}Q', padded))
+    return [int.from_bytes(view[i:i + width], 'little') for i in range(offset, end, width)]
+
+
+def encode_ballot(link, params, ciphertexts):
+    """
+    Encode a ballot in the binary wire format.
+    
+    Args:
+        link: Questionnaire link
+        params: (poly_degree, plain_modulus, ciph_modulus) tuple
+        ciphertexts: List of Ciphertext, laid out as in slot_packing
+    
+    Returns:
+        bytes
+    """
+    poly_degree, plain_modulus, ciph_modulus = params
+    width = coefficient_width(ciph_modulus)
+    link_bytes = link.encode('utf-8')
+    header = _BALLOT_HEADER.pack(
+        BALLOT_MAGIC, BALLOT_FORMAT_VERSION, width, len(ciphertexts), poly_degree,
+        params_id(poly_degree, plain_modulus, ciph_modulus), len(link_bytes)
+    )
+    coeffs = [c % ciph_modulus for ciph in ciphertexts for poly in (ciph.c0, ciph.c1) for c in poly.coeffs]
+    return header + link_bytes + _pack_coeffs(coeffs, width)
+
+
+def decode_ballot(data):
+    """
+    Decode a ballot in the binary wire format.
+    
+    Args:
+        data: bytes
+    
+    Returns:
+        (link, params_id, ciphertexts) tuple
+    
+    Raises:
+        ValueError: If the data is not a well-formed ballot
+    """
+    view = memoryview(data)
+    if len(view) < _BALLOT_HEADER.size:
+        raise ValueError('Ballot too short')
+    magic, version, width, count, degree, pid, link_len = _BALLOT_HEADER.unpack_from(view)
+    if magic != BALLOT_MAGIC:
+        raise ValueError('Not a binary ballot')
+    if version != BALLOT_FORMAT_VERSION:
+        raise ValueError(f'Unsupported ballot format version {version}')
+    if width == 0 or degree == 0:
+        raise ValueError('Invalid coefficient width or degree')
+    
+    offset = _BALLOT_HEADER.size
+    expected = offset + link_len + count * 2 * degree * width
+    if len(view) != expected:
+        raise ValueError(f'Ballot length {len(view)} does not match header (expected {expected})')
+    
+    link = bytes(view[offset:offset + link_len]).decode('utf-8')
+    offset += link_len
+    
+    coeffs = _unpack_coeffs(view, offset, count * 2 * degree, width)
+    ciphertexts = []
+    for i in range(0, len(coeffs), 2 * degree):
+        c0 = Polynomial(degree, coeffs[i:i + degree])
+        c1 = Polynomial(degree, coeffs[i + degree:i + 2 * degree])
+        ciphertexts.append(Ciphertext(c0, c1))
+    return link, pid, ciphertexts
+
+
+def ciphertexts_to_array(ciphertexts, ciph_modulus):
+    """Stack ciphertexts into a (count, 2, degree) coefficient array reduced mod ciph_modulus."""
+    ciph_modulus = int(ciph_modulus)
+    rows = [[[c % ciph_modulus for c in ciph.c0.coeffs], [c % ciph_modulus for c in ciph.c1.coeffs]]
+            for ciph in ciphertexts]
+    return np.array(rows, dtype=coefficient_dtype(ciph_modulus))
+
+
+def array_to_ciphertexts(array):
+    """Split a (count, 2, degree) coefficient array back into Ciphertext objects."""
+    degree = array.shape[2]
+    return [Ciphertext(Polynomial(degree, row[0]), Polynomial(degree, row[1])) for row in array.tolist()]
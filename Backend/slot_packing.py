@@ -0,0 +1,107 @@
+"""
+Slot packing: several questions per ciphertext.
+
+Every question is a one-hot vote over OPTIONS_PER_QUESTION options. The batch
+encoder has poly_degree slots, so one ciphertext can carry
+poly_degree // OPTIONS_PER_QUESTION questions. Question i is encoded in
+ciphertext i // questions_per_ciphertext, in the OPTIONS_PER_QUESTION slots
+starting at (i % questions_per_ciphertext) * OPTIONS_PER_QUESTION.
+
+With questions_per_ciphertext = 1 and poly_degree = 8 this is the original
+one-ciphertext-per-question layout.
+"""
+
+OPTIONS_PER_QUESTION = 8
+
+# Ring degree -> plain modulus. Each plain modulus is a prime congruent to
+# 1 mod 2 * degree, as the batch encoder requires.
+PLAIN_MODULI = {
+    8: 17,
+    16: 97,
+    32: 193,
+    64: 257,
+    128: 257,
+    256: 7681,
+    512: 12289,
+    1024: 12289,
+    2048: 12289,
+}
+MAX_PACKED_DEGREE = 2048
+
+# The frontend encrypts with plain JavaScript numbers, so every intermediate
+# sum in its polynomial multiply (up to degree * ciph_modulus) must stay exact
+JS_SAFE_BOUND = 1 << 53
+CIPH_MODULI = [8000000000000, 2000000000000]
+
+
+def ciph_modulus_for(degree):
+    """Largest supported cipher modulus that keeps degree * ciph_modulus below 2^53."""
+    for ciph_modulus in CIPH_MODULI:
+        if degree * ciph_modulus < JS_SAFE_BOUND:
+            return ciph_modulus
+    raise ValueError(f'No cipher modulus is exact in JavaScript for degree {degree}')
+
+
+def choose_parameters(num_questions, packed=True):
+    """
+    Pick BFV parameters and a slot layout for a questionnaire.
+
+    Packed questionnaires use the smallest degree that fits every question in
+    one ciphertext, up to MAX_PACKED_DEGREE; longer questionnaires use several
+    ciphertexts of that degree.
+
+    Args:
+        num_questions: Number of questions
+        packed: Pack several questions per ciphertext (default: True)
+
+    Returns:
+        (poly_degree, plain_modulus, ciph_modulus, questions_per_ciphertext) tuple
+    """
+    degree = OPTIONS_PER_QUESTION
+    if packed:
+        while degree < num_questions * OPTIONS_PER_QUESTION and degree < MAX_PACKED_DEGREE:
+            degree *= 2
+    return degree, PLAIN_MODULI[degree], ciph_modulus_for(degree), degree // OPTIONS_PER_QUESTION
+
+
+def num_ciphertexts(num_questions, questions_per_ciphertext):
+    """Number of ciphertexts in a ballot."""
+    return -(-num_questions // questions_per_ciphertext)
+
+
+def pack_answers(answers, poly_degree, questions_per_ciphertext):
+    """
+    Lay out one-hot answers in slot vectors, one per ciphertext.
+
+    Args:
+        answers: Chosen option index for each question
+        poly_degree: Number of slots per ciphertext
+        questions_per_ciphertext: Questions packed into each ciphertext
+
+    Returns:
+        List of slot vectors ready for BatchEncoder.encode
+    """
+    vectors = [[0] * poly_degree for _ in range(num_ciphertexts(len(answers), questions_per_ciphertext))]
+    for i, option in enumerate(answers):
+        slot = (i % questions_per_ciphertext) * OPTIONS_PER_QUESTION + option
+        vectors[i // questions_per_ciphertext][slot] = 1
+    return vectors
+
+
+def unpack_slots(decoded, num_questions, questions_per_ciphertext):
+    """
+    Split decoded slot vectors back into per-question option counts.
+
+    Args:
+        decoded: Decoded slot vector of each ciphertext
+        num_questions: Number of questions
+        questions_per_ciphertext: Questions packed into each ciphertext
+
+    Returns:
+        List with OPTIONS_PER_QUESTION counts per question
+    """
+    counts = []
+    for i in range(num_questions):
+        start = (i % questions_per_ciphertext) * OPTIONS_PER_QUESTION
+        counts.append(list(decoded[i // questions_per_ciphertext][start:start + OPTIONS_PER_QUESTION]))
+    return counts
@@ -0,0 +1,156 @@
+"""
+In-memory Bloom filters of the certificate fingerprints that have submitted.
+
+Before accepting a ballot the API must know whether its fingerprint has
+already voted. Most submitters are voting for the first time. A
+per-questionnaire Bloom filter answers "certainly not" for almost all of them
+without touching the database. Only a "maybe" (an earlier vote or a false
+positive, about FALSE_POSITIVE_RATE of first-time voters) goes on to the
+SubmissionRecord lookup.
+
+The filter is only a shortcut. The unique (questionnaire_id, cert_fingerprint)
+index on submission_records is what actually rejects duplicates. A
+questionnaire the filter has not been told about (e.g. one created by another
+process) always answers "maybe". Fingerprints written by another process are
+not added here; the index still rejects them when their ballots are flushed.
+
+Filters are scalable: when one fills up to its capacity, a new slice with
+twice the capacity is added, so nothing has to be re-read from the database.
+warm() fills them at startup from the questionnaires still taking ballots.
+"""
+
+import hashlib
+import math
+import threading
+
+from sqlalchemy import or_
+
+from models import get_session_factory, Questionnaire, SubmissionRecord
+
+# Target false-positive rate of each filter slice
+FALSE_POSITIVE_RATE = 0.01
+
+# Fingerprints the first slice of a new questionnaire's filter holds
+INITIAL_CAPACITY = 1024
+
+# Rows fetched per round trip while warming
+WARM_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter over strings, using double hashing."""
+
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SubmissionFilter:
+    """
+    Scalable Bloom filter per questionnaire id, safe to share between threads.
+
+    might_contain(questionnaire_id, fingerprint) is False only when the
+    fingerprint has certainly not submitted through this process since the
+    questionnaire was tracked.
+    """
+
+    def __init__(self, initial_capacity=INITIAL_CAPACITY, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.initial_capacity = initial_capacity
+        self.false_positive_rate = false_positive_rate
+        self._lock = threading.Lock()
+        self._filters = {}  # questionnaire id -> [BloomFilter], each twice the capacity of the last
+        self._stats = {'checks': 0, 'skipped': 0}
+
+    def track(self, questionnaire_id, expected=0):
+        """Start an empty filter for a questionnaire with no submissions yet."""
+        with self._lock:
+            if questionnaire_id not in self._filters:
+                capacity = max(self.initial_capacity, expected)
+                self._filters[questionnaire_id] = [BloomFilter(capacity, self.false_positive_rate)]
+
+    def add(self, questionnaire_id, fingerprints):
+        """Record fingerprints whose submissions were written; untracked questionnaires are ignored."""
+        with self._lock:
+            slices = self._filters.get(questionnaire_id)
+            if slices is not None:
+                self._add_to(slices, fingerprints)
+
+    def _add_to(self, slices, fingerprints):
+        for fingerprint in fingerprints:
+            if slices[-1].count >= slices[-1].capacity:
+                slices.append(BloomFilter(slices[-1].capacity * 2, self.false_positive_rate))
+            slices[-1].add(fingerprint)
+
+    def might_contain(self, questionnaire_id, fingerprint):
+        """False if the fingerprint certainly has no SubmissionRecord for the questionnaire."""
+        with self._lock:
+            self._stats['checks'] += 1
+            slices = self._filters.get(questionnaire_id)
+            if slices is None or any(fingerprint in bloom for bloom in slices):
+                return True
+            self._stats['skipped'] += 1
+            return False
+
+    def warm(self, db_url):
+        """
+        Fill the filters of every questionnaire that has not been finally decrypted.
+
+        Filters are built aside and installed complete, so a questionnaire
+        answers "maybe" until its filter holds every recorded fingerprint.
+
+        Returns:
+            int: Fingerprints loaded
+        """
+        still_open = or_(Questionnaire.is_decrypted.is_(None), Questionnaire.is_decrypted == 0)
+        session = get_session_factory(db_url).session_factory()
+        try:
+            warmed = {
+                questionnaire_id: [BloomFilter(max(self.initial_capacity, 2 * (num_responses or 0)),
+                                               self.false_positive_rate)]
+                for questionnaire_id, num_responses in session.query(
+                    Questionnaire.id, Questionnaire.num_responses
+                ).filter(still_open)
+            }
+
+            loaded = 0
+            rows = session.query(SubmissionRecord.questionnaire_id, SubmissionRecord.cert_fingerprint).join(
+                Questionnaire, Questionnaire.id == SubmissionRecord.questionnaire_id
+            ).filter(still_open).yield_per(WARM_BATCH_SIZE)
+            for questionnaire_id, fingerprint in rows:
+                if questionnaire_id in warmed:
+                    self._add_to(warmed[questionnaire_id], [fingerprint])
+                    loaded += 1
+        finally:
+            session.close()
+
+        with self._lock:
+            for questionnaire_id, slices in warmed.items():
+                self._filters.setdefault(questionnaire_id, slices)
+        return loaded
+
+    def stats(self):
+        """Tracked questionnaires, fingerprints held, and how many checks skipped the database."""
+        with self._lock:
+            return dict(
+                self._stats,
+                questionnaires=len(self._filters),
+                fingerprints=sum(bloom.count for slices in self._filters.values() for bloom in slices),
+                bytes=sum(len(bloom.bits) for slices in self._filters.values() for bloom in slices)
+            )
@@ -10,24 +10,10 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'py-fhe'))
 
 from models import init_db, get_session, Questionnaire
-from bfv.bfv_decryptor import BFVDecryptor
-from bfv.bfv_parameters import BFVParameters
-from bfv.batch_encoder import BatchEncoder
-from util.ciphertext import Ciphertext
-from util.polynomial import Polynomial
-from util.secret_key import SecretKey
-
-
-def deserialize_polynomial(data):
-    """Deserialize a Polynomial from JSON."""
-    return Polynomial(data['ring_degree'], data['coeffs'])
-
-
-def deserialize_ciphertext(data):
-    """Deserialize a Ciphertext from JSON."""
-    c0 = deserialize_polynomial(data['c0'])
-    c1 = deserialize_polynomial(data['c1'])
-    return Ciphertext(c0, c1, data.get('scaling_factor'), data.get('modulus'))
+from accumulator import load_decryptable_array
+from serialization import array_to_ciphertexts
+from slot_packing import unpack_slots
+from crypto_context import secret_keys
 
 
 def view_results(link):
@@ -61,45 +47,37 @@ def view_results(link):
             print("⚠️  No responses yet!")
             return
         
-        # Get parameters
-        params = BFVParameters(
-            poly_degree=questionnaire.poly_degree,
-            plain_modulus=questionnaire.plain_modulus,
-            ciph_modulus=int(questionnaire.ciph_modulus)
-        )
-        
-        # Reconstruct secret key
-        secret_key_data = questionnaire.get_secret_key()
-        secret_key_poly = Polynomial(secret_key_data['ring_degree'], secret_key_data['coeffs'])
-        secret_key = SecretKey(secret_key_poly)
-        
-        # Create decryptor and encoder
-        decryptor = BFVDecryptor(params, secret_key)
-        encoder = BatchEncoder(params)
-        
-        # Get accumulated responses
-        accumulated = questionnaire.get_accumulated_responses()
+        # Get accumulated responses (sum of all shards, or the compact finalized sum)
+        decryptable = load_decryptable_array(session, questionnaire)
         questions = questionnaire.get_questions()
         
-        if not accumulated:
+        if decryptable is None:
             print("⚠️  No accumulated responses found!")
             return
+        params, accumulated_array = decryptable
+        accumulated = array_to_ciphertexts(accumulated_array)
+        if questionnaire.final_accumulator_blob:
+            print(f"Finalized sum: {len(questionnaire.final_accumulator_blob)} bytes, "
+                  f"{(params[2] - 1).bit_length()}-bit modulus")
+        
+        # Decrypt every ciphertext with this questionnaire's key under the
+        # shared parameters and encoder for the modulus the sum is stored under
+        with secret_keys.acquire(params, questionnaire.secret_key_json) as key:
+            decoded_ciphertexts = key.decode_all(accumulated)
         
         print("=" * 80)
         print("RESULTS (Decrypted Accumulated Votes)")
         print("=" * 80)
         print()
         
-        # Decrypt and display each question's results
-        for i, (question, ciph_data) in enumerate(zip(questions, accumulated)):
+        # Split the decrypted slots into questions
+        question_votes = unpack_slots(decoded_ciphertexts, len(questions), questionnaire.questions_per_ciphertext or 1)
+        
+        # Display each question's results
+        for i, (question, decoded) in enumerate(zip(questions, question_votes)):
             print(f"Question {i + 1}: {question['text']}")
             print("-" * 80)
             
-            # Deserialize and decrypt
-            ciphertext = deserialize_ciphertext(ciph_data)
-            plaintext = decryptor.decrypt(ciphertext)
-            decoded = encoder.decode(plaintext)
-            
             # Display results for each option
             num_options = len(question['options'])
             for j in range(num_options):
@@ -152,7 +130,7 @@ def list_questionnaires():
             print(f"  Created: {q.created_at}")
             print(f"  Deadline: {q.deadline}")
             print(f"  Responses: {q.num_responses}")
-            print(f"  Questions: {len(q.get_questions())}")
+            print(f"  Questions: {q.num_questions}")
         
         print("\n" + "=" * 80)
         
@@ -190,6 +190,72 @@ class Ciphertext {
     }
 }
 
+// Seed-compressed polynomials, mirrored by expand_seed in serialization.py on the
+// backend. Block i is SHA-256('bfv-seeded-poly-v1' || seed || i as u32 little-endian),
+// read as one byte stream; each coefficient takes the next byte length of
+// (modulus - 1) bytes, little-endian, masked to the bit length of modulus - 1,
+// and is drawn again if it is not below modulus.
+const SEED_DOMAIN = new TextEncoder().encode('bfv-seeded-poly-v1');
+const EXPANDED_SEED_CACHE_SIZE = 16;
+const expandedSeeds = new Map();
+
+async function expandSeedUncached(seed, degree, modulus) {
+    const seedBytes = Uint8Array.from(seed.match(/../g), (h) => parseInt(h, 16));
+    let bits = 0;
+    for (let v = modulus - 1; v > 0; v = Math.floor(v / 2)) bits++;
+    const width = Math.ceil(bits / 8);
+    const topMask = (1 << (bits - 8 * (width - 1))) - 1;
+    const coeffs = [];
+    let stream = new Uint8Array(0);
+    let offset = 0;
+    let counter = 0;
+    while (coeffs.length < degree) {
+        if (stream.length - offset < width) {
+            // Hash the blocks this expansion will likely need in one batch
+            const numBlocks = Math.ceil(((degree - coeffs.length) * width * 2) / 32);
+            const blocks = await Promise.all(Array.from({ length: numBlocks }, (_, i) => {
+                const input = new Uint8Array(SEED_DOMAIN.length + seedBytes.length + 4);
+                input.set(SEED_DOMAIN);
+                input.set(seedBytes, SEED_DOMAIN.length);
+                new DataView(input.buffer).setUint32(input.length - 4, counter + i, true);
+                return crypto.subtle.digest('SHA-256', input);
+            }));
+            const next = new Uint8Array(stream.length - offset + numBlocks * 32);
+            next.set(stream.subarray(offset));
+            blocks.forEach((block, i) => next.set(new Uint8Array(block), stream.length - offset + i * 32));
+            stream = next;
+            offset = 0;
+            counter += numBlocks;
+            continue;
+        }
+        let value = stream[offset + width - 1] & topMask;
+        for (let k = width - 2; k >= 0; k--) value = value * 256 + stream[offset + k];
+        offset += width;
+        if (value < modulus) coeffs.push(value);
+    }
+    return coeffs;
+}
+
+// Expansions are cached, so each questionnaire's key is expanded once per page load
+function expandSeed(seed, degree, modulus) {
+    const key = `${seed}:${degree}:${modulus}`;
+    if (!expandedSeeds.has(key)) {
+        if (expandedSeeds.size >= EXPANDED_SEED_CACHE_SIZE) {
+            expandedSeeds.delete(expandedSeeds.keys().next().value);
+        }
+        const expansion = expandSeedUncached(seed, degree, modulus);
+        expansion.catch(() => expandedSeeds.delete(key));
+        expandedSeeds.set(key, expansion);
+    }
+    return expandedSeeds.get(key);
+}
+
+async function loadPolynomial(json, modulus) {
+    const degree = json.ringDegree || json.ring_degree;
+    const coeffs = json.seed !== undefined ? await expandSeed(json.seed, degree, modulus) : json.coeffs;
+    return new Polynomial(degree, coeffs);
+}
+
 class PublicKey {
     constructor(p0, p1) { this.p0 = p0; this.p1 = p1; }
     static fromJSON(json) {
@@ -197,6 +263,11 @@ class PublicKey {
         const p1 = new Polynomial(json.p1.ringDegree || json.p1.ring_degree, json.p1.coeffs);
         return new PublicKey(p0, p1);
     }
+    // Like fromJSON, but also accepts a seeded p1
+    static async load(json, ciphModulus) {
+        const [p0, p1] = await Promise.all([loadPolynomial(json.p0, ciphModulus), loadPolynomial(json.p1, ciphModulus)]);
+        return new PublicKey(p0, p1);
+    }
 }
 
 class BatchEncoder {
@@ -229,4 +300,85 @@ class BFVEncryptor {
     }
 }
 
-export { PublicKey, BatchEncoder, BFVEncryptor };
+// Slot packing, mirrored by slot_packing.py on the backend: question i goes in
+// ciphertext floor(i / questionsPerCiphertext), in the 8 slots starting at
+// (i % questionsPerCiphertext) * 8.
+const OPTIONS_PER_QUESTION = 8;
+
+function packAnswers(answers, polyDegree, questionsPerCiphertext = 1) {
+    const numCiphertexts = Math.ceil(answers.length / questionsPerCiphertext);
+    const vectors = Array.from({ length: numCiphertexts }, () => new Array(polyDegree).fill(0));
+    answers.forEach((option, i) => {
+        const slot = (i % questionsPerCiphertext) * OPTIONS_PER_QUESTION + option;
+        vectors[Math.floor(i / questionsPerCiphertext)][slot] = 1;
+    });
+    return vectors;
+}
+
+// Binary ballot format, mirrored by serialization.py on the backend.
+// Little-endian: magic 'BFVB', version u8, coefficient width u8, ciphertext count u16,
+// degree u32, params id u32 (CRC-32 of 'degree:plain:ciph'), link length u16, link (UTF-8),
+// then c0 and c1 coefficients of every ciphertext, width bytes each.
+const BALLOT_CONTENT_TYPE = 'application/x-bfv-ballot';
+const BALLOT_FORMAT_VERSION = 1;
+const BALLOT_HEADER_SIZE = 18;
+
+const CRC32_TABLE = (() => {
+    const table = new Uint32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+        table[n] = c >>> 0;
+    }
+    return table;
+})();
+
+function crc32(bytes) {
+    let crc = 0xFFFFFFFF;
+    for (let i = 0; i < bytes.length; i++) crc = CRC32_TABLE[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+    return (crc ^ 0xFFFFFFFF) >>> 0;
+}
+
+function paramsId(params) {
+    return crc32(new TextEncoder().encode(`${params.polyDegree}:${params.plainModulus}:${params.ciphModulus}`));
+}
+
+function coefficientWidth(ciphModulus) {
+    let width = 0;
+    for (let v = ciphModulus - 1; v > 0; v = Math.floor(v / 256)) width++;
+    return Math.max(width, 1);
+}
+
+function encodeBallot(link, params, ciphertexts) {
+    const width = coefficientWidth(params.ciphModulus);
+    const degree = params.polyDegree;
+    const linkBytes = new TextEncoder().encode(link);
+    const buffer = new Uint8Array(BALLOT_HEADER_SIZE + linkBytes.length + ciphertexts.length * 2 * degree * width);
+    const view = new DataView(buffer.buffer);
+
+    buffer.set([0x42, 0x46, 0x56, 0x42], 0); // 'BFVB'
+    view.setUint8(4, BALLOT_FORMAT_VERSION);
+    view.setUint8(5, width);
+    view.setUint16(6, ciphertexts.length, true);
+    view.setUint32(8, degree, true);
+    view.setUint32(12, paramsId(params), true);
+    view.setUint16(16, linkBytes.length, true);
+    buffer.set(linkBytes, BALLOT_HEADER_SIZE);
+
+    let offset = BALLOT_HEADER_SIZE + linkBytes.length;
+    for (const ciphertext of ciphertexts) {
+        for (const poly of [ciphertext.c0, ciphertext.c1]) {
+            for (const coeff of poly.coeffs) {
+                // Coefficients stay below 2^53, so plain number arithmetic is exact
+                let v = ((coeff % params.ciphModulus) + params.ciphModulus) % params.ciphModulus;
+                for (let k = 0; k < width; k++) {
+                    buffer[offset++] = v % 256;
+                    v = Math.floor(v / 256);
+                }
+            }
+        }
+    }
+    return buffer;
+}
+
+export { PublicKey, BatchEncoder, BFVEncryptor, packAnswers, encodeBallot, expandSeed, BALLOT_CONTENT_TYPE };
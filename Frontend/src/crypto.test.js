@@ -1,4 +1,4 @@
-import {BatchEncoder, BFVEncryptor, PublicKey} from './crypto.js'
+import {BatchEncoder, BFVEncryptor, PublicKey, packAnswers, encodeBallot, expandSeed} from './crypto.js'
 
 const params = {
     polyDegree: 8,
@@ -25,3 +25,25 @@ console.log('plaintext encoded:', plaintext.poly.coeffs.length === 8)
 console.log('ciphertext c0 length:', json.c0.coeffs.length === 8)
 console.log('ciphertext c1 length:', json.c1.coeffs.length === 8)
 
+const ballot = encodeBallot('abc123', params, [ciphertext, ciphertext])
+const ballotView = new DataView(ballot.buffer)
+console.log('ballot magic:', String.fromCharCode(...ballot.slice(0, 4)) === 'BFVB')
+console.log('ballot width:', ballotView.getUint8(5) === 2)
+console.log('ballot length:', ballot.length === 18 + 6 + 2 * 2 * 8 * 2)
+console.log('ballot first coeff:', ballotView.getUint16(24, true) === json.c0.coeffs[0])
+
+const packed = packAnswers([2, 7, 0], 16, 2)
+console.log('packed ciphertexts:', packed.length === 2)
+console.log('packed slots:', packed[0][2] === 1 && packed[0][15] === 1 && packed[1][0] === 1)
+console.log('packed one-hot:', packed.flat().reduce((a, b) => a + b) === 3)
+
+// Vectors from expand_seed in Backend/serialization.py
+const seed = '00'.repeat(31) + '01'
+const expanded = await expandSeed(seed, 8, 12289)
+console.log('seed expansion:', expanded.join() === [2097, 2228, 2943, 843, 12228, 11541, 1599, 2852].join())
+const expandedWide = await expandSeed(seed, 4, 2000000000000)
+console.log('seed expansion wide:', expandedWide.join() === [774305299076, 272413044676, 1319056329508, 800538805072].join())
+console.log('seed expansion cached:', (await expandSeed(seed, 8, 12289)) === expanded)
+
+const seededPk = await PublicKey.load({p0: pkJson.p0, p1: {ring_degree: 8, seed}}, params.ciphModulus)
+console.log('seeded publicKey loaded:', seededPk.p1.coeffs.join() === [14980, 18481, 18612, 19327, 17227, 32243, 12228, 27925].join())
@@ -9,6 +9,7 @@ export default function Create() {
   const [deadline, setDeadline] = useState(localDateStr)
   const [customLink, setCustomLink] = useState('')
   const [hideResultsUntilDeadline, setHideResultsUntilDeadline] = useState(true)
+  const [profile, setProfile] = useState('')
   const [result, setResult] = useState(null)
 
   const addQuestion = () => setQuestions([...questions, { id: Date.now(), text: '', options: ['', '', '', '', 'N/A', 'N/A', 'N/A', 'N/A'] }])
@@ -37,7 +38,8 @@ export default function Create() {
         questions: questions.map(q => ({ text: q.text, options: q.options })),
         deadline_datetime: utcDateStr,
         link: customLink || null,
-        hide_results_until_deadline: hideResultsUntilDeadline
+        hide_results_until_deadline: hideResultsUntilDeadline,
+        profile: profile || null
       })
     })
     setResult(await res.json())
@@ -95,6 +97,16 @@ export default function Create() {
           </div>
         </div>
 
+        <div style={{ marginBottom: '2rem' }}>
+          <label>Encryption Profile</label>
+          <select value={profile} onChange={e => setProfile(e.target.value)}>
+            <option value="">Automatic (sized to the number of questions)</option>
+            <option value="small">Small (degree 8, demo only)</option>
+            <option value="medium">Medium (degree 2048)</option>
+            <option value="large">Large (degree 8192, slower to encrypt)</option>
+          </select>
+        </div>
+
         <div style={{ marginBottom: '2rem' }}>
            <label style={{ display: 'flex', alignItems: 'center', gap: '10px', cursor: 'pointer' }}>
             <input 
@@ -1,12 +1,33 @@
 import { useState, useEffect } from 'react'
 import { Link } from 'react-router-dom'
 
+const PAGE_SIZE = 20
+const FILTERS = [['', 'All'], ['open', 'Active'], ['expired', 'Expired']]
+
 export default function List() {
   const [questionnaires, setQuestionnaires] = useState([])
+  const [status, setStatus] = useState('')
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loading, setLoading] = useState(false)
+
+  const loadPage = (cursor, append) => {
+    const params = new URLSearchParams({ limit: PAGE_SIZE })
+    if (status) params.set('status', status)
+    if (cursor) params.set('cursor', cursor)
+    setLoading(true)
+    return fetch(`/api/questionnaires?${params}`)
+      .then(r => r.json())
+      .then(d => {
+        const page = d.questionnaires || []
+        setQuestionnaires(prev => append ? [...prev, ...page] : page)
+        setNextCursor(d.next_cursor || null)
+      })
+      .finally(() => setLoading(false))
+  }
 
   useEffect(() => {
-    fetch('/api/questionnaires').then(r => r.json()).then(d => setQuestionnaires(d.questionnaires || []))
-  }, [])
+    loadPage(null, false)
+  }, [status])
 
   return (
     <div>
@@ -21,7 +42,19 @@ export default function List() {
         </Link>
       </div>
 
-      {questionnaires.length === 0 ? (
+      <div style={{ display: 'flex', gap: '10px', marginBottom: '1.5rem' }}>
+        {FILTERS.map(([value, label]) => (
+          <button
+            key={value}
+            onClick={() => setStatus(value)}
+            style={status === value ? {} : { background: 'white', color: '#5a67d8', border: '1px solid #e2e8f0' }}
+          >
+            {label}
+          </button>
+        ))}
+      </div>
+
+      {questionnaires.length === 0 && !loading ? (
         <div className="text-center" style={{ padding: '3rem', background: '#f7fafc', borderRadius: '12px' }}>
           <p>No questionnaires found.</p>
           <Link to="/create">Create your first questionnaire</Link>
@@ -59,6 +92,14 @@ export default function List() {
           ))}
         </div>
       )}
+
+      {nextCursor && (
+        <div className="text-center" style={{ marginTop: '1.5rem' }}>
+          <button onClick={() => loadPage(nextCursor, true)} disabled={loading}>
+            {loading ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   )
 }
@@ -1,17 +1,24 @@
 import { useState, useEffect } from 'react'
 import { useParams, Link } from 'react-router-dom'
-import { PublicKey, BatchEncoder, BFVEncryptor } from '../crypto'
+import { PublicKey, BatchEncoder, BFVEncryptor, packAnswers, encodeBallot, BALLOT_CONTENT_TYPE } from '../crypto'
 
 export default function Questionnaire() {
   const { id } = useParams()
   const [data, setData] = useState(null)
+  const [publicKey, setPublicKey] = useState(null)
   const [answers, setAnswers] = useState({})
   const [submitted, setSubmitted] = useState(false)
   const [alreadySubmitted, setAlreadySubmitted] = useState(false)
   const [certInfo, setCertInfo] = useState(null)
 
   useEffect(() => {
-    fetch(`/api/questionnaire/${id}`).then(r => r.json()).then(setData)
+    fetch(`/api/questionnaire/${id}`).then(r => r.json()).then(d => {
+      setData(d)
+      // Content-addressed, so the browser keeps it cached across visits; a seeded
+      // p1 is expanded here, once, rather than on every submit
+      if (d.public_key_url) fetch(d.public_key_url).then(r => r.json())
+        .then(pk => PublicKey.load(pk, d.params.ciph_modulus)).then(setPublicKey)
+    })
     fetch('/api/cert-info').then(r => r.json()).then(setCertInfo)
   }, [id])
 
@@ -27,20 +34,18 @@ export default function Questionnaire() {
 
   const submit = async () => {
     const params = { polyDegree: data.params.poly_degree, plainModulus: data.params.plain_modulus, ciphModulus: data.params.ciph_modulus }
-    const pk = PublicKey.fromJSON(data.public_key)
     const encoder = new BatchEncoder(params)
-    const encryptor = new BFVEncryptor(params, pk)
+    const encryptor = new BFVEncryptor(params, publicKey)
 
-    const encrypted = data.questions.map((_, i) => {
-      const vec = new Array(params.polyDegree).fill(0)
-      vec[answers[i]] = 1
-      return encryptor.encrypt(encoder.encode(vec)).toJSON()
-    })
+    // Several questions can share one ciphertext's slots
+    const choices = data.questions.map((_, i) => answers[i])
+    const encrypted = packAnswers(choices, params.polyDegree, data.params.questions_per_ciphertext || 1)
+      .map(vec => encryptor.encrypt(encoder.encode(vec)))
 
     const res = await fetch('/api/submit-answers', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ questionnaire_id: id, encrypted_answers: encrypted })
+      headers: { 'Content-Type': BALLOT_CONTENT_TYPE },
+      body: encodeBallot(id, params, encrypted)
     })
 
     if (res.status === 409) {
@@ -124,7 +129,7 @@ export default function Questionnaire() {
           <div style={{ marginTop: '2rem', display: 'flex', justifyContent: 'flex-end' }}>
             <button 
               onClick={submit} 
-              disabled={submitted || isExpired || alreadySubmitted || Object.keys(answers).length < data.questions.length}
+              disabled={submitted || isExpired || alreadySubmitted || !publicKey || Object.keys(answers).length < data.questions.length}
               style={{ padding: '1rem 3rem', fontSize: '1.1rem' }}
             >
               {submitted ? '✓ Submitted' : alreadySubmitted ? 'Already Submitted' : 'Submit Answers'}